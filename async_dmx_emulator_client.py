@@ -0,0 +1,215 @@
+#
+# AsyncDMXEmulatorClient - asyncio client for connecting to DMX Emulator
+# Copyright © 2019  Dave Hocker (email: AtHomeX10@gmail.com)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the LICENSE file for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program (the LICENSE file).  If not, see <http://www.gnu.org/licenses/>.
+#
+
+import asyncio
+import socket
+from struct import pack
+
+
+class AsyncDMXEmulatorClient:
+    """
+    Sends data to a DMX Emulator app from an asyncio event loop.
+
+    Uses the same frame format as DMXEmulatorClient. Unlike that class,
+    errors are raised rather than printed. Every send waits on the
+    stream's drain(), so a slow emulator applies back-pressure to the
+    sender instead of frames piling up in memory. If the connection
+    breaks during a send, the client reconnects with exponential backoff
+    and sends the frame again.
+
+    One event loop can drive hundreds of these clients.
+    """
+
+    def __init__(self, num_channels, host="localhost", port=5555, reconnect=True,
+                 backoff_initial=0.1, backoff_max=5.0, max_reconnect_attempts=None):
+        """
+        Create an instance of an asyncio DMX Emulator client
+        :param num_channels: Number of channels in a frame
+        :param host: Emulator host name
+        :param port: Emulator port (one per universe)
+        :param reconnect: Reconnect automatically when the connection breaks
+        :param backoff_initial: Delay before the first reconnect attempt (seconds)
+        :param backoff_max: Longest delay between reconnect attempts (seconds)
+        :param max_reconnect_attempts: Give up after this many failed attempts.
+        None means keep trying.
+        """
+        self._num_channels = num_channels
+        self._host = host
+        self._port = port
+        self._reconnect = reconnect
+        self._backoff_initial = backoff_initial
+        self._backoff_max = backoff_max
+        self._max_reconnect_attempts = max_reconnect_attempts
+        self._reader = None
+        self._writer = None
+        self._closed = True
+
+        # Statistics
+        self.frames_sent = 0
+        self.bytes_sent = 0
+        self.reconnects = 0
+
+    @property
+    def is_open(self):
+        return self._writer is not None
+
+    async def open(self):
+        """
+        Open the connection to the emulator app
+        :return:
+        """
+        self._reader, self._writer = await asyncio.open_connection(self._host, self._port)
+        sock = self._writer.get_extra_info("socket")
+        if sock is not None:
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self._closed = False
+
+    async def close(self):
+        """
+        Close the connection to the emulator app
+        :return:
+        """
+        self._closed = True
+        writer = self._writer
+        self._reader = None
+        self._writer = None
+        if writer is not None:
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except (ConnectionError, OSError):
+                # The connection was already broken
+                pass
+
+    async def send(self, frame):
+        """
+        Send a frame to the emulator app
+        :param frame: A bytes-like object of 1-512 bytes
+        :return: Count of bytes sent
+        """
+        if len(frame) < 1 or len(frame) > 512:
+            raise ValueError("Frame must contain 1-512 channels")
+        return await self._write([pack('!i', len(frame)), frame], 1)
+
+    async def send_many(self, frames):
+        """
+        Send several frames to the emulator app in a single write
+        :param frames: A list of bytes-like objects of 1-512 bytes each
+        :return: Count of bytes sent
+        """
+        blocks = []
+        for frame in frames:
+            if len(frame) < 1 or len(frame) > 512:
+                raise ValueError("Frame must contain 1-512 channels")
+            blocks.append(pack('!i', len(frame)))
+            blocks.append(frame)
+        return await self._write(blocks, len(frames))
+
+    async def stream(self, frames, hz=44.0, stamp=None):
+        """
+        Send frames at a fixed rate. Each frame has an absolute deadline
+        (start + n / hz), so timing errors do not accumulate. A frame
+        that is late is sent immediately and the schedule is kept.
+        :param frames: An iterable or async iterable of frames
+        :param hz: Frames per second
+        :param stamp: Optional callable taking a frame, called when the
+        frame's deadline has passed, right before it is sent. For send
+        timestamps that do not include the wait for the deadline.
+        :return: Count of frames sent
+        """
+        loop = asyncio.get_running_loop()
+        interval = 1.0 / hz
+        start = loop.time()
+        count = 0
+
+        if hasattr(frames, "__aiter__"):
+            async for frame in frames:
+                await self._wait_until(loop, start + count * interval)
+                if stamp is not None:
+                    stamp(frame)
+                await self.send(frame)
+                count += 1
+        else:
+            for frame in frames:
+                await self._wait_until(loop, start + count * interval)
+                if stamp is not None:
+                    stamp(frame)
+                await self.send(frame)
+                count += 1
+        return count
+
+    @staticmethod
+    async def _wait_until(loop, deadline):
+        delay = deadline - loop.time()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    async def _write(self, blocks, frame_count):
+        """
+        Write blocks and wait for the stream to drain, reconnecting if
+        the connection breaks.
+        :param blocks: List of bytes-like objects
+        :param frame_count: Number of frames in blocks
+        :return: Count of bytes sent
+        """
+        size = sum(len(block) for block in blocks)
+        while True:
+            if self._writer is None:
+                if self._closed:
+                    raise ConnectionError("AsyncDMXEmulatorClient: connection is not open")
+                await self._reopen()
+            try:
+                # The emulator never sends anything, so end of file on the
+                # read side means it has closed the connection
+                if self._reader.at_eof() or self._writer.is_closing():
+                    raise ConnectionResetError("AsyncDMXEmulatorClient: connection closed by emulator")
+                self._writer.writelines(blocks)
+                await self._writer.drain()
+                break
+            except (ConnectionError, OSError):
+                if not self._reconnect:
+                    raise
+                self._drop_connection()
+
+        self.frames_sent += frame_count
+        self.bytes_sent += size
+        return size
+
+    def _drop_connection(self):
+        if self._writer is not None:
+            self._writer.close()
+        self._reader = None
+        self._writer = None
+
+    async def _reopen(self):
+        """
+        Reconnect with exponential backoff
+        :return:
+        """
+        delay = self._backoff_initial
+        attempts = 0
+        while True:
+            await asyncio.sleep(delay)
+            try:
+                await self.open()
+                self.reconnects += 1
+                return
+            except (ConnectionError, OSError):
+                attempts += 1
+                if self._max_reconnect_attempts is not None and attempts >= self._max_reconnect_attempts:
+                    raise
+                delay = min(delay * 2.0, self._backoff_max)
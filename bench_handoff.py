@@ -0,0 +1,153 @@
+#
+# Frame handoff contention benchmark - for testing the DMX Emulator frame store
+# Copyright © 2019  Dave Hocker (email: AtHomeX10@gmail.com)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the LICENSE file for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program (the LICENSE file).  If not, see <http://www.gnu.org/licenses/>.
+#
+
+#
+# Compares the locked handoff (every writer takes the universe lock for
+# every frame) with the lock-free handoff (a FrameSlot per writer,
+# collected by the reader once per tick).
+#
+# For each writer count, that many threads write frames into the frame
+# store as fast as they can (or at --rate frames/sec each) while a frame
+# scheduler reads every universe once per tick, as the emulator does.
+# The benchmark reports the total write rate, the time each write call
+# took (p50/p99/p99.9/max), which is where lock convoys show up, and the
+# tick rate the reader managed (33/sec when it is never held up). It also
+# checks that every written frame was counted by the frame store.
+#
+# Usage:
+#   python bench_handoff.py [--writers 1 8 64] [--duration 2.0] [--universes 1] [--rate 0]
+#
+
+import argparse
+import threading
+import time
+from dmx_frame_store import FrameStore
+from dmx_latency import LatencyHistogram
+from dmx_scheduler import FrameScheduler
+
+
+def write_frames(store, handoff, universe, rate, start_event, end, histogram, counts, index):
+    """
+    Write frames until the end time, timing every write call. Each
+    writer checks the time itself: with many busy writers the main
+    thread can wait a long time for the GIL.
+    """
+    tracker = store.register_connection("writer {0}".format(index))
+    slot = None
+    if handoff == FrameStore.HANDOFF_LOCK_FREE:
+        slot = store.open_slot(universe, tracker)
+    frame = bytearray(512)
+    interval = 1.0 / rate if rate else 0.0
+    start_event.wait()
+    start = time.perf_counter()
+    written = 0
+    while time.perf_counter() < end[0]:
+        frame[0] = written & 0xFF
+        began = time.perf_counter_ns()
+        if slot is not None:
+            store.put(slot, frame)
+        else:
+            store.update(universe, frame, tracker)
+        histogram.record(time.perf_counter_ns() - began)
+        written += 1
+        if interval:
+            delay = start + written * interval - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+    if slot is not None:
+        slot.close()
+    store.unregister_connection(tracker)
+    counts[index] = written
+
+
+def run(handoff, writers, universes, rate, duration):
+    store = FrameStore(queue_policy=FrameStore.POLICY_COALESCE, handoff=handoff)
+    for universe in range(universes):
+        store.universe(universe)
+    scheduler = FrameScheduler(store, tick_interval_ms=30)
+    scheduler.start()
+
+    start_event = threading.Event()
+    end = [0.0]
+    histograms = [LatencyHistogram() for i in range(writers)]
+    counts = [0] * writers
+    threads = [threading.Thread(target=write_frames,
+                                args=(store, handoff, i % universes, rate, start_event, end, histograms[i],
+                                      counts, i))
+               for i in range(writers)]
+    for thread in threads:
+        thread.start()
+    wall_start = time.perf_counter()
+    end[0] = wall_start + duration
+    ticks_start = scheduler.ticks
+    start_event.set()
+    for thread in threads:
+        thread.join()
+    wall = time.perf_counter() - wall_start
+    ticks = scheduler.ticks - ticks_start
+    scheduler.stop()
+
+    histogram = LatencyHistogram()
+    for h in histograms:
+        histogram.merge(h)
+    written = sum(counts)
+    # A last read collects whatever the scheduler had not
+    for universe in range(universes):
+        store.snapshot(universe)
+    counted = sum(store.universe(universe).frames_received for universe in range(universes))
+
+    return {
+        "handoff": handoff,
+        "writers": writers,
+        "frames": written,
+        "write_rate": written / wall,
+        "p50_us": histogram.value_at_percentile(50.0) / 1000.0,
+        "p99_us": histogram.value_at_percentile(99.0) / 1000.0,
+        "p999_us": histogram.value_at_percentile(99.9) / 1000.0,
+        "max_us": histogram.max / 1000.0,
+        "tick_rate": ticks / wall,
+        "counted": counted == written,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="DMX Emulator frame handoff contention benchmark")
+    parser.add_argument("--writers", type=int, nargs="+", default=[1, 8, 64],
+                        help="Numbers of concurrent writer threads")
+    parser.add_argument("--duration", type=float, default=2.0, help="Seconds per run")
+    parser.add_argument("--universes", type=int, default=1,
+                        help="Universes the writers are spread across (1 is the worst case)")
+    parser.add_argument("--rate", type=float, default=0.0,
+                        help="Frames/sec per writer. 0 writes as fast as possible.")
+    args = parser.parse_args()
+
+    print("{0:>9} {1:>8} {2:>10} {3:>12} {4:>9} {5:>9} {6:>9} {7:>10} {8:>10} {9:>8}".format(
+        "handoff", "writers", "frames", "writes/sec", "p50 us", "p99 us", "p99.9 us", "max us",
+        "ticks/sec", "counted"))
+    for writers in args.writers:
+        for handoff in FrameStore.VALID_HANDOFFS:
+            r = run(handoff, writers, args.universes, args.rate, args.duration)
+            print("{0:>9} {1:>8} {2:>10} {3:>12.0f} {4:>9.1f} {5:>9.1f} {6:>9.1f} {7:>10.1f} {8:>10.1f} {9:>8}".format(
+                r["handoff"], r["writers"], r["frames"], r["write_rate"], r["p50_us"],
+                r["p99_us"], r["p999_us"], r["max_us"], r["tick_rate"], "yes" if r["counted"] else "NO"))
+
+
+#
+# Run as an application
+#
+if __name__ == "__main__":
+    main()
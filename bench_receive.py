@@ -0,0 +1,170 @@
+#
+# Receive path micro-benchmark - for testing the DMX Emulator socket server
+# Copyright © 2019  Dave Hocker (email: AtHomeX10@gmail.com)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the LICENSE file for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program (the LICENSE file).  If not, see <http://www.gnu.org/licenses/>.
+#
+
+#
+# Compares the original receive path of TCPRequestHandler (recv + bytes
+# concatenation) with the buffered recv_into path of FrameReader.
+#
+# A sender thread offers frames at a fixed rate over a socket pair and the
+# main thread reads them with each receive path. For every offered load the
+# benchmark reports the rate actually received, the receiver's CPU time per
+# frame and the number of recv system calls per frame.
+#
+# Usage:
+#   python bench_receive.py [--channels 512] [--duration 2.0] [--rates 1000 10000 100000]
+#
+
+import argparse
+import socket
+import threading
+import time
+from struct import pack, unpack
+from dmxsocketserver.FrameReader import FrameReader
+
+
+class CountingSocket:
+    """
+    Wraps a socket and counts receive calls
+    """
+    def __init__(self, sock):
+        self._sock = sock
+        self.calls = 0
+
+    def recv(self, count):
+        self.calls += 1
+        return self._sock.recv(count)
+
+    def recv_into(self, buffer):
+        self.calls += 1
+        return self._sock.recv_into(buffer)
+
+
+class LegacyReader:
+    """
+    The receive path as it was before FrameReader
+    """
+    def __init__(self, sock):
+        self._sock = sock
+
+    def receive(self, block_size):
+        count = block_size
+        dmx_data = b''
+        while count:
+            seg = self._sock.recv(count)
+            if seg:
+                dmx_data += seg
+                count -= len(seg)
+            else:
+                return None
+        dmx_data = bytes(dmx_data)
+        return dmx_data
+
+
+def send_frames(sock, channels, rate, duration):
+    """
+    Offer frames at a fixed rate. Deadlines are absolute so a late send
+    does not push back every later frame.
+    """
+    frame = pack('!i', channels) + bytes([n % 256 for n in range(channels)])
+    interval = 1.0 / rate
+    total = int(rate * duration)
+    start = time.perf_counter()
+    sent = 0
+    try:
+        while sent < total:
+            # Send every frame that is due by now
+            due = min(int((time.perf_counter() - start) / interval) + 1, total)
+            while sent < due:
+                sock.sendall(frame)
+                sent += 1
+            next_deadline = start + sent * interval
+            delay = next_deadline - time.perf_counter()
+            if delay > 0.0005:
+                time.sleep(delay)
+    finally:
+        sock.shutdown(socket.SHUT_WR)
+
+
+def receive_frames(reader):
+    """
+    Read frames until the sender closes the connection
+    :return: Number of frames received
+    """
+    frames = 0
+    while True:
+        header = reader.receive(4)
+        if not header:
+            return frames
+        size = unpack('!i', header)[0]
+        dmx_data = reader.receive(size)
+        if not dmx_data:
+            return frames
+        frames += 1
+
+
+def run(path, channels, rate, duration):
+    sender_sock, receiver_sock = socket.socketpair()
+    counting_sock = CountingSocket(receiver_sock)
+    if path == "legacy":
+        reader = LegacyReader(counting_sock)
+    else:
+        reader = FrameReader(counting_sock, channels + 4)
+
+    sender = threading.Thread(target=send_frames, args=(sender_sock, channels, rate, duration))
+    wall_start = time.perf_counter()
+    cpu_start = time.thread_time()
+    sender.start()
+    frames = receive_frames(reader)
+    cpu = time.thread_time() - cpu_start
+    wall = time.perf_counter() - wall_start
+    sender.join()
+    sender_sock.close()
+    receiver_sock.close()
+
+    return {
+        "path": path,
+        "offered": rate,
+        "frames": frames,
+        "received_rate": frames / wall,
+        "cpu_us_per_frame": (cpu / frames) * 1000000.0 if frames else 0.0,
+        "recv_calls_per_frame": counting_sock.calls / frames if frames else 0.0,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="DMX Emulator receive path micro-benchmark")
+    parser.add_argument("--channels", type=int, default=512, help="Channels per frame")
+    parser.add_argument("--duration", type=float, default=2.0, help="Seconds per run")
+    parser.add_argument("--rates", type=int, nargs="+", default=[1000, 10000, 100000],
+                        help="Offered loads in frames/sec")
+    args = parser.parse_args()
+
+    print("{0:>9} {1:>10} {2:>10} {3:>12} {4:>12} {5:>10}".format(
+        "path", "offered", "frames", "recv/sec", "cpu us/frm", "recv/frm"))
+    for rate in args.rates:
+        for path in ("legacy", "recv_into"):
+            r = run(path, args.channels, rate, args.duration)
+            print("{0:>9} {1:>10} {2:>10} {3:>12.0f} {4:>12.2f} {5:>10.2f}".format(
+                r["path"], r["offered"], r["frames"], r["received_rate"],
+                r["cpu_us_per_frame"], r["recv_calls_per_frame"]))
+
+
+#
+# Run as an application
+#
+if __name__ == "__main__":
+    main()
@@ -37,9 +37,30 @@ class Configuration():
     cfg_port = 5555
     cfg_num_channels = 512
     cfg_polling_interval = 30
+    cfg_max_polling_interval = 500
     cfg_log_console = True
     cfg_log_file = ""
     cfg_log_level = "debug"
+    cfg_frame_queue_size = 64
+    cfg_frame_queue_policy = "drop-oldest"
+    cfg_frame_handoff = "locked"
+    cfg_server_engine = "threaded"
+    cfg_ingest_workers = 0
+    cfg_num_universes = 1
+    cfg_artnet_enabled = False
+    cfg_artnet_port = 6454
+    cfg_sacn_enabled = False
+    cfg_sacn_universes = [1]
+    cfg_sacn_merge = "htp"
+    cfg_sacn_interface = "0.0.0.0"
+    cfg_metrics_enabled = False
+    cfg_metrics_port = 9555
+    cfg_control_enabled = False
+    cfg_control_port = 9556
+    cfg_liveview_enabled = False
+    cfg_liveview_port = 9557
+    cfg_liveview_rate = 20.0
+    cfg_shm_export_name = ""
 
     ######################################################################
     def __init__(self):
@@ -82,12 +103,54 @@ class Configuration():
                 cls.cfg_num_channels = int(config["num_channels"])
             if "polling_interval" in config:
                 cls.cfg_polling_interval = int(config["polling_interval"])
+            if "max_polling_interval" in config:
+                cls.cfg_max_polling_interval = int(config["max_polling_interval"])
             if "log_level" in config:
                 cls.cfg_log_level = config["log_level"].lower()
             if "log_console" in config:
                 cls.cfg_log_console = config["log_console"].lower() == "true"
             if "log_file" in config:
                 cls.cfg_log_file = config["log_file"]
+            if "frame_queue_size" in config:
+                cls.cfg_frame_queue_size = int(config["frame_queue_size"])
+            if "frame_queue_policy" in config:
+                cls.cfg_frame_queue_policy = config["frame_queue_policy"].lower()
+            if "frame_handoff" in config:
+                cls.cfg_frame_handoff = config["frame_handoff"].lower()
+            if "server_engine" in config:
+                cls.cfg_server_engine = config["server_engine"].lower()
+            if "ingest_workers" in config:
+                cls.cfg_ingest_workers = int(config["ingest_workers"])
+            if "num_universes" in config:
+                cls.cfg_num_universes = int(config["num_universes"])
+            if "artnet_enabled" in config:
+                cls.cfg_artnet_enabled = config["artnet_enabled"].lower() == "true"
+            if "artnet_port" in config:
+                cls.cfg_artnet_port = int(config["artnet_port"])
+            if "sacn_enabled" in config:
+                cls.cfg_sacn_enabled = config["sacn_enabled"].lower() == "true"
+            if "sacn_universes" in config:
+                cls.cfg_sacn_universes = [int(u) for u in config["sacn_universes"]]
+            if "sacn_merge" in config:
+                cls.cfg_sacn_merge = config["sacn_merge"].lower()
+            if "sacn_interface" in config:
+                cls.cfg_sacn_interface = config["sacn_interface"]
+            if "metrics_enabled" in config:
+                cls.cfg_metrics_enabled = config["metrics_enabled"].lower() == "true"
+            if "metrics_port" in config:
+                cls.cfg_metrics_port = int(config["metrics_port"])
+            if "control_enabled" in config:
+                cls.cfg_control_enabled = config["control_enabled"].lower() == "true"
+            if "control_port" in config:
+                cls.cfg_control_port = int(config["control_port"])
+            if "liveview_enabled" in config:
+                cls.cfg_liveview_enabled = config["liveview_enabled"].lower() == "true"
+            if "liveview_port" in config:
+                cls.cfg_liveview_port = int(config["liveview_port"])
+            if "liveview_rate" in config:
+                cls.cfg_liveview_rate = float(config["liveview_rate"])
+            if "shm_export_name" in config:
+                cls.cfg_shm_export_name = config["shm_export_name"]
         except Exception as ex:
             print("Unable to parse configuration file as JSON")
             print(str(ex))
@@ -102,9 +165,30 @@ class Configuration():
         logger.info("port: %d", cls.cfg_port)
         logger.info("num_channels: %d", cls.cfg_num_channels)
         logger.info("polling_interval: %d", cls.cfg_polling_interval)
+        logger.info("max_polling_interval: %d", cls.cfg_max_polling_interval)
         logger.info("log_console: %s", str(cls.cfg_log_console))
         logger.info("log_file: %s", cls.cfg_log_file)
         logger.info("log_level: %s", cls.cfg_log_level)
+        logger.info("frame_queue_size: %d", cls.cfg_frame_queue_size)
+        logger.info("frame_queue_policy: %s", cls.cfg_frame_queue_policy)
+        logger.info("frame_handoff: %s", cls.cfg_frame_handoff)
+        logger.info("server_engine: %s", cls.cfg_server_engine)
+        logger.info("ingest_workers: %d", cls.cfg_ingest_workers)
+        logger.info("num_universes: %d", cls.cfg_num_universes)
+        logger.info("artnet_enabled: %s", str(cls.cfg_artnet_enabled))
+        logger.info("artnet_port: %d", cls.cfg_artnet_port)
+        logger.info("sacn_enabled: %s", str(cls.cfg_sacn_enabled))
+        logger.info("sacn_universes: %s", str(cls.cfg_sacn_universes))
+        logger.info("sacn_merge: %s", cls.cfg_sacn_merge)
+        logger.info("sacn_interface: %s", cls.cfg_sacn_interface)
+        logger.info("metrics_enabled: %s", str(cls.cfg_metrics_enabled))
+        logger.info("metrics_port: %d", cls.cfg_metrics_port)
+        logger.info("control_enabled: %s", str(cls.cfg_control_enabled))
+        logger.info("control_port: %d", cls.cfg_control_port)
+        logger.info("liveview_enabled: %s", str(cls.cfg_liveview_enabled))
+        logger.info("liveview_port: %d", cls.cfg_liveview_port)
+        logger.info("liveview_rate: %.1f", cls.cfg_liveview_rate)
+        logger.info("shm_export_name: %s", cls.cfg_shm_export_name)
 
     ######################################################################
     @classmethod
@@ -142,6 +226,11 @@ class Configuration():
     def polling_interval(cls):
         return cls.cfg_polling_interval
 
+    ######################################################################
+    @classmethod
+    def max_polling_interval(cls):
+        return cls.cfg_max_polling_interval
+
     ######################################################################
     @classmethod
     def log_console(cls):
@@ -157,6 +246,115 @@ class Configuration():
     def log_level(cls):
         return cls.cfg_log_level
 
+    ######################################################################
+    @classmethod
+    def frame_queue_size(cls):
+        return cls.cfg_frame_queue_size
+
+    ######################################################################
+    @classmethod
+    def frame_queue_policy(cls):
+        return cls.cfg_frame_queue_policy
+
+    ######################################################################
+    @classmethod
+    def frame_handoff(cls):
+        return cls.cfg_frame_handoff
+
+    ######################################################################
+    @classmethod
+    def server_engine(cls):
+        return cls.cfg_server_engine
+
+    ######################################################################
+    @classmethod
+    def ingest_workers(cls):
+        return cls.cfg_ingest_workers
+
+    ######################################################################
+    @classmethod
+    def num_universes(cls):
+        return cls.cfg_num_universes
+
+    ######################################################################
+    @classmethod
+    def universe_ports(cls):
+        """
+        Returns the list of listening ports. Universe n is served on
+        port + n.
+        """
+        return [cls.cfg_port + universe for universe in range(cls.cfg_num_universes)]
+
+    ######################################################################
+    @classmethod
+    def artnet_enabled(cls):
+        return cls.cfg_artnet_enabled
+
+    ######################################################################
+    @classmethod
+    def artnet_port(cls):
+        return cls.cfg_artnet_port
+
+    ######################################################################
+    @classmethod
+    def sacn_enabled(cls):
+        return cls.cfg_sacn_enabled
+
+    ######################################################################
+    @classmethod
+    def sacn_universes(cls):
+        return cls.cfg_sacn_universes
+
+    ######################################################################
+    @classmethod
+    def sacn_merge(cls):
+        return cls.cfg_sacn_merge
+
+    ######################################################################
+    @classmethod
+    def sacn_interface(cls):
+        return cls.cfg_sacn_interface
+
+    ######################################################################
+    @classmethod
+    def metrics_enabled(cls):
+        return cls.cfg_metrics_enabled
+
+    ######################################################################
+    @classmethod
+    def metrics_port(cls):
+        return cls.cfg_metrics_port
+
+    ######################################################################
+    @classmethod
+    def control_enabled(cls):
+        return cls.cfg_control_enabled
+
+    ######################################################################
+    @classmethod
+    def control_port(cls):
+        return cls.cfg_control_port
+
+    ######################################################################
+    @classmethod
+    def liveview_enabled(cls):
+        return cls.cfg_liveview_enabled
+
+    ######################################################################
+    @classmethod
+    def liveview_port(cls):
+        return cls.cfg_liveview_port
+
+    ######################################################################
+    @classmethod
+    def liveview_rate(cls):
+        return cls.cfg_liveview_rate
+
+    ######################################################################
+    @classmethod
+    def shm_export_name(cls):
+        return cls.cfg_shm_export_name
+
     ######################################################################
     @classmethod
     def get_configuration_file_path(cls):
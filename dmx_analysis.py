@@ -0,0 +1,476 @@
+#
+# DMX Emulator capture analysis
+# Copyright © 2019  Dave Hocker (email: AtHomeX10@gmail.com)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the LICENSE file for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program (the LICENSE file).  If not, see <http://www.gnu.org/licenses/>.
+#
+
+#
+# Vectorized analysis of capture files (see dmx_capture.py).
+# Requires numpy, which the emulator itself does not need:
+#   pip install numpy
+#
+# Usage:
+#   python dmx_analysis.py session.dmxcap [--universe N] [--fade-frames 4]
+#       [--channels] [--json]
+#
+
+import argparse
+import json
+import os
+from dmx_capture import CaptureReader, HEADER_SIZE, DMX_UNIVERSE_SIZE
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Channels are numbered from 1 in reports, as in the DMX window
+FIRST_CHANNEL = 1
+
+
+def _require_numpy():
+    if np is None:
+        raise ImportError("Capture analysis requires numpy (pip install numpy)")
+
+
+def capture_dtype():
+    """
+    Returns the numpy dtype of a capture record
+    """
+    _require_numpy()
+    return np.dtype([("timestamp_ns", "<u8"), ("sequence", "<u4"), ("universe", "<u2"),
+                     ("length", "<u2"), ("data", "u1", (DMX_UNIVERSE_SIZE,))])
+
+
+def load_capture(file_path):
+    """
+    Map a capture file as a numpy record array without reading it.
+    records["data"] is a (frames x 512) uint8 view of the file.
+    :param file_path: Full path to the capture file
+    :return: A read-only numpy memmap of capture records
+    """
+    _require_numpy()
+    # Validates the header
+    with CaptureReader(file_path) as capture:
+        count = len(capture)
+    if count == 0:
+        return np.zeros(0, dtype=capture_dtype())
+    return np.memmap(file_path, dtype=capture_dtype(), mode="r", offset=HEADER_SIZE, shape=(count,))
+
+
+class UniverseAnalysis:
+    """
+    Statistics of one universe, accumulated a chunk of frames at a time
+    so captures of any length can be analyzed in constant memory. All
+    per-channel results are numpy arrays of 512 values.
+
+    DMX streams are mostly unchanged from one frame to the next, so the
+    only pass over every channel of every frame is a vectorized compare
+    with the previous frame. Everything else is computed from the
+    resulting list of changes.
+    """
+
+    def __init__(self, universe, fade_frames=4):
+        """
+        Constructor
+        :param universe: Universe number
+        :param fade_frames: Consecutive changes in the same direction that
+        count as a fade. Frames where the channel holds its value do not
+        interrupt a fade.
+        """
+        _require_numpy()
+        self.universe = universe
+        self.fade_frames = fade_frames
+        channels = DMX_UNIVERSE_SIZE
+
+        self.frames = 0
+        self.first_ns = None
+        self.last_ns = None
+        self.length = 0
+
+        # Channel values
+        self.min = np.full(channels, 255, dtype=np.uint8)
+        self.max = np.zeros(channels, dtype=np.uint8)
+        self._sum = np.zeros(channels, dtype=np.float64)
+
+        # Frame to frame deltas
+        self.changes = np.zeros(channels, dtype=np.int64)
+        self.max_delta = np.zeros(channels, dtype=np.int64)
+        self._delta_sum = np.zeros(channels, dtype=np.float64)
+        # Histogram of the number of channels changed per frame
+        self.changed_per_frame = np.zeros(channels + 1, dtype=np.int64)
+
+        # Fades and holds
+        self.fades = np.zeros(channels, dtype=np.int64)
+        self.longest_fade = np.zeros(channels, dtype=np.int64)
+        self._fade_steps = np.zeros(channels, dtype=np.int64)
+        self._fade_step_sum = np.zeros(channels, dtype=np.float64)
+        self._longest_hold = np.zeros(channels, dtype=np.int64)
+
+        # Frame intervals
+        self._interval_sum = 0
+        self._interval_squares = 0.0
+        self.max_interval_ns = 0
+
+        # State carried from one chunk to the next
+        self._last_frame = None
+        # Frame number of each channel's last change
+        self._last_change = np.zeros(channels, dtype=np.int64)
+        # Direction and fade length of each channel's last change
+        self._last_sign = np.zeros(channels, dtype=np.int64)
+        self._fade_run = np.zeros(channels, dtype=np.int64)
+
+    def add(self, data, timestamps, lengths):
+        """
+        Add a chunk of consecutive frames
+        :param data: (n x 512) uint8 array
+        :param timestamps: n timestamps (ns)
+        :param lengths: n frame lengths
+        :return:
+        """
+        n = data.shape[0]
+        if n == 0:
+            return
+        self.length = max(self.length, int(lengths.max()))
+
+        timestamps = timestamps.astype(np.int64)
+        if self._last_frame is None:
+            self.first_ns = int(timestamps[0])
+            intervals = np.diff(timestamps)
+        else:
+            intervals = np.diff(timestamps, prepend=self.last_ns)
+        if intervals.size:
+            self._interval_sum += int(intervals.sum())
+            self._interval_squares += float(np.square(intervals, dtype=np.float64).sum())
+            self.max_interval_ns = max(self.max_interval_ns, int(intervals.max()))
+        self.last_ns = int(timestamps[-1])
+
+        # Every change in the chunk as (frame in chunk, channel)
+        # (flatnonzero is much faster than a 2D nonzero)
+        frame, channel = np.divmod(np.flatnonzero(data[1:] != data[:-1]), DMX_UNIVERSE_SIZE)
+        frame += 1
+        if self._last_frame is None:
+            # The first frame has nothing to change from
+            base = data[0]
+            first_step = 1
+            np.minimum(self.min, base, out=self.min)
+            np.maximum(self.max, base, out=self.max)
+        else:
+            base = self._last_frame
+            first_step = 0
+            first_changes = np.flatnonzero(data[0] != base)
+            frame = np.concatenate((np.zeros(len(first_changes), dtype=frame.dtype), frame))
+            channel = np.concatenate((first_changes, channel))
+
+        # Changes per frame, counting frames without any
+        per_frame = np.bincount(frame, minlength=n)[first_step:]
+        self.changed_per_frame += np.bincount(per_frame, minlength=DMX_UNIVERSE_SIZE + 1)
+
+        # Value sums: each value holds from its frame to the end of the chunk
+        base = base.astype(np.int64)
+        chunk_sum = base * n
+        new_value = data[frame, channel].astype(np.int64)
+        old_value = np.where(frame > 0, data[frame - 1, channel], base[channel])
+        delta = new_value - old_value
+        if len(frame):
+            chunk_sum = chunk_sum + np.bincount(channel, weights=delta * (n - frame),
+                                                minlength=DMX_UNIVERSE_SIZE)
+        self._sum += chunk_sum
+        global_frame = self.frames + frame
+        self.frames += n
+        self._last_frame = data[-1].copy()
+        if not len(frame):
+            return
+
+        # Group the changes by channel, in frame order within a channel
+        order = np.argsort(channel.astype(np.uint16), kind="stable")
+        channel = channel[order]
+        global_frame = global_frame[order]
+        new_value = new_value[order]
+        delta = delta[order]
+        magnitude = np.abs(delta)
+        count = len(channel)
+        starts = np.flatnonzero(np.concatenate(([True], channel[1:] != channel[:-1])))
+        ends = np.append(starts[1:], count) - 1
+        used = channel[starts]
+
+        self.changes[used] += ends - starts + 1
+        self._delta_sum += np.bincount(channel, weights=magnitude, minlength=DMX_UNIVERSE_SIZE)
+        self.max_delta[used] = np.maximum(self.max_delta[used], np.maximum.reduceat(magnitude, starts))
+        self.min[used] = np.minimum(self.min[used], np.minimum.reduceat(new_value, starts))
+        self.max[used] = np.maximum(self.max[used], np.maximum.reduceat(new_value, starts))
+
+        # Holds: unchanged frames between consecutive changes
+        previous_change = np.empty_like(global_frame)
+        previous_change[1:] = global_frame[:-1]
+        previous_change[starts] = self._last_change[used]
+        hold = np.maximum.reduceat(global_frame - previous_change - 1, starts)
+        self._longest_hold[used] = np.maximum(self._longest_hold[used], hold)
+        self._last_change[used] = global_frame[ends]
+
+        # Fades: runs of changes in the same direction
+        sign = np.sign(delta)
+        previous_sign = np.empty_like(sign)
+        previous_sign[1:] = sign[:-1]
+        previous_sign[starts] = self._last_sign[used]
+        continuing = sign == previous_sign
+        # The first change of each channel in the chunk starts a segment,
+        # continuing a run from the previous chunk if the direction holds
+        segment_start = ~continuing
+        segment_start[starts] = True
+        carried = np.zeros(count, dtype=np.int64)
+        carried[starts] = np.where(continuing[starts], self._fade_run[used], 0)
+        index = np.arange(count)
+        last_start = np.maximum.accumulate(np.where(segment_start, index, 0))
+        run = index - last_start + 1 + carried[last_start]
+
+        self.fades += np.bincount(channel[run == self.fade_frames], minlength=DMX_UNIVERSE_SIZE)
+        self.longest_fade[used] = np.maximum(self.longest_fade[used], np.maximum.reduceat(run, starts))
+        in_fade = run >= self.fade_frames
+        self._fade_steps += np.bincount(channel[in_fade], minlength=DMX_UNIVERSE_SIZE)
+        self._fade_step_sum += np.bincount(channel[in_fade], weights=magnitude[in_fade],
+                                           minlength=DMX_UNIVERSE_SIZE)
+        self._fade_run[used] = run[ends]
+        self._last_sign[used] = sign[ends]
+
+    @property
+    def longest_hold(self):
+        """
+        Longest run of frames over which each channel did not change
+        """
+        if self.frames < 2:
+            return np.zeros(DMX_UNIVERSE_SIZE, dtype=np.int64)
+        trailing = (self.frames - 1) - self._last_change
+        return np.maximum(self._longest_hold, trailing)
+
+    @property
+    def mean(self):
+        """
+        Mean value of each channel
+        """
+        return self._sum / max(1, self.frames)
+
+    @property
+    def mean_delta(self):
+        """
+        Mean absolute frame to frame change of each channel
+        """
+        return self._delta_sum / max(1, self.frames - 1)
+
+    @property
+    def fade_slope(self):
+        """
+        Mean change per step of each channel while fading, 0 for
+        channels that never fade
+        """
+        return np.where(self._fade_steps > 0, self._fade_step_sum / np.maximum(1, self._fade_steps), 0.0)
+
+    def stuck_channels(self):
+        """
+        Returns the indexes of channels in use that never changed
+        """
+        if self.frames < 2:
+            return np.zeros(0, dtype=np.int64)
+        return np.nonzero(self.changes[0:self.length] == 0)[0]
+
+    def duration_ns(self):
+        if self.frames < 2:
+            return 0
+        return self.last_ns - self.first_ns
+
+    def interval_stats(self):
+        """
+        Frame interval mean, standard deviation and maximum in ns
+        """
+        count = self.frames - 1
+        if count < 1:
+            return None, None, None
+        mean = self._interval_sum / count
+        variance = max(0.0, self._interval_squares / count - mean * mean)
+        return mean, variance ** 0.5, self.max_interval_ns
+
+    def changed_per_frame_stats(self):
+        """
+        Mean and maximum number of channels changed per frame, and the
+        99th percentile
+        """
+        total = int(self.changed_per_frame.sum())
+        if not total:
+            return None, None, None
+        counts = np.arange(DMX_UNIVERSE_SIZE + 1)
+        mean = float((self.changed_per_frame * counts).sum()) / total
+        nonzero = np.nonzero(self.changed_per_frame)[0]
+        cumulative = np.cumsum(self.changed_per_frame)
+        p99 = int(np.searchsorted(cumulative, 0.99 * total))
+        return mean, p99, int(nonzero[-1])
+
+    def to_dict(self, channels=False):
+        """
+        Summarize as a JSON friendly dict
+        :param channels: Include the per channel arrays
+        :return: A dict
+        """
+        interval_mean, interval_stddev, interval_max = self.interval_stats()
+        changed_mean, changed_p99, changed_max = self.changed_per_frame_stats()
+        result = {
+            "universe": self.universe,
+            "frames": self.frames,
+            "duration_seconds": self.duration_ns() / 1e9,
+            "channels": self.length,
+            "interval_ms": {
+                "mean": None if interval_mean is None else interval_mean / 1e6,
+                "stddev": None if interval_stddev is None else interval_stddev / 1e6,
+                "max": None if interval_max is None else interval_max / 1e6,
+            },
+            "changed_channels_per_frame": {"mean": changed_mean, "p99": changed_p99, "max": changed_max},
+            "stuck_channels": [int(c) + FIRST_CHANNEL for c in self.stuck_channels()],
+            "fading_channels": int((self.fades[0:self.length] > 0).sum()),
+        }
+        if channels:
+            n = self.length
+            result["channel"] = {
+                "min": self.min[0:n].tolist(),
+                "max": self.max[0:n].tolist(),
+                "mean": self.mean[0:n].tolist(),
+                "changes": self.changes[0:n].tolist(),
+                "mean_delta": self.mean_delta[0:n].tolist(),
+                "max_delta": self.max_delta[0:n].tolist(),
+                "fades": self.fades[0:n].tolist(),
+                "longest_fade": self.longest_fade[0:n].tolist(),
+                "fade_slope": self.fade_slope[0:n].tolist(),
+                "longest_hold": self.longest_hold[0:n].tolist(),
+            }
+        return result
+
+
+def analyze(file_path, universe=None, fade_frames=4, chunk_frames=16384):
+    """
+    Analyze a capture file
+    :param file_path: Full path to the capture file
+    :param universe: Only analyze this universe. None for all.
+    :param fade_frames: Consecutive steps in one direction that count as a fade
+    :param chunk_frames: Frames processed per step. Bounds memory use.
+    :return: A dict of universe: UniverseAnalysis
+    """
+    records = load_capture(file_path)
+    results = {}
+    for start in range(0, len(records), chunk_frames):
+        chunk = records[start:start + chunk_frames]
+        universes = chunk["universe"]
+        first = int(universes[0])
+        if (universes == first).all():
+            # The usual single universe case needs no copying
+            groups = [(first, chunk)]
+        else:
+            groups = [(int(u), chunk[universes == u]) for u in np.unique(universes)]
+        for number, frames in groups:
+            if universe is not None and number != universe:
+                continue
+            analysis = results.get(number)
+            if analysis is None:
+                analysis = UniverseAnalysis(number, fade_frames=fade_frames)
+                results[number] = analysis
+            analysis.add(frames["data"], frames["timestamp_ns"], frames["length"])
+    return results
+
+
+def _ranges(channels):
+    """
+    Format a sorted list of channel numbers as compact ranges
+    """
+    parts = []
+    start = previous = None
+    for channel in channels:
+        if start is None:
+            start = previous = channel
+        elif channel == previous + 1:
+            previous = channel
+        else:
+            parts.append(str(start) if start == previous else "{0}-{1}".format(start, previous))
+            start = previous = channel
+    if start is not None:
+        parts.append(str(start) if start == previous else "{0}-{1}".format(start, previous))
+    return ", ".join(parts)
+
+
+def print_summary(analysis, channels=False):
+    """
+    Print a readable summary of one universe
+    :param analysis: A UniverseAnalysis
+    :param channels: Also print a line per channel
+    :return:
+    """
+    summary = analysis.to_dict()
+    duration = summary["duration_seconds"]
+    rate = (analysis.frames - 1) / duration if duration else 0.0
+    print("Universe {0}: {1} frames over {2:.3f} sec ({3:.1f} frames/sec), {4} channels".format(
+        analysis.universe, analysis.frames, duration, rate, analysis.length))
+    interval = summary["interval_ms"]
+    if interval["mean"] is not None:
+        print("  Frame interval ms: mean {0:.3f} stddev {1:.3f} max {2:.3f}".format(
+            interval["mean"], interval["stddev"], interval["max"]))
+    changed = summary["changed_channels_per_frame"]
+    if changed["mean"] is not None:
+        print("  Channels changed per frame: mean {0:.1f} p99 {1} max {2}".format(
+            changed["mean"], changed["p99"], changed["max"]))
+    print("  Stuck channels: {0}".format(_ranges(summary["stuck_channels"]) or "none"))
+    print("  Fading channels: {0}".format(summary["fading_channels"]))
+
+    n = analysis.length
+    active = np.argsort(-analysis.changes[0:n], kind="stable")[0:5]
+    active = [c for c in active if analysis.changes[c] > 0]
+    if active:
+        print("  Most active channels: " + ", ".join(
+            "{0} ({1} changes)".format(int(c) + FIRST_CHANNEL, int(analysis.changes[c])) for c in active))
+
+    if channels:
+        print("  Channel   Min   Max    Mean  Changes  MeanDelta  MaxDelta  Fades  Slope  LongestHold")
+        mean = analysis.mean
+        mean_delta = analysis.mean_delta
+        slope = analysis.fade_slope
+        for c in range(n):
+            print("  {0:7d} {1:5d} {2:5d} {3:7.1f} {4:8d} {5:10.2f} {6:9d} {7:6d} {8:6.2f} {9:12d}".format(
+                c + FIRST_CHANNEL, int(analysis.min[c]), int(analysis.max[c]), mean[c],
+                int(analysis.changes[c]), mean_delta[c], int(analysis.max_delta[c]),
+                int(analysis.fades[c]), slope[c], int(analysis.longest_hold[c])))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Analyze a DMX Emulator capture file")
+    parser.add_argument("file", help="Capture file")
+    parser.add_argument("--universe", type=int, default=None, help="Only analyze this universe")
+    parser.add_argument("--fade-frames", type=int, default=4,
+                        help="Consecutive changes in one direction that count as a fade")
+    parser.add_argument("--channels", action="store_true", help="Show statistics for every channel")
+    parser.add_argument("--json", action="store_true", help="Write the results as JSON")
+    args = parser.parse_args()
+
+    if np is None:
+        parser.error("numpy is required (pip install numpy)")
+    if not os.path.exists(args.file):
+        parser.error("{0} does not exist".format(args.file))
+
+    results = analyze(args.file, universe=args.universe, fade_frames=args.fade_frames)
+    if args.json:
+        print(json.dumps([results[u].to_dict(channels=args.channels) for u in sorted(results.keys())], indent=2))
+    else:
+        for universe in sorted(results.keys()):
+            print_summary(results[universe], channels=args.channels)
+
+
+#
+# Run as an application
+#
+if __name__ == "__main__":
+    main()
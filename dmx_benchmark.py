@@ -0,0 +1,347 @@
+#
+# DMX Emulator load generator and benchmark
+# Copyright © 2019  Dave Hocker (email: AtHomeX10@gmail.com)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the LICENSE file for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program (the LICENSE file).  If not, see <http://www.gnu.org/licenses/>.
+#
+
+#
+# Starts a headless emulator, in this process or as a subprocess, drives it
+# with a configurable number of connections at a fixed frame rate and reports:
+#   sustained frames/sec sent and received
+#   end-to-end latency percentiles (client send to server frame store)
+#   emulator CPU time and RSS
+#   dropped and coalesced frames
+#
+# Results are written as JSON so runs can be compared across commits.
+#
+# Every frame carries its send time (time.monotonic_ns, 8 bytes big endian)
+# in its first 8 channels. On Linux the monotonic clock is system wide,
+# so latency can also be measured when the emulator is a subprocess.
+#
+# Usage:
+#   python dmx_benchmark.py [--mode inprocess|subprocess] [--connections 8]
+#       [--channels 512] [--rate 44] [--duration 10] [--engine threaded|asyncio]
+#       [--handoff locked|lock-free] [--workers 0] [--universes 1] [--port 5700]
+#       [--output results.json]
+#
+
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import resource
+import signal
+import subprocess
+import sys
+import threading
+import time
+from array import array
+from struct import pack_into, unpack_from
+from async_dmx_emulator_client import AsyncDMXEmulatorClient
+from dmx_connection_handler import DMXConnectionHandler
+from dmx_frame_store import FrameStore
+from dmx_headless import HeadlessRunner
+from dmx_ingest_pool import IngestPool
+from dmx_sinks import MetricsSink
+from dmxsocketserver import SocketServerThread
+
+# Channels needed to carry the send timestamp
+TIMESTAMP_SIZE = 8
+
+
+def percentile(sorted_values, fraction):
+    """
+    Nearest rank percentile
+    :param sorted_values: Sorted sequence
+    :param fraction: 0.0-1.0
+    :return: The value or None if there are no values
+    """
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, int(fraction * len(sorted_values)))
+    return sorted_values[index]
+
+
+def rss_kb():
+    """
+    Returns the current resident set size of this process in KB
+    """
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * (os.sysconf("SC_PAGE_SIZE") // 1024)
+    except (OSError, ValueError):
+        # Not Linux, fall back to the peak
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+class EmulatorUnderTest:
+    """
+    A headless emulator with a frame listener that measures latency
+    """
+
+    def __init__(self, port, universes, engine, queue_size=64, queue_policy=FrameStore.POLICY_DROP_OLDEST,
+                 handoff=FrameStore.HANDOFF_LOCKED, workers=0):
+        self._store = FrameStore(queue_size=queue_size, queue_policy=queue_policy, handoff=handoff)
+        self._store.add_listener(self._on_frame)
+        # Latency samples in ns
+        self._latencies = array("q")
+
+        ports = [port + universe for universe in range(universes)]
+        DMXConnectionHandler.set_frame_store(self._store)
+        DMXConnectionHandler.set_universe_ports(ports)
+        self._server = SocketServerThread.SocketServerThread("127.0.0.1", [] if workers else ports,
+                                                             DMXConnectionHandler, frame_size=512, engine=engine)
+        if workers:
+            # Frames parsed in worker processes never reach the latency
+            # listener. The receive to render histograms still apply.
+            self._server.AddServer(IngestPool("127.0.0.1", ports, self._store, workers=workers),
+                                   "TCP ingest workers")
+        self._metrics = MetricsSink()
+        self._runner = HeadlessRunner(self._store, [self._metrics], polling_interval_ms=30)
+        self._runner_thread = threading.Thread(target=self._runner.run)
+
+    def _on_frame(self, universe, sequence, dmx_data):
+        if len(dmx_data) >= TIMESTAMP_SIZE:
+            self._latencies.append(time.monotonic_ns() - unpack_from("!Q", dmx_data)[0])
+
+    def start(self):
+        self._cpu_start = time.process_time()
+        self._children_cpu_start = self._children_cpu()
+        self._server.Start()
+        self._runner_thread.start()
+
+    def stop(self):
+        """
+        Stop the emulator
+        :return: A dict of server side results
+        """
+        self._runner.stop()
+        self._runner_thread.join()
+        self._server.Stop()
+        cpu = time.process_time() - self._cpu_start
+        # Ingest workers, once they have exited
+        workers_cpu = self._children_cpu() - self._children_cpu_start
+
+        received = dropped = coalesced = 0
+        for universe in self._store.universes():
+            state = self._store.universe(universe)
+            received += state.frames_received
+            dropped += state.frames_dropped
+            coalesced += state.frames_coalesced
+
+        latencies = sorted(self._latencies)
+        return {
+            "received_frames": received,
+            "dropped_frames": dropped,
+            "coalesced_frames": coalesced,
+            "consumed_frames": sum(self._metrics.frames_consumed.values()),
+            "latency_ms": {
+                "p50": self._ms(percentile(latencies, 0.50)),
+                "p99": self._ms(percentile(latencies, 0.99)),
+                "p999": self._ms(percentile(latencies, 0.999)),
+                "max": self._ms(latencies[-1] if latencies else None),
+            },
+            # Frame store histograms: inter-arrival and receive to render
+            "histograms": self._store.latency_report(),
+            "cpu_seconds": cpu,
+            "workers_cpu_seconds": workers_cpu,
+            "rss_kb": rss_kb(),
+            "max_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        }
+
+    @staticmethod
+    def _children_cpu():
+        usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+        return usage.ru_utime + usage.ru_stime
+
+    @staticmethod
+    def _ms(ns):
+        if ns is None:
+            return None
+        return ns / 1000000.0
+
+
+async def drive(args):
+    """
+    Run the load: connections frames at args.rate each for args.duration
+    :return: A dict of client side results
+    """
+    frames_per_connection = int(args.rate * args.duration)
+
+    def frames():
+        # Each frame is a fresh buffer because it may still be queued in
+        # the stream when the next one is built
+        for n in range(frames_per_connection):
+            yield bytearray((n + i) % 256 for i in range(args.channels))
+
+    def stamp(frame):
+        # Stamped after the stream's wait for the frame's deadline, so
+        # the latency is only the time from the write to the emulator
+        pack_into("!Q", frame, 0, time.monotonic_ns())
+
+    clients = [AsyncDMXEmulatorClient(args.channels, host="127.0.0.1",
+                                      port=args.port + (c % args.universes), reconnect=False)
+               for c in range(args.connections)]
+    await asyncio.gather(*[client.open() for client in clients])
+
+    start = time.perf_counter()
+    sent = await asyncio.gather(*[client.stream(frames(), hz=args.rate, stamp=stamp) for client in clients])
+    elapsed = time.perf_counter() - start
+
+    await asyncio.gather(*[client.close() for client in clients])
+    return {
+        "sent_frames": sum(sent),
+        "elapsed_seconds": elapsed,
+    }
+
+
+def serve(args):
+    """
+    Subprocess mode, emulator side. Runs until SIGTERM, then writes its
+    results to stdout as JSON.
+    """
+    stop = threading.Event()
+    signal.signal(signal.SIGTERM, lambda signum, frame: stop.set())
+
+    emulator = EmulatorUnderTest(args.port, args.universes, args.engine, handoff=args.handoff,
+                                 workers=args.workers)
+    emulator.start()
+    print("READY", flush=True)
+    while not stop.wait(0.5):
+        pass
+    print(json.dumps(emulator.stop()), flush=True)
+
+
+def run_inprocess(args):
+    # The server prints as connections come and go. Keep stdout for the
+    # results, so they can be redirected to a file.
+    with contextlib.redirect_stdout(sys.stderr):
+        emulator = EmulatorUnderTest(args.port, args.universes, args.engine, handoff=args.handoff,
+                                     workers=args.workers)
+        emulator.start()
+        try:
+            # The load generator runs on this thread's event loop
+            client_cpu_start = time.thread_time()
+            client = asyncio.run(drive(args))
+            client["cpu_seconds"] = time.thread_time() - client_cpu_start
+            # Let the server finish with what is in flight
+            time.sleep(0.5)
+        finally:
+            server = emulator.stop()
+    # The process CPU time includes the load generator. The emulator's
+    # share is what its threads used.
+    server["process_cpu_seconds"] = server["cpu_seconds"]
+    server["cpu_seconds"] = max(0.0, server["cpu_seconds"] - client["cpu_seconds"])
+    return client, server
+
+
+def run_subprocess(args):
+    command = [sys.executable, os.path.abspath(__file__), "--serve",
+               "--port", str(args.port), "--universes", str(args.universes), "--engine", args.engine,
+               "--handoff", args.handoff, "--workers", str(args.workers)]
+    child = subprocess.Popen(command, stdout=subprocess.PIPE, universal_newlines=True,
+                             cwd=os.path.dirname(os.path.abspath(__file__)))
+    try:
+        # Wait for the emulator to start listening
+        for line in child.stdout:
+            if line.strip() == "READY":
+                break
+        client_cpu_start = time.process_time()
+        client = asyncio.run(drive(args))
+        client["cpu_seconds"] = time.process_time() - client_cpu_start
+        time.sleep(0.5)
+    finally:
+        child.send_signal(signal.SIGTERM)
+    server = None
+    for line in child.stdout:
+        line = line.strip()
+        if line.startswith("{"):
+            server = json.loads(line)
+    child.wait()
+    return client, server
+
+
+def git_commit():
+    """
+    Returns the commit of the working tree, if it is a git repository
+    """
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"],
+                                       cwd=os.path.dirname(os.path.abspath(__file__)),
+                                       stderr=subprocess.DEVNULL, universal_newlines=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="DMX Emulator load generator and benchmark")
+    parser.add_argument("--mode", choices=["inprocess", "subprocess"], default="inprocess",
+                        help="Run the emulator in this process or in a subprocess")
+    parser.add_argument("--connections", type=int, default=8, help="Number of client connections")
+    parser.add_argument("--channels", type=int, default=512, help="Channels per frame (8-512)")
+    parser.add_argument("--rate", type=float, default=44.0, help="Frames/sec per connection")
+    parser.add_argument("--duration", type=float, default=10.0, help="Seconds of load")
+    parser.add_argument("--engine", choices=["threaded", "asyncio"], default="threaded",
+                        help="Emulator server engine")
+    parser.add_argument("--handoff", choices=list(FrameStore.VALID_HANDOFFS), default=FrameStore.HANDOFF_LOCKED,
+                        help="Frame store handoff between connections and universes")
+    parser.add_argument("--workers", type=int, default=0,
+                        help="Parse TCP frames in this many worker processes (0 for none)")
+    parser.add_argument("--universes", type=int, default=1,
+                        help="Universes (ports) the connections are spread across")
+    parser.add_argument("--port", type=int, default=5700, help="First emulator port")
+    parser.add_argument("--output", default=None, help="Write JSON results to this file")
+    parser.add_argument("--serve", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(args)
+        return
+    if args.channels < TIMESTAMP_SIZE or args.channels > 512:
+        parser.error("--channels must be {0}-512".format(TIMESTAMP_SIZE))
+
+    if args.mode == "subprocess":
+        client, server = run_subprocess(args)
+    else:
+        client, server = run_inprocess(args)
+
+    elapsed = client["elapsed_seconds"]
+    results = {
+        "commit": git_commit(),
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "config": vars(args),
+        "offered_fps": args.rate * args.connections,
+        "sent_frames": client["sent_frames"],
+        "sent_fps": client["sent_frames"] / elapsed,
+        "client": client,
+        "server": server,
+    }
+    if server:
+        results["received_fps"] = server["received_frames"] / elapsed
+        results["lost_frames"] = client["sent_frames"] - server["received_frames"]
+    del results["config"]["serve"]
+
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    print(output)
+
+
+#
+# Run as an application
+#
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,302 @@
+#
+# DMX Emulator frame capture files
+# Copyright © 2019  Dave Hocker (email: AtHomeX10@gmail.com)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the LICENSE file for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program (the LICENSE file).  If not, see <http://www.gnu.org/licenses/>.
+#
+
+#
+# Capture file format (all integers little endian)
+#
+# Header, 64 bytes:
+#   magic           8 bytes  b"DMXCAP\x00\x01"
+#   version         uint16   1
+#   record_size     uint16   528
+#   reserved        uint32
+#   start_time      double   time.time() when the capture started
+#   start_ns        uint64   time.monotonic_ns() when the capture started
+#   reserved        32 bytes
+#
+# Followed by fixed size records, 528 bytes each:
+#   timestamp_ns    uint64   ns since start_ns when the frame was received
+#   sequence        uint32   frame sequence number within its universe
+#   universe        uint16
+#   length          uint16   number of valid channels, 1-512
+#   data            512 bytes, zero padded after length
+#
+# Record n starts at 64 + n * 528, so a capture of any length can be
+# memory mapped and read at random. Records are in receive order, so
+# timestamps never decrease. A partly written last record (after a
+# crash) is ignored by the reader.
+#
+
+import argparse
+import mmap
+import os
+import struct
+import time
+from collections import namedtuple
+from threading import Condition, Thread
+import app_logger
+
+logger = app_logger.getAppLogger()
+
+MAGIC = b"DMXCAP\x00\x01"
+VERSION = 1
+HEADER = struct.Struct("<8sHHLdQ32x")
+HEADER_SIZE = HEADER.size
+RECORD_HEADER = struct.Struct("<QLHH")
+DMX_UNIVERSE_SIZE = 512
+RECORD_SIZE = RECORD_HEADER.size + DMX_UNIVERSE_SIZE
+_EMPTY_RECORD = bytes(RECORD_SIZE)
+
+CaptureRecord = namedtuple("CaptureRecord", ["timestamp_ns", "sequence", "universe", "data"])
+
+
+class CaptureWriter:
+    """
+    Appends every frame received by the emulator to a capture file.
+
+    The writer is a frame store listener. On the receiving thread it only
+    packs the frame into an in-memory batch. A background thread writes
+    the batches to disk, so reception never waits for the disk. If the
+    disk falls so far behind that max_pending bytes are waiting, new
+    frames are counted as dropped rather than held in memory.
+    """
+
+    def __init__(self, file_path, flush_interval=0.25, max_pending=64 * 1024 * 1024):
+        """
+        Create the capture file and start the writer thread
+        :param file_path: Full path to the capture file. An existing file
+        is replaced.
+        :param flush_interval: Longest time a frame waits in memory (seconds)
+        :param max_pending: Largest batch held in memory (bytes)
+        """
+        self._file_path = file_path
+        self._flush_interval = flush_interval
+        self._max_pending = max_pending
+        self._file = open(file_path, "wb")
+        self._start_ns = time.monotonic_ns()
+        self._file.write(HEADER.pack(MAGIC, VERSION, RECORD_SIZE, 0, time.time(), self._start_ns))
+
+        self._pending = bytearray()
+        self._condition = Condition()
+        self._closing = False
+
+        # Statistics
+        self.frames_captured = 0
+        self.frames_dropped = 0
+        self.bytes_written = HEADER_SIZE
+
+        self._thread = Thread(target=self._run, name="CaptureWriter")
+        self._thread.daemon = True
+        self._thread.start()
+        logger.info("Capturing frames to %s", file_path)
+
+    def __call__(self, universe, sequence, dmx_data):
+        """
+        Frame store listener. Queues one record.
+        :param universe: Universe number
+        :param sequence: Frame sequence number
+        :param dmx_data: 1-512 channel values
+        :return:
+        """
+        n = min(len(dmx_data), DMX_UNIVERSE_SIZE)
+        with self._condition:
+            if self._closing:
+                return
+            if len(self._pending) >= self._max_pending:
+                self.frames_dropped += 1
+                return
+            pending = self._pending
+            offset = len(pending)
+            # Grow by a whole record, zero filled, then fill it in
+            pending.extend(_EMPTY_RECORD)
+            RECORD_HEADER.pack_into(pending, offset, time.monotonic_ns() - self._start_ns,
+                                    sequence & 0xFFFFFFFF, universe, n)
+            start = offset + RECORD_HEADER.size
+            pending[start:start + n] = dmx_data[0:n]
+            self.frames_captured += 1
+
+    def _run(self):
+        while True:
+            with self._condition:
+                if not self._closing:
+                    self._condition.wait(self._flush_interval)
+                batch = self._pending
+                self._pending = bytearray()
+                closing = self._closing
+            if batch:
+                self._file.write(batch)
+                self._file.flush()
+                self.bytes_written += len(batch)
+            if closing:
+                return
+
+    def close(self):
+        """
+        Write out everything that is pending and close the file
+        :return:
+        """
+        with self._condition:
+            if self._closing:
+                return
+            self._closing = True
+            self._condition.notify()
+        self._thread.join()
+        self._file.close()
+        logger.info("Captured %d frames to %s (%d dropped)",
+                    self.frames_captured, self._file_path, self.frames_dropped)
+
+
+class CaptureReader:
+    """
+    Random access to a capture file through a read-only memory map.
+    Nothing is loaded until it is touched, so multi-hour captures can be
+    opened instantly and scanned without being read into memory.
+    """
+
+    def __init__(self, file_path):
+        """
+        Open and map a capture file
+        :param file_path: Full path to the capture file
+        """
+        self._file = open(file_path, "rb")
+        try:
+            size = os.fstat(self._file.fileno()).st_size
+            if size < HEADER_SIZE:
+                raise ValueError("{0} is not a DMX capture file".format(file_path))
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except Exception:
+            self._file.close()
+            raise
+
+        magic, version, record_size, reserved, self.start_time, self.start_ns = HEADER.unpack_from(self._map, 0)
+        if magic != MAGIC or record_size != RECORD_SIZE:
+            self.close()
+            raise ValueError("{0} is not a DMX capture file".format(file_path))
+        if version != VERSION:
+            self.close()
+            raise ValueError("Unsupported DMX capture file version {0}".format(version))
+
+        self._view = memoryview(self._map)
+        self._count = (size - HEADER_SIZE) // RECORD_SIZE
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __len__(self):
+        return self._count
+
+    def __getitem__(self, index):
+        """
+        Returns record n
+        :param index: Record number. Negative numbers count from the end.
+        :return: A CaptureRecord. Its data is a view of the map that is
+        valid until the reader is closed.
+        """
+        if index < 0:
+            index += self._count
+        if index < 0 or index >= self._count:
+            raise IndexError("capture record index out of range")
+        offset = HEADER_SIZE + index * RECORD_SIZE
+        timestamp_ns, sequence, universe, length = RECORD_HEADER.unpack_from(self._map, offset)
+        start = offset + RECORD_HEADER.size
+        return CaptureRecord(timestamp_ns, sequence, universe, self._view[start:start + length])
+
+    def __iter__(self):
+        for index in range(self._count):
+            yield self[index]
+
+    @property
+    def buffer(self):
+        """
+        The whole file as a read-only memoryview, for bulk analysis
+        """
+        return self._view
+
+    def timestamp(self, index):
+        """
+        Returns the timestamp of record n without reading its data
+        :param index: Record number
+        :return: ns since the start of the capture
+        """
+        return struct.unpack_from("<Q", self._map, HEADER_SIZE + index * RECORD_SIZE)[0]
+
+    def find_time(self, timestamp_ns):
+        """
+        Binary search for the first record at or after a time
+        :param timestamp_ns: ns since the start of the capture
+        :return: A record number, len(self) if every record is earlier
+        """
+        low, high = 0, self._count
+        while low < high:
+            middle = (low + high) // 2
+            if self.timestamp(middle) < timestamp_ns:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def duration_ns(self):
+        """
+        Returns the time between the first and last records in ns
+        """
+        if self._count < 2:
+            return 0
+        return self.timestamp(self._count - 1) - self.timestamp(0)
+
+    def close(self):
+        """
+        Unmap and close the file
+        :return:
+        """
+        if getattr(self, "_view", None) is not None:
+            self._view.release()
+            self._view = None
+        if getattr(self, "_map", None) is not None:
+            try:
+                self._map.close()
+            except BufferError:
+                # Record data views are still in use. The map is
+                # released when they are.
+                pass
+            self._map = None
+        self._file.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Summarize a DMX Emulator capture file")
+    parser.add_argument("file", help="Capture file")
+    args = parser.parse_args()
+
+    with CaptureReader(args.file) as capture:
+        print("Started:   {0}".format(time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(capture.start_time))))
+        print("Records:   {0}".format(len(capture)))
+        print("Duration:  {0:.3f} sec".format(capture.duration_ns() / 1e9))
+        universes = {}
+        for index in range(len(capture)):
+            universe = struct.unpack_from("<H", capture.buffer, HEADER_SIZE + index * RECORD_SIZE + 12)[0]
+            universes[universe] = universes.get(universe, 0) + 1
+        for universe in sorted(universes.keys()):
+            print("Universe {0}: {1} frames".format(universe, universes[universe]))
+
+
+#
+# Run as an application
+#
+if __name__ == "__main__":
+    main()
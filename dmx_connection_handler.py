@@ -17,7 +17,7 @@
 
 import app_logger
 from configuration import Configuration
-from threading import Lock
+from dmx_frame_store import FrameStore
 
 logger = app_logger.getAppLogger()
 
@@ -35,8 +35,12 @@ class DMXConnectionHandler:
     range is 1 to 512. Note that the body is ALWAYS 512 bytes.
     """
 
-    frame_list = []
-    frame_lock = Lock()
+    # Universe state shared with the DMX window and other consumers
+    frame_store = None
+
+    # Listening port: universe number. Frames arriving on a port that
+    # is not in the map go to universe 0.
+    port_universes = {}
 
     def __init__(self):
         """
@@ -46,39 +50,147 @@ class DMXConnectionHandler:
         Body = 512 bytes (always this size)
         Trailer = 4 bytes of 0xFF
         """
+        # The universe for this connection's port, looked up on first use
+        self._universe = None
+        # Latency statistics for this connection, created on first use
+        self._latency = None
+        # FrameSlot used with the lock-free handoff
+        self._slot = None
 
     def execute_command(self, port, dmx_data):
         """
         Execute a client command/request.
-        :param port: The port number receiving the request. It can be used
-        to qualify or discriminate the request. The idea is to be able to
-        map a port number to a device.
-        :param dmx_data: The DMX data sent by the client as a list of bytes
+        :param port: The port number receiving the request. It is mapped
+        to the universe that the frame updates.
+        :param dmx_data: The DMX data sent by the client as a bytes-like
+        object. It may be a view of the server's receive buffer that is
+        only valid for the duration of the call.
         :return: None
         """
         # print("Frame received:", len(dmx_data))
-        # Let's reformat the frame into something that the DMX window can readily use
-        DMXConnectionHandler.frame_lock.acquire()
+        if self._universe is None:
+            self._bind(port)
+        if self._slot is not None:
+            DMXConnectionHandler.get_frame_store().put(self._slot, dmx_data)
+        else:
+            DMXConnectionHandler.get_frame_store().update(self._universe, dmx_data, self._latency)
+
+        return None
+
+    def execute_frames(self, port, frames):
+        """
+        Execute several frames that arrived back-to-back.
+        :param port: The port number receiving the frames
+        :param frames: A list of DMX data frames, oldest first
+        :return: None
+        """
+        if self._universe is None:
+            self._bind(port)
+        if self._slot is not None:
+            DMXConnectionHandler.get_frame_store().put_many(self._slot, frames)
+        else:
+            DMXConnectionHandler.get_frame_store().update_many(self._universe, frames, self._latency)
+
+        return None
+
+    def close(self):
+        """
+        Called by the server when the connection has closed
+        :return: None
+        """
+        if self._slot is not None:
+            self._slot.close()
+            self._slot = None
+        if self._latency is not None:
+            DMXConnectionHandler.get_frame_store().unregister_connection(self._latency)
+            self._latency = None
 
-        DMXConnectionHandler.frame_list.append(dmx_data)
+        return None
 
-        DMXConnectionHandler.frame_lock.release()
+    def _bind(self, port):
+        """
+        Look up the universe for the connection's port and start
+        tracking the connection's latency
+        :param port: The port number receiving the connection
+        :return:
+        """
+        self._universe = DMXConnectionHandler.port_universes.get(port, 0)
+        frame_store = DMXConnectionHandler.get_frame_store()
+        self._latency = frame_store.register_connection(
+            "port {0}, universe {1}".format(port, self._universe),
+            labels=(("port", port), ("universe", self._universe)))
+        if frame_store.handoff == FrameStore.HANDOFF_LOCK_FREE:
+            self._slot = frame_store.open_slot(self._universe, self._latency)
+
+    def execute_universe(self, universe, dmx_data):
+        """
+        Apply a frame to a universe given directly by number, as done by
+        receivers whose protocol addresses universes itself (Art-Net).
+        :param universe: Universe number
+        :param dmx_data: The DMX data as a bytes-like object. It may be a
+        view that is only valid for the duration of the call.
+        :return: None
+        """
+        DMXConnectionHandler.get_frame_store().update(universe, dmx_data)
 
         return None
 
     @classmethod
-    def get_frame(cls):
+    def set_universe_ports(cls, ports):
         """
-        Gets the next available DMX data frame. The frame is a list of bytes.
-        :return: Returns the frame or None
+        Map listening ports to universes
+        :param ports: List of port numbers. The port at index n
+        receives frames for universe n.
+        :return:
+        """
+        cls.port_universes = {port: universe for universe, port in enumerate(ports)}
+
+    @classmethod
+    def set_frame_store(cls, frame_store):
+        """
+        Frame store injection
+        :param frame_store: A FrameStore instance
+        :return:
         """
-        frame = None
+        cls.frame_store = frame_store
 
-        DMXConnectionHandler.frame_lock.acquire()
+    @classmethod
+    def get_frame_store(cls):
+        """
+        Returns the frame store, creating one from the configuration
+        if none has been injected.
+        :return: A FrameStore instance
+        """
+        if cls.frame_store is None:
+            cls.frame_store = FrameStore(queue_size=Configuration.frame_queue_size(),
+                                         queue_policy=Configuration.frame_queue_policy(),
+                                         handoff=Configuration.frame_handoff())
+        return cls.frame_store
 
-        if len(cls.frame_list):
-            frame = cls.frame_list.pop()
+    @classmethod
+    def get_frame(cls, universe=0):
+        """
+        Gets the next available DMX data frame. The frame is a list of bytes.
+        Frames are returned oldest first.
+        :param universe: Universe number
+        :return: Returns the frame or None
+        """
+        return cls.get_frame_store().get_frame(universe)
 
-        DMXConnectionHandler.frame_lock.release()
+    @classmethod
+    def get_latest_frame(cls, universe=0):
+        """
+        Gets the most recent DMX data frame, discarding any older
+        frames that have not been read.
+        :param universe: Universe number
+        :return: Returns the frame or None
+        """
+        return cls.get_frame_store().get_latest_frame(universe)
 
-        return frame
+    @classmethod
+    def frames_received(cls, universe=0):
+        """
+        Returns the total number of frames received
+        :param universe: Universe number
+        """
+        return cls.get_frame_store().universe(universe).frames_received
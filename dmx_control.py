@@ -0,0 +1,508 @@
+#
+# DMX Emulator control channel
+# Copyright © 2019  Dave Hocker (email: AtHomeX10@gmail.com)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the LICENSE file for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program (the LICENSE file).  If not, see <http://www.gnu.org/licenses/>.
+#
+
+#
+# Serves the newline/JSON protocol of dmxsocketserver.CommandHandler on a
+# listener of its own, for reading the emulator's state from scripts and
+# automated tests.
+#
+# The state comes from a ControlSink registered with the frame scheduler,
+# never from the frame store directly, so queries do not take frames
+# away from the window or the sinks and never touch the receive path.
+# Replies are JSON text built once per change (channel values) or once
+# per stats_interval (statistics) and shared by every client. Change
+# notifications are only built when a subscriber asks for one.
+#
+
+import json
+import select
+import socket
+import socketserver
+import threading
+import time
+from collections import OrderedDict
+from dmxsocketserver.CommandHandler import CommandHandler
+from dmxsocketserver.TCPRequestHandler import TCPRequestHandler
+from dmx_sinks import FrameSink
+import app_logger
+
+logger = app_logger.getAppLogger()
+
+DMX_UNIVERSE_SIZE = 512
+
+
+def _reply(values):
+    """
+    Serialize a reply the way CommandHandler.Response does
+    :param values: An OrderedDict starting with command and result
+    :return: The reply text, newline terminated
+    """
+    return json.dumps(values) + CommandHandler.END_RESPONSE_DELIMITER
+
+
+class PreparedResponse:
+    """
+    A response whose JSON text was built ahead of time. It stands in for
+    a CommandHandler.Response.
+    """
+
+    def __init__(self, text):
+        self._text = text
+
+    def is_closed(self):
+        return False
+
+    def __str__(self):
+        return self._text
+
+
+class Subscriber:
+    """
+    The change notifications waiting for one control connection. The
+    sink marks a universe as pending and wakes the connection's thread
+    through a socket pair, so the thread can wait for notifications and
+    commands with a single select(). A connection that is slow to read
+    gets the newest state of each universe, not a backlog.
+    """
+
+    def __init__(self):
+        self.universes = set()
+        # universe: (change number, channel values) last sent. Only used
+        # on the connection's thread.
+        self.sent = {}
+        self._pending = set()
+        self._lock = threading.Lock()
+        self.wake_receiver, self._wake_sender = socket.socketpair()
+        self._wake_sender.setblocking(False)
+
+    def notify(self, universe):
+        """
+        Mark a universe as changed. Called on the sink's thread.
+        :param universe: Universe number
+        :return:
+        """
+        with self._lock:
+            wake = not self._pending
+            self._pending.add(universe)
+        if wake:
+            try:
+                self._wake_sender.send(b"\x00")
+            except OSError:
+                # Already awake, or the connection is closing
+                pass
+
+    def take(self):
+        """
+        Collect the changed universes. Called on the connection's thread
+        when wake_receiver is readable.
+        :return: Sorted list of universe numbers
+        """
+        self.wake_receiver.recv(4096)
+        with self._lock:
+            pending, self._pending = self._pending, set()
+        return sorted(pending)
+
+    def close(self):
+        self.wake_receiver.close()
+        self._wake_sender.close()
+
+
+class ControlSink(FrameSink):
+    """
+    Keeps the newest channel values of every universe for the control
+    channel, the cached replies built from them and the statistics
+    reply, and passes changes on to subscribers.
+    """
+
+    # Cached get replies kept before the cache is cleared
+    max_cached_replies = 1024
+
+    def __init__(self, frame_store, stats_interval=1.0):
+        """
+        Constructor
+        :param frame_store: The FrameStore reported on by stats
+        :param stats_interval: Seconds between statistics refreshes
+        """
+        self._frame_store = frame_store
+        self._stats_interval = stats_interval
+        # universe: (change number, channel values)
+        self._frames = {}
+        # (universe, start, count): (change number, reply text)
+        self._replies = {}
+        # universe: (change number, {change number sent before: text})
+        # for the newest change. Subscribers that are in step share the
+        # same text.
+        self._notifications = {}
+        self._notifications_lock = threading.Lock()
+        # Universes changed since the last tick
+        self._changed = []
+        self._subscribers = []
+        self._subscribers_lock = threading.Lock()
+        self._stats = None
+        self._next_stats = None
+        # universe: frames_received at the last refresh
+        self._last_received = {}
+        self._last_stats_time = None
+
+        # Statistics
+        self.connections = 0
+
+    def frame(self, universe, dmx_data):
+        # Notifications are built by notification(), when a subscriber
+        # wants one, so an unwatched universe costs nothing here
+        previous = self._frames.get(universe)
+        self._frames[universe] = (previous[0] + 1 if previous else 1, dmx_data)
+        self._changed.append(universe)
+
+    def tick(self, now):
+        if self._changed:
+            changed, self._changed = self._changed, []
+            for subscriber in self._subscribers:
+                for universe in changed:
+                    if universe in subscriber.universes:
+                        subscriber.notify(universe)
+        if self._next_stats is None or now >= self._next_stats:
+            self._next_stats = now + self._stats_interval
+            self._stats = self._build_stats(now)
+
+    def get(self, universe, start=1, count=None):
+        """
+        Returns the get reply for a range of channels
+        :param universe: Universe number
+        :param start: First channel, 1-512
+        :param count: Number of channels. None for the rest of the frame.
+        :return: The reply text, or None if the universe has no frame
+        """
+        current = self._frames.get(universe)
+        if current is None:
+            return None
+        key = (universe, start, count)
+        cached = self._replies.get(key)
+        if cached is not None and cached[0] == current[0]:
+            return cached[1]
+
+        change, dmx_data = current
+        end = len(dmx_data) if count is None else min(len(dmx_data), start - 1 + count)
+        reply = OrderedDict()
+        reply["command"] = "get"
+        reply["result"] = CommandHandler.OK_RESPONSE
+        reply["universe"] = universe
+        reply["change"] = change
+        reply["start"] = start
+        reply["channels"] = list(dmx_data[start - 1:end])
+        text = _reply(reply)
+        if len(self._replies) >= ControlSink.max_cached_replies:
+            self._replies = {}
+        self._replies[key] = (change, text)
+        return text
+
+    def notification(self, universe, sent=None):
+        """
+        Returns the notification for the newest change of a universe. Its
+        changed channels are those that differ from what the subscriber
+        was last sent, however many changes it missed in between.
+        :param universe: Universe number
+        :param sent: (change number, channel values) last sent to the
+        subscriber, or None if it has been sent nothing
+        :return: ((change number, channel values), text), or (None, None)
+        if there is no frame or the subscriber is up to date
+        """
+        current = self._frames.get(universe)
+        if current is None or (sent is not None and sent[0] == current[0]):
+            return None, None
+        change, dmx_data = current
+        since = sent[0] if sent is not None else 0
+        with self._notifications_lock:
+            cached = self._notifications.get(universe)
+            if cached is None or cached[0] != change:
+                cached = (change, {})
+                self._notifications[universe] = cached
+            text = cached[1].get(since)
+            if text is None:
+                if sent is None:
+                    changed = list(range(1, len(dmx_data) + 1))
+                else:
+                    old = sent[1]
+                    changed = [channel + 1 for channel in range(max(len(old), len(dmx_data)))
+                               if channel >= len(old) or channel >= len(dmx_data) or
+                               old[channel] != dmx_data[channel]]
+                notification = OrderedDict()
+                notification["command"] = "subscribe"
+                notification["result"] = CommandHandler.OK_RESPONSE
+                notification["event"] = "changed"
+                notification["universe"] = universe
+                notification["change"] = change
+                notification["changed"] = changed
+                notification["channels"] = list(dmx_data)
+                text = _reply(notification)
+                cached[1][since] = text
+        return current, text
+
+    def stats(self):
+        """
+        Returns the stats reply text, refreshed every stats_interval
+        """
+        if self._stats is None:
+            self._stats = self._build_stats(time.monotonic())
+        return self._stats
+
+    def _build_stats(self, now):
+        # Counters are read without locks, as the metrics endpoint does
+        elapsed = now - self._last_stats_time if self._last_stats_time is not None else None
+        self._last_stats_time = now
+        universes = []
+        for universe in self._frame_store.universes():
+            state = self._frame_store.universe(universe)
+            received = state.frames_received
+            entry = OrderedDict()
+            entry["universe"] = universe
+            entry["frames_received"] = received
+            entry["frames_per_sec"] = (received - self._last_received.get(universe, 0)) / elapsed \
+                if elapsed else None
+            entry["bytes_received"] = state.bytes_received
+            entry["frames_dropped"] = state.frames_dropped
+            entry["frames_coalesced"] = state.frames_coalesced
+            entry["frames_rendered"] = state.frames_rendered
+            entry["queue_depth"] = state.queue_depth()
+            entry["latency"] = state.latency.to_dict()
+            universes.append(entry)
+            self._last_received[universe] = received
+
+        connections = []
+        for tracker in self._frame_store.connections():
+            entry = OrderedDict()
+            entry["connection"] = tracker.name
+            entry["frames_received"] = tracker.frames_received
+            entry["bytes_received"] = tracker.bytes_received
+            entry["latency"] = tracker.to_dict()
+            connections.append(entry)
+
+        reply = OrderedDict()
+        reply["command"] = "stats"
+        reply["result"] = CommandHandler.OK_RESPONSE
+        reply["time"] = time.time()
+        reply["universes"] = universes
+        reply["active_connections"] = len(connections)
+        reply["connections"] = connections
+        reply["frames_rejected"] = OrderedDict([
+            ("oversize", TCPRequestHandler.frames_rejected_oversize),
+            ("invalid", TCPRequestHandler.frames_rejected_invalid),
+            ("short", TCPRequestHandler.frames_rejected_short),
+        ])
+        reply["control_connections"] = self.connections
+        return _reply(reply)
+
+    def subscribe(self, subscriber, universe):
+        """
+        Stream a universe's changes to a subscriber, starting with its
+        current state
+        :param subscriber: A Subscriber
+        :param universe: Universe number
+        :return:
+        """
+        with self._subscribers_lock:
+            subscriber.universes.add(universe)
+            if subscriber not in self._subscribers:
+                self._subscribers = self._subscribers + [subscriber]
+        if universe in self._frames:
+            subscriber.notify(universe)
+
+    def unsubscribe(self, subscriber, universe=None):
+        """
+        Stop streaming a universe, or every universe
+        :param subscriber: A Subscriber
+        :param universe: Universe number. None for all.
+        :return:
+        """
+        with self._subscribers_lock:
+            if universe is None:
+                subscriber.universes.clear()
+                subscriber.sent.clear()
+            else:
+                subscriber.universes.discard(universe)
+                subscriber.sent.pop(universe, None)
+            if not subscriber.universes:
+                self._subscribers = [s for s in self._subscribers if s is not subscriber]
+
+
+class ControlCommandHandler(CommandHandler):
+    """
+    CommandHandler with the control channel commands:
+        get <universe> [start] [count]  current channel values
+        stats                           throughput, latency and connection counters
+        subscribe <universe>            stream change notifications
+        unsubscribe [universe]          stop streaming
+    One instance is created per connection.
+    """
+
+    def __init__(self, sink):
+        """
+        Constructor
+        :param sink: The server's ControlSink
+        """
+        super(ControlCommandHandler, self).__init__()
+        self._sink = sink
+        self.subscriber = Subscriber()
+        self._valid_commands["get"] = self.get_channels
+        self._valid_commands["stats"] = self.get_stats
+        self._valid_commands["subscribe"] = self.subscribe
+        self._valid_commands["unsubscribe"] = self.unsubscribe
+
+    @staticmethod
+    def _error(tokens, message):
+        r = CommandHandler.Response(tokens[0], result=CommandHandler.ERROR_RESPONSE)
+        r.set_value("messages", message)
+        return r
+
+    def get_channels(self, tokens, command):
+        """
+        get <universe> [start] [count]
+        :param tokens:
+        :param command:
+        :return:
+        """
+        try:
+            universe = int(tokens[1])
+            start = int(tokens[2]) if len(tokens) > 2 else 1
+            count = int(tokens[3]) if len(tokens) > 3 else None
+        except (IndexError, ValueError):
+            return self._error(tokens, "Usage: get <universe> [start] [count]")
+        if start < 1 or start > DMX_UNIVERSE_SIZE or (count is not None and count < 1):
+            return self._error(tokens, "Channels are 1-{0}".format(DMX_UNIVERSE_SIZE))
+        text = self._sink.get(universe, start, count)
+        if text is None:
+            return self._error(tokens, "No frames received for universe {0}".format(universe))
+        return PreparedResponse(text)
+
+    def get_stats(self, tokens, command):
+        """
+        stats
+        :param tokens:
+        :param command:
+        :return:
+        """
+        return PreparedResponse(self._sink.stats())
+
+    def subscribe(self, tokens, command):
+        """
+        subscribe <universe>
+        :param tokens:
+        :param command:
+        :return:
+        """
+        try:
+            universe = int(tokens[1])
+        except (IndexError, ValueError):
+            return self._error(tokens, "Usage: subscribe <universe>")
+        self._sink.subscribe(self.subscriber, universe)
+        r = CommandHandler.Response(tokens[0], result=CommandHandler.OK_RESPONSE)
+        r.set_value("universe", universe)
+        return r
+
+    def unsubscribe(self, tokens, command):
+        """
+        unsubscribe [universe]
+        :param tokens:
+        :param command:
+        :return:
+        """
+        try:
+            universe = int(tokens[1]) if len(tokens) > 1 else None
+        except ValueError:
+            return self._error(tokens, "Usage: unsubscribe [universe]")
+        self._sink.unsubscribe(self.subscriber, universe)
+        return CommandHandler.Response(tokens[0], result=CommandHandler.OK_RESPONSE)
+
+    def close(self):
+        """
+        Called when the connection ends
+        :return:
+        """
+        self._sink.unsubscribe(self.subscriber)
+        self.subscriber.close()
+
+
+class ControlRequestHandler(socketserver.BaseRequestHandler):
+    """
+    One control connection. Waits for command lines and change
+    notifications at the same time.
+    """
+
+    # Longest command line accepted
+    max_line = 1024
+
+    def setup(self):
+        self._handler = ControlCommandHandler(self.server.sink)
+        self.server.sink.connections += 1
+
+    def handle(self):
+        sock = self.request
+        port = sock.getsockname()[1]
+        subscriber = self._handler.subscriber
+        buffer = b""
+        while True:
+            readable = select.select([sock, subscriber.wake_receiver], [], [])[0]
+            if subscriber.wake_receiver in readable:
+                for universe in subscriber.take():
+                    if universe not in subscriber.universes:
+                        continue
+                    current, text = self.server.sink.notification(universe, subscriber.sent.get(universe))
+                    if text:
+                        sock.sendall(text.encode("utf-8"))
+                        subscriber.sent[universe] = current
+            if sock in readable:
+                data = sock.recv(4096)
+                if not data:
+                    return
+                buffer += data
+                while b"\n" in buffer:
+                    line, buffer = buffer.split(b"\n", 1)
+                    line = line.decode("utf-8", "replace").strip()
+                    if not line:
+                        continue
+                    response = self._handler.execute_command(port, line)
+                    sock.sendall(str(response).encode("utf-8"))
+                    if response.is_closed():
+                        return
+                if len(buffer) > ControlRequestHandler.max_line:
+                    logger.error("Control command line is too long, closing connection")
+                    return
+
+    def finish(self):
+        self.server.sink.connections -= 1
+        self._handler.close()
+
+
+class ControlServer(socketserver.ThreadingTCPServer):
+    """
+    TCP server for the control channel. It has the socketserver
+    interface, so SocketServerThread can run it alongside the DMX
+    listeners. Its sink must be added to the frame scheduler.
+    """
+
+    allow_reuse_address = True
+    daemon_threads = True
+    block_on_close = False
+
+    def __init__(self, server_address, frame_store):
+        """
+        Create the server and bind its socket
+        :param server_address: (host, port) tuple
+        :param frame_store: The FrameStore reported on by stats
+        """
+        self.sink = ControlSink(frame_store)
+        super(ControlServer, self).__init__(server_address, ControlRequestHandler)
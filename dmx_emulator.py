@@ -15,28 +15,72 @@
 # along with this program (the LICENSE file).  If not, see <http://www.gnu.org/licenses/>.
 #
 
+import argparse
 import logging
 import signal
 import os
 import sys
 from dmxsocketserver import SocketServerThread
+from dmxsocketserver.ArtNetServer import ArtNetServer
+from dmxsocketserver.SACNServer import SACNServer, SACN_PORT
 # import configuration
 import app_logger
 # import app_trace # in athomeutils package
 import disclaimer.disclaimer
 from configuration import Configuration
+from dmx_capture import CaptureWriter
 from dmx_connection_handler import DMXConnectionHandler
-from dmx_window import run_dmx_window
+from dmx_control import ControlServer
+from dmx_liveview import LiveViewServer
+from dmx_frame_store import FrameStore
+from dmx_headless import HeadlessRunner
+from dmx_ingest_pool import IngestPool
+from dmx_rules import RuleEngine, RulesSink
+from dmx_metrics import MetricsServer
+from dmx_scheduler import FrameScheduler
+from dmx_shared_universes import SharedUniverseExport
+from dmx_sinks import StatsSink, RecorderSink, MetricsSink
 
 terminate_service = False
 
+
+def parse_args():
+    """
+    Parse the command line
+    :return: argparse namespace
+    """
+    parser = argparse.ArgumentParser(description="DMX Emulator for AtHomeDMX")
+    parser.add_argument("--headless", action="store_true",
+                        help="Run without the emulator window (no display required)")
+    parser.add_argument("--stats-interval", type=float, default=10.0,
+                        help="Headless only. Seconds between logged frame statistics")
+    parser.add_argument("--record", metavar="FILE", default=None,
+                        help="Record universe state to FILE as JSON lines")
+    parser.add_argument("--record-rate", type=float, default=None,
+                        help="Most recorded states per second per universe (default: once per polling interval)")
+    parser.add_argument("--metrics-rate", type=float, default=None,
+                        help="Headless only. Rate at which the metrics sink consumes frames "
+                             "(default: once per polling interval)")
+    parser.add_argument("--capture", metavar="FILE", default=None,
+                        help="Capture every received frame to FILE (binary capture format)")
+    parser.add_argument("--rules", metavar="FILE", default=None,
+                        help="Check every received frame against the channel rules in FILE (JSON). "
+                             "The exit code is 1 if a rule fails.")
+    parser.add_argument("--rules-report", metavar="FILE", default=None,
+                        help="Write the rule results to FILE as JSON")
+    return parser.parse_args()
+
+
 #
 # main
 #
 def main():
     global terminate_service
 
+    args = parse_args()
     logger = logging.getLogger("dmx")
+    runner = None
+    scheduler = None
 
     # Clean up when killed
     def term_handler(signum, frame):
@@ -44,6 +88,8 @@ def main():
         logger.info("DMXEmulator received kill signal...shutting down")
         # This will break the forever loop at the foot of main()
         terminate_service = True
+        if runner:
+            runner.stop()
         sys.exit(0)
 
     # Orderly clean up of the LED emulator
@@ -87,17 +133,100 @@ def main():
 
     # This accepts connections from any network interface. It was the only
     # way to get it to work in the RPi from remote machines.
-    HOST, PORT = "0.0.0.0", Configuration.cfg_port
+    # There is one listening port per universe
+    HOST, PORTS = "0.0.0.0", Configuration.universe_ports()
+    DMXConnectionHandler.set_universe_ports(PORTS)
+
+    # Received frames go into a bounded frame store shared by the
+    # socket server and the DMX window
+    DMXConnectionHandler.set_frame_store(FrameStore(queue_size=Configuration.frame_queue_size(),
+                                                    queue_policy=Configuration.frame_queue_policy(),
+                                                    handoff=Configuration.frame_handoff()))
+    # Create the configured universes up front so they are reported
+    # before any frames arrive
+    for universe in range(len(PORTS)):
+        DMXConnectionHandler.get_frame_store().universe(universe)
+
+    # Capture every received frame, written to disk in the background
+    capture = None
+    if args.capture:
+        capture = CaptureWriter(args.capture)
+        DMXConnectionHandler.get_frame_store().add_listener(capture)
+
+    # Check every received frame against the channel rules. The results
+    # are logged by a sink and decide the exit code.
+    rules = None
+    if args.rules:
+        if Configuration.ingest_workers():
+            # Frames received by ingest workers never reach the listeners
+            logger.error("--rules cannot be used with ingest_workers: the rules would not see any TCP frames")
+            CleanUp()
+            sys.exit(2)
+        rules = RuleEngine.load(args.rules)
+        DMXConnectionHandler.get_frame_store().add_listener(rules)
+        logger.info("Checking %d channel rule(s) from %s", len(rules.rules), args.rules)
+
+    # Publish the universes in shared memory for other processes. With
+    # ingest workers, their shared block is given the export name instead.
+    ingest_workers = Configuration.ingest_workers()
+    export = None
+    if Configuration.shm_export_name() and not ingest_workers:
+        num_exported = len(PORTS)
+        if Configuration.sacn_enabled():
+            num_exported = max([num_exported] + [u + 1 for u in Configuration.sacn_universes()])
+        export = SharedUniverseExport(Configuration.shm_export_name(), num_exported)
+        DMXConnectionHandler.get_frame_store().add_listener(export)
+        logger.info("Exporting %d universes to shared memory %s", num_exported, Configuration.shm_export_name())
 
     # Create the TCP socket server on its own thread.
     # This is done so that we can handle the kill signal which
     # arrives on the main thread. If we didn't put the TCP server
     # on its own thread we would not be able to shut it down in
     # an orderly fashion.
-    server = SocketServerThread.SocketServerThread(HOST, PORT,
+    # With ingest workers, the TCP listeners run in the worker processes
+    # instead of on this thread.
+    server = SocketServerThread.SocketServerThread(HOST, [] if ingest_workers else PORTS,
                                                    DMXConnectionHandler,
                                                    connection_time_out=-1,
-                                                   frame_size=512)
+                                                   frame_size=512,
+                                                   engine=Configuration.server_engine())
+    if ingest_workers:
+        server.AddServer(IngestPool(HOST, PORTS, DMXConnectionHandler.get_frame_store(), workers=ingest_workers,
+                                    shm_name=Configuration.shm_export_name() or None),
+                         "TCP ingest workers")
+        if capture:
+            logger.warning("Frames received by ingest workers are not captured")
+
+    # Art-Net receiver, run and stopped along with the TCP listeners
+    if Configuration.artnet_enabled():
+        server.AddServer(ArtNetServer((HOST, Configuration.artnet_port()), DMXConnectionHandler()),
+                         "Art-Net")
+
+    # sACN (E1.31) receiver
+    if Configuration.sacn_enabled():
+        server.AddServer(SACNServer((HOST, SACN_PORT), DMXConnectionHandler(),
+                                    Configuration.sacn_universes(),
+                                    merge_mode=Configuration.sacn_merge(),
+                                    interface=Configuration.sacn_interface()),
+                         "sACN")
+
+    # Prometheus metrics endpoint
+    if Configuration.metrics_enabled():
+        server.AddServer(MetricsServer((HOST, Configuration.metrics_port()), DMXConnectionHandler.get_frame_store()),
+                         "Metrics")
+
+    # Control channel. Its sink is fed by the frame scheduler below.
+    control = None
+    if Configuration.control_enabled():
+        control = ControlServer((HOST, Configuration.control_port()), DMXConnectionHandler.get_frame_store())
+        server.AddServer(control, "Control channel")
+
+    # Browser live view, also fed by the frame scheduler
+    liveview = None
+    if Configuration.liveview_enabled():
+        liveview = LiveViewServer((HOST, Configuration.liveview_port()), DMXConnectionHandler.get_frame_store(),
+                                  rate=Configuration.liveview_rate())
+        server.AddServer(liveview, "Live view")
 
     # Launch the socket server
     try:
@@ -105,7 +234,40 @@ def main():
         server.Start()
 
         terminate_service = False
-        run_dmx_window(Configuration.num_channels(), Configuration.polling_interval())
+        if args.headless:
+            sinks = [StatsSink(interval=args.stats_interval), MetricsSink(rate=args.metrics_rate)]
+            if args.record:
+                sinks.append(RecorderSink(args.record, rate=args.record_rate))
+            if control:
+                sinks.append(control.sink)
+            if liveview:
+                sinks.append(liveview.sink)
+            if rules:
+                sinks.append(RulesSink(rules, report_path=args.rules_report))
+            runner = HeadlessRunner(DMXConnectionHandler.get_frame_store(), sinks,
+                                    polling_interval_ms=Configuration.polling_interval())
+            runner.run()
+        else:
+            # The scheduler runs on its own thread, so the window never
+            # holds up the sinks or the receiving threads
+            scheduler = FrameScheduler(DMXConnectionHandler.get_frame_store(),
+                                       tick_interval_ms=Configuration.polling_interval())
+            if args.record:
+                recorder = RecorderSink(args.record, rate=args.record_rate)
+                scheduler.add_sink(recorder, rate=recorder.rate, adaptive=recorder.adaptive)
+            if control:
+                scheduler.add_sink(control.sink)
+            if liveview:
+                scheduler.add_sink(liveview.sink)
+            if rules:
+                rules_sink = RulesSink(rules, report_path=args.rules_report)
+                scheduler.add_sink(rules_sink, rate=rules_sink.rate)
+            scheduler.start()
+            # tkinter is only loaded when the window is wanted
+            from dmx_window import run_dmx_window
+            run_dmx_window(Configuration.num_channels(), Configuration.polling_interval(),
+                           num_universes=Configuration.num_universes(), scheduler=scheduler,
+                           max_polling_interval=Configuration.max_polling_interval())
     except KeyboardInterrupt:
         logger.info("DMXEmulator shutting down...")
     except Exception as e:
@@ -116,7 +278,21 @@ def main():
     finally:
         # We actually get here through ctrl-c or process kill (SIGTERM)
         server.Stop()
+        if scheduler:
+            scheduler.stop()
+        if capture:
+            capture.close()
+        if export:
+            DMXConnectionHandler.get_frame_store().remove_listener(export)
+            export.close()
+        if rules:
+            DMXConnectionHandler.get_frame_store().remove_listener(rules)
+            if not rules.passed:
+                logger.error("One or more channel rules failed")
         CleanUp()
+        # A failed rule fails the run, even when it was ended by a signal
+        if rules and not rules.passed:
+            sys.exit(1)
     print("Exiting main()")
 
 
@@ -17,37 +17,89 @@
 
 import socket
 from struct import pack
+from dmxsocketserver import FrameCodec
 
 
 class DMXEmulatorClient:
     """
     Sends data to a DMX Emulator app
     """
-    def __init__(self, num_channels, host="localhost", port=5555):
+    # Seconds to wait for the reply to a HELLO
+    hello_timeout = 5.0
+
+    def __init__(self, num_channels, host="localhost", port=5555, negotiate=True):
         """
         Create an instance of a DMX Emulator client
         :param num_channels:
         :param host:
         :param port:
+        :param negotiate: Ask the emulator for protocol version 2 and
+        send each frame as the smallest of a full, delta or RLE frame.
+        Emulators that only speak version 1 are sent legacy frames.
         """
         self._num_channels = num_channels
         self._host = host
         self._port = port
+        self._negotiate = negotiate
         self._sock = None
+        # Reused by send_many
+        self._batch = bytearray()
+        # Agreed on by open()
+        self.protocol_version = FrameCodec.PROTOCOL_LEGACY
+        self._encoder = FrameCodec.FrameEncoder()
 
     def open(self):
         """
         Open the connection to the emulator app
         :return:
         """
+        self.protocol_version = FrameCodec.PROTOCOL_LEGACY
+        self._encoder.reset()
+        if not self._connect():
+            return False
+        if self._negotiate:
+            try:
+                self.protocol_version = self._hello()
+            except Exception:
+                # A version 1 emulator drops the connection on a HELLO.
+                # Connect again and send legacy frames.
+                self.close()
+                return self._connect()
+        return True
+
+    def _connect(self):
         self._sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         try:
+            # Frames are small and latency sensitive, so don't let Nagle
+            # hold them back
+            self._sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
             self._sock.connect((self._host, self._port))
         except Exception as ex:
             print(str(ex))
             return False
         return True
 
+    def _hello(self):
+        """
+        Agree on a protocol version with the emulator
+        :return: The version the emulator will use
+        """
+        self._sock.sendall(FrameCodec.typed_header(FrameCodec.FRAME_HELLO, FrameCodec.HELLO.size) +
+                           FrameCodec.HELLO.pack(FrameCodec.PROTOCOL_VERSION))
+        self._sock.settimeout(DMXEmulatorClient.hello_timeout)
+        try:
+            reply = b""
+            while len(reply) < 8:
+                block = self._sock.recv(8 - len(reply))
+                if not block:
+                    raise ConnectionError("DMXEmulatorClient: HELLO refused")
+                reply += block
+        finally:
+            self._sock.settimeout(None)
+        if reply[0:4] != FrameCodec.typed_header(FrameCodec.FRAME_HELLO, FrameCodec.HELLO.size):
+            raise ConnectionError("DMXEmulatorClient: invalid HELLO reply")
+        return FrameCodec.HELLO.unpack(reply[4:8])[0]
+
     def close(self):
         """
         Close the connection to the emulator app
@@ -62,7 +114,7 @@ class DMXEmulatorClient:
     def send(self, frame):
         """
         Send a frame to the emulator app
-        :param frame: A list of 1-512 bytes
+        :param frame: A bytes-like object of 1-512 bytes
         :return: Count of bytes sent
         """
         try:
@@ -72,27 +124,64 @@ class DMXEmulatorClient:
             return 0
         return sent
 
+    def send_many(self, frames):
+        """
+        Send several frames to the emulator app in a single write
+        :param frames: A list of bytes-like objects of 1-512 bytes each
+        :return: Count of bytes sent
+        """
+        try:
+            self._batch.clear()
+            for frame in frames:
+                if self.protocol_version >= FrameCodec.PROTOCOL_TYPED:
+                    header, frame = self._encoder.encode(frame)
+                    self._batch += header
+                else:
+                    self._batch += pack('!i', len(frame))
+                self._batch += frame
+            sent = self._block_send([self._batch])
+        except Exception as ex:
+            print(str(ex))
+            return 0
+        return sent
+
     def _frame_send(self, frame):
         """
-        Send an entire frame
+        Send an entire frame, length and data together
         :param frame:
         :return:
         """
+        if self.protocol_version >= FrameCodec.PROTOCOL_TYPED:
+            return self._block_send(list(self._encoder.encode(frame)))
         frame_size = pack('!i', len(frame))
-        sent = self._block_send(frame_size)
-        sent += self._block_send(frame)
-        return sent
+        return self._block_send([frame_size, frame])
 
-    def _block_send(self, block):
+    def _block_send(self, blocks):
         """
-        Send a block of bytes
-        :param block:
-        :return:
+        Send a list of blocks of bytes with as few system calls as
+        possible. Where the platform has sendmsg, the blocks are gathered
+        by the kernel. Partial sends are resumed with memoryview slices,
+        so nothing is copied.
+        :param blocks: List of bytes-like objects
+        :return: Count of bytes sent
         """
+        if not hasattr(self._sock, "sendmsg"):
+            # e.g. Windows
+            block = b''.join(blocks)
+            self._sock.sendall(block)
+            return len(block)
+
+        views = [memoryview(block) for block in blocks]
         total_sent = 0
-        while total_sent < len(block):
-            sent = self._sock.send(block[total_sent:])
+        while views:
+            sent = self._sock.sendmsg(views)
             if sent == 0:
                 raise RuntimeError("DMXEmulatorClient: connection to emulator broken")
             total_sent += sent
+            # Drop what was sent completely and trim a partially sent block
+            while views and sent >= len(views[0]):
+                sent -= len(views[0])
+                views.pop(0)
+            if sent:
+                views[0] = views[0][sent:]
         return total_sent
@@ -0,0 +1,765 @@
+#
+# DMX frame store - universe state shared by the socket server and its consumers
+# Copyright © 2019  Dave Hocker (email: AtHomeX10@gmail.com)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the LICENSE file for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program (the LICENSE file).  If not, see <http://www.gnu.org/licenses/>.
+#
+
+import itertools
+import time
+from collections import deque
+from threading import Lock
+from dmx_latency import LatencyTracker
+
+# A DMX universe never has more than 512 channels
+DMX_UNIVERSE_SIZE = 512
+
+
+class UniverseState:
+    """
+    The current state of one DMX universe.
+
+    The channel values live in a preallocated 512 byte buffer that is
+    overwritten in place by every received frame, so memory use does not
+    depend on how fast clients send. A sequence number is bumped for
+    every frame. Optionally, a bounded queue of recent frames is kept for
+    consumers that want to see frames individually. What happens when
+    that queue is full is determined by the queue policy.
+
+    Frames are consumed with either get_frame() (one at a time) or
+    get_latest_frame() (newest only). Each universe is meant to have one
+    consuming reader. Other readers can use snapshot().
+
+    Every frame is stamped with its monotonic receive time as it enters
+    the universe. When the reader has finished with a frame it calls
+    mark_rendered(), which records the receive to render time.
+
+    Connections using the lock-free handoff write to a FrameSlot of
+    their own instead. The newest frame of each slot is collected into
+    the universe whenever the universe is read, normally once per
+    frame scheduler tick.
+    """
+
+    def __init__(self, universe, queue_size, queue_policy):
+        """
+        Constructor
+        :param universe: Universe number
+        :param queue_size: Maximum number of queued frames
+        :param queue_policy: One of the FrameStore.POLICY_xxx values
+        """
+        self.universe = universe
+        self.buffer = bytearray(DMX_UNIVERSE_SIZE)
+        # Number of valid channels in the most recent frame
+        self.length = 0
+        self.sequence = 0
+        # time.monotonic_ns() when the most recent frame arrived
+        self.received_ns = 0
+        # LatencyTracker of the connection that sent the most recent frame
+        self.source = None
+        self.latency = LatencyTracker("universe {0}".format(universe))
+
+        # Statistics
+        self.frames_received = 0
+        self.bytes_received = 0
+        self.frames_dropped = 0
+        self.frames_coalesced = 0
+        self.frames_rendered = 0
+
+        self._queue_policy = queue_policy
+        self._queue_size = queue_size
+        if queue_policy == FrameStore.POLICY_COALESCE:
+            self._queue = None
+        elif queue_policy == FrameStore.POLICY_DROP_OLDEST:
+            # The deque discards from the left when an append would overflow
+            self._queue = deque(maxlen=queue_size)
+        else:
+            self._queue = deque()
+        # Sequence number of the last frame handed out by get_frame
+        self._read_sequence = 0
+        # Receive time and source of the last frame handed out, until
+        # it is marked rendered
+        self._read_received_ns = 0
+        self._read_source = None
+        self._lock = Lock()
+        # Sequence numbers are shared with lock-free writers, which
+        # cannot take the lock. next() on a count is atomic in CPython.
+        self._sequences = itertools.count(1)
+        # Open FrameSlots, copy on write
+        self._slots = ()
+
+    def update(self, dmx_data, source=None):
+        """
+        Apply a received frame to the universe
+        :param dmx_data: The DMX data as a bytes-like object of 1-512 bytes
+        :param source: Optional LatencyTracker of the sending connection
+        :return: The sequence number assigned to the frame
+        """
+        received_ns = time.monotonic_ns()
+        with self._lock:
+            self._apply(dmx_data, received_ns, source)
+            return self.sequence
+
+    def update_many(self, frames, source=None):
+        """
+        Apply several frames, in order, with a single lock acquisition.
+        The frames share one receive time.
+        :param frames: A list of bytes-like objects
+        :param source: Optional LatencyTracker of the sending connection
+        :return: The sequence number assigned to the last frame
+        """
+        received_ns = time.monotonic_ns()
+        with self._lock:
+            for dmx_data in frames:
+                self._apply(dmx_data, received_ns, source)
+            return self.sequence
+
+    def _apply(self, dmx_data, received_ns, source):
+        # The caller must hold the lock
+        n = min(len(dmx_data), DMX_UNIVERSE_SIZE)
+        self.buffer[0:n] = dmx_data[0:n]
+        self.length = n
+        self.sequence = next(self._sequences)
+        self.frames_received += 1
+        self.bytes_received += n
+        self.received_ns = received_ns
+        self.source = source
+        self.latency.arrived(received_ns, n)
+        if source is not None:
+            source.arrived(received_ns, n)
+        self._enqueue(received_ns, source)
+
+    def _enqueue(self, received_ns, source):
+        # The caller must hold the lock
+        n = self.length
+        if self._queue is not None:
+            if self._queue_policy == FrameStore.POLICY_DROP_OLDEST:
+                if len(self._queue) == self._queue_size:
+                    self.frames_dropped += 1
+                self._queue.append((self.sequence, received_ns, source, bytes(self.buffer[0:n])))
+            elif len(self._queue) < self._queue_size:
+                self._queue.append((self.sequence, received_ns, source, bytes(self.buffer[0:n])))
+            else:
+                # keep-all: the queue is full so the new frame only
+                # updates the universe state
+                self.frames_dropped += 1
+
+    def reserve_sequences(self, n=1):
+        """
+        Take sequence numbers for frames written without the lock, by a
+        slot. The n numbers are consecutive, even with other writers
+        taking numbers at the same time.
+        :param n: Number of frames
+        :return: The last of the n sequence numbers
+        """
+        if n == 1:
+            return next(self._sequences)
+        # islice() over a count runs in C without releasing the GIL, so
+        # no other writer can take a number in between
+        return next(itertools.islice(self._sequences, n - 1, None))
+
+    def open_slot(self, source=None):
+        """
+        Create a lock-free handoff slot for one writer
+        :param source: Optional LatencyTracker of the writing connection
+        :return: A FrameSlot
+        """
+        slot = FrameSlot(self, source)
+        self.add_slot(slot)
+        return slot
+
+    def add_slot(self, slot):
+        """
+        Add a slot to be collected into the universe. Any object with
+        FrameSlot's consumer side (collect(), collected, bytes_collected,
+        source and closed) will do.
+        :param slot: The slot
+        :return:
+        """
+        with self._lock:
+            self._slots = self._slots + (slot,)
+
+    def remove_slot(self, slot):
+        """
+        Collect a slot for the last time and remove it. Unlike close(),
+        the slot is not read again once this returns.
+        :param slot: A slot passed to add_slot()
+        :return:
+        """
+        with self._lock:
+            self._collect()
+            self._slots = tuple(s for s in self._slots if s is not slot)
+
+    def _collect(self):
+        """
+        Apply the newest frame of every slot that has been written since
+        the last collection, oldest first. Frames older than the current
+        state, and frames overwritten in a slot before they were
+        collected, are counted as received but never applied.
+        The caller must hold the lock.
+        :return:
+        """
+        slots = self._slots
+        if not slots:
+            return
+        fresh = []
+        closed = []
+        for slot in slots:
+            # closed is read before collecting. A slot seen closed has
+            # written its final frame, so this is its last collection.
+            # A slot that closes after it was collected is kept for the
+            # next collection, or its final frame would be lost.
+            if slot.closed:
+                closed.append(slot)
+            latest = slot.collect()
+            if latest is not None and latest[0] != slot.collected:
+                fresh.append(latest + (slot,))
+        # Sort on the sequence numbers
+        fresh.sort(key=lambda entry: entry[1])
+        for count, sequence, received_ns, bytes_written, frame, slot in fresh:
+            self.frames_received += count - slot.collected
+            self.bytes_received += bytes_written - slot.bytes_collected
+            slot.collected = count
+            slot.bytes_collected = bytes_written
+            if sequence < self.sequence:
+                continue
+            n = len(frame)
+            self.buffer[0:n] = frame
+            self.length = n
+            self.sequence = sequence
+            self.received_ns = received_ns
+            self.source = slot.source
+            self._enqueue(received_ns, slot.source)
+        if closed:
+            self._slots = tuple(slot for slot in slots if slot not in closed)
+
+    def snapshot(self):
+        """
+        Take a consistent copy of the current universe state
+        :return: A tuple of (sequence, frame) where frame is bytes
+        """
+        with self._lock:
+            self._collect()
+            return self.sequence, bytes(self.buffer[0:self.length])
+
+    def get_frame(self):
+        """
+        Gets the next available frame. With a queue, frames are returned
+        oldest first. Without a queue (coalesce policy), the latest state is
+        returned if it has changed since the last call.
+        :return: Returns the frame as bytes or None
+        """
+        with self._lock:
+            self._collect()
+            if self._queue is not None:
+                if len(self._queue):
+                    self._read_sequence, self._read_received_ns, self._read_source, frame = \
+                        self._queue.popleft()
+                    return frame
+                return None
+
+            return self._take_latest()
+
+    def get_latest_frame(self):
+        """
+        Gets the most recent frame if the state has changed since the
+        last read. Any older queued frames are discarded and counted
+        as coalesced.
+        :return: Returns the frame as bytes or None
+        """
+        with self._lock:
+            self._collect()
+            if self._queue is not None:
+                self._queue.clear()
+            return self._take_latest()
+
+    def get_latest_stamped(self):
+        """
+        Like get_latest_frame(), but also returns the frame's sequence
+        number, receive time and source, for consumers that render the
+        frame later and record its latency with record_rendered()
+        :return: Returns a tuple of (sequence, received_ns, source, frame)
+        or None
+        """
+        with self._lock:
+            self._collect()
+            if self._queue is not None:
+                self._queue.clear()
+            frame = self._take_latest()
+            if frame is None:
+                return None
+            return self._read_sequence, self._read_received_ns, self._read_source, frame
+
+    def _take_latest(self):
+        # The caller must hold the lock
+        if self.sequence == self._read_sequence:
+            return None
+        # Every frame between the previous read and this one was
+        # overwritten before anyone saw it
+        self.frames_coalesced += self.sequence - self._read_sequence - 1
+        self._read_sequence = self.sequence
+        self._read_received_ns = self.received_ns
+        self._read_source = self.source
+        return bytes(self.buffer[0:self.length])
+
+    def mark_rendered(self, rendered_ns=None):
+        """
+        Record that the reader has finished with the last frame it got
+        from get_frame() or get_latest_frame()
+        :param rendered_ns: time.monotonic_ns() when rendering finished.
+        Defaults to now.
+        :return: The receive to render time in ns, or None if there was
+        no unrendered frame
+        """
+        if rendered_ns is None:
+            rendered_ns = time.monotonic_ns()
+        with self._lock:
+            if not self._read_received_ns:
+                return None
+            latency = self._record_rendered(self._read_received_ns, self._read_source, rendered_ns)
+            self._read_received_ns = 0
+            self._read_source = None
+            return latency
+
+    def record_rendered(self, received_ns, source=None, rendered_ns=None):
+        """
+        Record the rendering of a frame obtained from get_latest_stamped()
+        :param received_ns: The frame's receive time
+        :param source: The frame's source
+        :param rendered_ns: time.monotonic_ns() when rendering finished.
+        Defaults to now.
+        :return: The receive to render time in ns
+        """
+        if rendered_ns is None:
+            rendered_ns = time.monotonic_ns()
+        with self._lock:
+            return self._record_rendered(received_ns, source, rendered_ns)
+
+    def _record_rendered(self, received_ns, source, rendered_ns):
+        # The caller must hold the lock
+        latency = rendered_ns - received_ns
+        self.frames_rendered += 1
+        self.latency.rendered(latency)
+        if source is not None:
+            source.rendered(latency)
+        return latency
+
+    def queue_depth(self):
+        """
+        Returns the number of queued frames
+        """
+        if self._queue is None:
+            return 0
+        return len(self._queue)
+
+
+class FrameSlot:
+    """
+    Lock-free single producer, single consumer handoff between one
+    connection and its universe.
+
+    The connection's thread (the only producer) publishes every frame by
+    replacing the latest tuple, a single reference assignment, which is
+    atomic in CPython. The universe (the only consumer) reads that
+    reference when it collects. Neither side takes a lock, so writers
+    never wait for each other or for the reader. Only the newest frame
+    is handed over, so a slot never holds more than one frame.
+    """
+
+    def __init__(self, universe_state, source=None):
+        """
+        Constructor. Use UniverseState.open_slot() or
+        FrameStore.open_slot().
+        :param universe_state: The UniverseState written to
+        :param source: Optional LatencyTracker of the writing connection
+        """
+        self.universe = universe_state.universe
+        self.source = source
+        self.closed = False
+        # (frames written, sequence, received_ns, bytes written, frame)
+        self.latest = None
+        self._universe_state = universe_state
+        self._frames_written = 0
+        self._bytes_written = 0
+        # Consumer side: counts at the last collection
+        self.collected = 0
+        self.bytes_collected = 0
+
+    def put(self, dmx_data):
+        """
+        Publish a frame. Producer thread only.
+        :param dmx_data: The DMX data as a bytes-like object of 1-512 bytes
+        :return: The sequence number assigned to the frame
+        """
+        received_ns = time.monotonic_ns()
+        n = min(len(dmx_data), DMX_UNIVERSE_SIZE)
+        sequence = self._universe_state.reserve_sequences()
+        self._frames_written += 1
+        self._bytes_written += n
+        if self.source is not None:
+            self.source.arrived(received_ns, n)
+        self.latest = (self._frames_written, sequence, received_ns, self._bytes_written, bytes(dmx_data[0:n]))
+        return sequence
+
+    def put_many(self, frames):
+        """
+        Publish several frames. Only the last one is handed over, the
+        rest are counted. Producer thread only.
+        :param frames: A list of bytes-like objects
+        :return: The sequence numbers assigned to the frames
+        """
+        received_ns = time.monotonic_ns()
+        last_sequence = self._universe_state.reserve_sequences(len(frames))
+        sequences = list(range(last_sequence - len(frames) + 1, last_sequence + 1))
+        for dmx_data in frames:
+            n = min(len(dmx_data), DMX_UNIVERSE_SIZE)
+            self._frames_written += 1
+            self._bytes_written += n
+            if self.source is not None:
+                self.source.arrived(received_ns, n)
+        last = frames[-1][0:DMX_UNIVERSE_SIZE]
+        self.latest = (self._frames_written, sequences[-1], received_ns, self._bytes_written, bytes(last))
+        return sequences
+
+    def collect(self):
+        """
+        Consumer side. Returns the newest frame, as
+        (frames written, sequence, received_ns, bytes written, frame), or
+        None if nothing has been written.
+        """
+        return self.latest
+
+    def close(self):
+        """
+        The producer is done. Frames not yet collected still are, then
+        the slot is dropped from its universe.
+        :return:
+        """
+        self.closed = True
+
+
+class FrameStore:
+    """
+    Holds the state of every universe seen by the emulator. The socket
+    server writes frames into the store and the DMX window (or any other
+    consumer) reads them back out.
+
+    Frame listeners are called for every frame as it is stored, on the
+    thread that received it, so they must be quick.
+
+    Latency statistics are kept per universe and, for connections that
+    register a tracker, per client connection.
+
+    With the locked handoff every writer takes its universe's lock for
+    every frame. With the lock-free handoff, connections write to a
+    FrameSlot of their own (see open_slot()) and only readers take the
+    lock. Frames written through slots are not queued individually,
+    and the universe's inter-arrival histogram only covers frames
+    written with update().
+    """
+
+    # Queue policies
+    # Keep the newest queue_size frames, discarding the oldest
+    POLICY_DROP_OLDEST = "drop-oldest"
+    # No queue, consumers only ever see the latest state
+    POLICY_COALESCE = "coalesce"
+    # Keep the first queue_size frames, new frames are not queued until
+    # the consumer catches up
+    POLICY_KEEP_ALL = "keep-all"
+
+    VALID_POLICIES = (POLICY_DROP_OLDEST, POLICY_COALESCE, POLICY_KEEP_ALL)
+
+    # Handoffs between connections and universes
+    # update() under the universe lock
+    HANDOFF_LOCKED = "locked"
+    # A FrameSlot per connection, collected by the reader
+    HANDOFF_LOCK_FREE = "lock-free"
+
+    VALID_HANDOFFS = (HANDOFF_LOCKED, HANDOFF_LOCK_FREE)
+
+    # Number of closed connections whose latency statistics are kept
+    CLOSED_CONNECTIONS_KEPT = 16
+
+    def __init__(self, queue_size=64, queue_policy=POLICY_DROP_OLDEST, handoff=HANDOFF_LOCKED):
+        """
+        Constructor
+        :param queue_size: Maximum number of queued frames per universe
+        :param queue_policy: What to do when a universe's queue is full
+        :param handoff: How connections hand frames to universes
+        """
+        if queue_policy not in FrameStore.VALID_POLICIES:
+            raise ValueError("Unrecognized frame queue policy: {0}".format(queue_policy))
+        if handoff not in FrameStore.VALID_HANDOFFS:
+            raise ValueError("Unrecognized frame handoff: {0}".format(handoff))
+        if queue_size < 1 and queue_policy != FrameStore.POLICY_COALESCE:
+            raise ValueError("Frame queue size must be at least 1")
+
+        self._queue_size = queue_size
+        self._queue_policy = queue_policy
+        self._handoff = handoff
+        self._universes = {}
+        self._lock = Lock()
+        self._listeners = []
+        # Open client connections: LatencyTracker
+        self._connections = []
+        self._connection_count = 0
+        # The most recently closed connections, so short lived ones
+        # still show up in reports
+        self._closed_connections = deque(maxlen=FrameStore.CLOSED_CONNECTIONS_KEPT)
+        # labels: LatencyTracker with the totals of every closed
+        # connection with those labels
+        self._closed_totals = {}
+
+    @property
+    def queue_policy(self):
+        return self._queue_policy
+
+    @property
+    def queue_size(self):
+        return self._queue_size
+
+    @property
+    def handoff(self):
+        return self._handoff
+
+    def universe(self, universe):
+        """
+        Return the state for a universe, creating it on first use
+        :param universe: Universe number
+        :return: A UniverseState instance
+        """
+        state = self._universes.get(universe)
+        if state is None:
+            with self._lock:
+                state = self._universes.get(universe)
+                if state is None:
+                    state = UniverseState(universe, self._queue_size, self._queue_policy)
+                    self._universes[universe] = state
+        return state
+
+    def add_listener(self, listener):
+        """
+        Register a frame listener
+        :param listener: Callable taking (universe, sequence, dmx_data).
+        dmx_data may be a view that is only valid during the call.
+        :return:
+        """
+        # Copy on write so update() can iterate without a lock
+        self._listeners = self._listeners + [listener]
+
+    def remove_listener(self, listener):
+        """
+        Unregister a frame listener
+        :param listener: A callable passed to add_listener
+        :return:
+        """
+        self._listeners = [l for l in self._listeners if l is not listener]
+
+    def universes(self):
+        """
+        Returns a sorted list of the universe numbers in the store
+        """
+        return sorted(self._universes.keys())
+
+    def update(self, universe, dmx_data, source=None):
+        """
+        Apply a received frame to a universe
+        :param universe: Universe number
+        :param dmx_data: The DMX data as a bytes-like object
+        :param source: Optional LatencyTracker of the sending connection
+        :return: The sequence number assigned to the frame
+        """
+        sequence = self.universe(universe).update(dmx_data, source)
+        for listener in self._listeners:
+            listener(universe, sequence, dmx_data)
+        return sequence
+
+    def open_slot(self, universe, source=None):
+        """
+        Create a lock-free handoff slot for one connection
+        :param universe: Universe number
+        :param source: Optional LatencyTracker of the connection
+        :return: A FrameSlot. Write frames with put() or put_many() and
+        close it when the connection closes.
+        """
+        return self.universe(universe).open_slot(source)
+
+    def put(self, slot, dmx_data):
+        """
+        Publish a frame through a slot and call the frame listeners
+        :param slot: A FrameSlot from open_slot()
+        :param dmx_data: The DMX data as a bytes-like object
+        :return: The sequence number assigned to the frame
+        """
+        sequence = slot.put(dmx_data)
+        for listener in self._listeners:
+            listener(slot.universe, sequence, dmx_data)
+        return sequence
+
+    def put_many(self, slot, frames):
+        """
+        Publish several frames through a slot and call the frame listeners
+        :param slot: A FrameSlot from open_slot()
+        :param frames: A list of bytes-like objects
+        :return: The sequence number assigned to the last frame
+        """
+        sequences = slot.put_many(frames)
+        listeners = self._listeners
+        if listeners:
+            for sequence, dmx_data in zip(sequences, frames):
+                for listener in listeners:
+                    listener(slot.universe, sequence, dmx_data)
+        return sequences[-1]
+
+    def update_many(self, universe, frames, source=None):
+        """
+        Apply several received frames to a universe
+        :param universe: Universe number
+        :param frames: A list of bytes-like objects
+        :param source: Optional LatencyTracker of the sending connection
+        :return: The sequence number assigned to the last frame
+        """
+        sequence = self.universe(universe).update_many(frames, source)
+        listeners = self._listeners
+        if listeners:
+            first = sequence - len(frames) + 1
+            for i, dmx_data in enumerate(frames):
+                for listener in listeners:
+                    listener(universe, first + i, dmx_data)
+        return sequence
+
+    def get_frame(self, universe):
+        """
+        Gets the next available frame for a universe
+        :param universe: Universe number
+        :return: Returns the frame or None
+        """
+        return self.universe(universe).get_frame()
+
+    def get_latest_frame(self, universe):
+        """
+        Gets the most recent frame for a universe, collapsing older ones
+        :param universe: Universe number
+        :return: Returns the frame or None
+        """
+        return self.universe(universe).get_latest_frame()
+
+    def snapshot(self, universe):
+        """
+        Take a copy of the current universe state
+        :param universe: Universe number
+        :return: A tuple of (sequence, frame)
+        """
+        return self.universe(universe).snapshot()
+
+    def mark_rendered(self, universe, rendered_ns=None):
+        """
+        Record that the consumer of a universe has finished rendering the
+        last frame it got
+        :param universe: Universe number
+        :param rendered_ns: time.monotonic_ns() when rendering finished.
+        Defaults to now.
+        :return: The receive to render time in ns or None
+        """
+        return self.universe(universe).mark_rendered(rendered_ns)
+
+    def get_latest_stamped(self, universe):
+        """
+        Gets the most recent frame for a universe with its sequence
+        number, receive time and source
+        :param universe: Universe number
+        :return: A tuple of (sequence, received_ns, source, frame) or None
+        """
+        return self.universe(universe).get_latest_stamped()
+
+    def record_rendered(self, universe, received_ns, source=None, rendered_ns=None):
+        """
+        Record the rendering of a frame obtained from get_latest_stamped()
+        :param universe: Universe number
+        :param received_ns: The frame's receive time
+        :param source: The frame's source
+        :param rendered_ns: time.monotonic_ns() when rendering finished
+        :return: The receive to render time in ns
+        """
+        return self.universe(universe).record_rendered(received_ns, source, rendered_ns)
+
+    def register_connection(self, description, labels=()):
+        """
+        Create a latency tracker for a client connection
+        :param description: Describes the connection in reports
+        :param labels: (name, value) pairs shared by every connection to
+        the same place, e.g. (("port", 5555), ("universe", 0)). Metrics
+        are kept per set of labels, not per connection.
+        :return: A LatencyTracker to pass to update() and update_many()
+        """
+        with self._lock:
+            self._connection_count += 1
+            tracker = LatencyTracker("connection {0} ({1})".format(self._connection_count, description), labels)
+            self._connections = self._connections + [tracker]
+        return tracker
+
+    def unregister_connection(self, tracker):
+        """
+        Move a connection to the closed list
+        :param tracker: A LatencyTracker from register_connection()
+        :return:
+        """
+        with self._lock:
+            self._connections = [t for t in self._connections if t is not tracker]
+            self._closed_connections.append(tracker)
+            totals = self._closed_totals.get(tracker.labels)
+            if totals is None:
+                totals = LatencyTracker("closed connections", tracker.labels)
+                self._closed_totals[tracker.labels] = totals
+            totals.merge(tracker)
+
+    def connections(self):
+        """
+        Returns the latency trackers of the open connections
+        """
+        return self._connections
+
+    def connection_series(self):
+        """
+        Totals of every connection, open or closed, per set of labels.
+        However often clients reconnect, there is one entry per port and
+        universe, and its counts never go down.
+        :return: A list of (labels, open connections, LatencyTracker),
+        sorted on the labels
+        """
+        with self._lock:
+            series = {}
+            for labels, totals in self._closed_totals.items():
+                tracker = LatencyTracker("connections", labels)
+                tracker.merge(totals)
+                series[labels] = [0, tracker]
+            for connection in self._connections:
+                entry = series.get(connection.labels)
+                if entry is None:
+                    entry = [0, LatencyTracker("connections", connection.labels)]
+                    series[connection.labels] = entry
+                entry[0] += 1
+                entry[1].merge(connection)
+        return [(labels, entry[0], entry[1]) for labels, entry in sorted(series.items())]
+
+    def latency_report(self):
+        """
+        Summarize the latency histograms of every universe and of the
+        open and recently closed connections
+        :return: A dict with "universes", "connections" and
+        "closed_connections" entries
+        """
+        return {
+            "universes": {universe: self.universe(universe).latency.to_dict() for universe in self.universes()},
+            "connections": {tracker.name: tracker.to_dict() for tracker in self._connections},
+            "closed_connections": {tracker.name: tracker.to_dict() for tracker in list(self._closed_connections)},
+        }
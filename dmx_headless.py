@@ -0,0 +1,74 @@
+#
+# DMX Emulator headless runner - consumes frames without a UI
+# Copyright © 2019  Dave Hocker (email: AtHomeX10@gmail.com)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the LICENSE file for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program (the LICENSE file).  If not, see <http://www.gnu.org/licenses/>.
+#
+
+import app_logger
+from dmx_scheduler import FrameScheduler
+
+logger = app_logger.getAppLogger()
+
+
+class HeadlessRunner:
+    """
+    Takes the place of the DMX window when there is no display. A frame
+    scheduler hands the newest frame of every changed universe to each
+    sink, at the sink's own rate or once per polling interval.
+    """
+
+    def __init__(self, frame_store, sinks, polling_interval_ms=30):
+        """
+        Constructor
+        :param frame_store: The FrameStore to consume
+        :param sinks: A list of FrameSink instances
+        :param polling_interval_ms: Polling time in ms
+        """
+        self._sinks = sinks
+        self._scheduler = FrameScheduler(frame_store, tick_interval_ms=polling_interval_ms)
+        for sink in sinks:
+            self._scheduler.add_sink(sink, rate=sink.rate, adaptive=sink.adaptive)
+
+    @property
+    def scheduler(self):
+        return self._scheduler
+
+    def run(self):
+        """
+        Poll until stop() is called. Runs on the calling thread.
+        :return:
+        """
+        logger.info("Headless runner started with %d sink(s)", len(self._sinks))
+        try:
+            self._scheduler.run()
+        finally:
+            for scheduled in self._scheduler.sinks():
+                if scheduled.frames_skipped:
+                    logger.info("%s skipped %d frame(s)", type(scheduled.sink).__name__, scheduled.frames_skipped)
+            logger.info("Headless runner stopped")
+
+    def poll(self, now):
+        """
+        Run one scheduler tick
+        :param now: time.monotonic() at the start of the poll
+        :return:
+        """
+        self._scheduler.tick(now)
+
+    def stop(self):
+        """
+        Ask run() to return. May be called from any thread.
+        :return:
+        """
+        self._scheduler.stop()
@@ -0,0 +1,249 @@
+#
+# DMX Emulator multi-process ingestion
+# Copyright © 2019  Dave Hocker (email: AtHomeX10@gmail.com)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the LICENSE file for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program (the LICENSE file).  If not, see <http://www.gnu.org/licenses/>.
+#
+
+#
+# TCP frames are parsed in worker processes, each with its own GIL.
+# Universe n is served by worker n % workers, which listens on the
+# universe's port with an asyncio TCP server and writes every frame to
+# the universe's slot in a shared memory block (dmx_shared_universes.py).
+# In the main process each universe collects its shared slot once per
+# frame scheduler tick, so the window, sinks and metrics work unchanged.
+#
+
+import multiprocessing
+import signal
+import threading
+from dmxsocketserver.AsyncTCPServer import AsyncTCPServer
+from dmxsocketserver.TCPRequestHandler import TCPRequestHandler
+from dmx_shared_universes import SharedUniverses
+import app_logger
+
+logger = app_logger.getAppLogger()
+
+
+class SharedMemoryConnectionHandler:
+    """
+    Command handler for the TCP servers of an ingest worker. Frames are
+    written straight to shared memory. A worker's event loop is its only
+    writer, so every universe slot has a single writer.
+    """
+
+    # SharedUniverses of the worker
+    shared = None
+    # Listening port: universe number
+    port_universes = {}
+
+    def execute_command(self, port, dmx_data):
+        """
+        Write a frame to the shared slot of the port's universe
+        :param port: The port number receiving the frame
+        :param dmx_data: The DMX data as a bytes-like object
+        :return: None
+        """
+        SharedMemoryConnectionHandler.shared.write(SharedMemoryConnectionHandler.port_universes.get(port, 0),
+                                                   dmx_data)
+        return None
+
+    def close(self):
+        return None
+
+
+def run_worker(shm_name, host, port_universes, frame_size, ready, stop_event):
+    """
+    Ingest worker process
+    :param shm_name: Name of the shared universe block
+    :param host: Address to listen on
+    :param port_universes: Dict of port: universe served by this worker
+    :param frame_size: Largest accepted frame
+    :param ready: Connection on which "ok" or an error is reported once
+    :param stop_event: multiprocessing.Event set to stop the worker
+    :return:
+    """
+    # Ctrl-C is handled by the main process, which stops the workers
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    try:
+        shared = SharedUniverses.attach(shm_name)
+        SharedMemoryConnectionHandler.shared = shared
+        SharedMemoryConnectionHandler.port_universes = port_universes
+        TCPRequestHandler.set_command_handler_class(SharedMemoryConnectionHandler)
+        TCPRequestHandler.set_max_frame_size(frame_size)
+        server = AsyncTCPServer([(host, port) for port in sorted(port_universes.keys())])
+    except Exception as ex:
+        ready.send(str(ex))
+        return
+    ready.send("ok")
+
+    thread = threading.Thread(target=server.serve_forever)
+    thread.start()
+    stop_event.wait()
+    server.shutdown()
+    thread.join()
+    server.server_close()
+    SharedMemoryConnectionHandler.shared = None
+    shared.close()
+
+
+class SharedUniverseSlot:
+    """
+    The main process side of a shared universe slot. It has FrameSlot's
+    consumer interface, so a UniverseState collects it like the slot of
+    a lock-free connection.
+    """
+
+    def __init__(self, shared, universe_state):
+        """
+        Constructor
+        :param shared: The SharedUniverses block
+        :param universe_state: The UniverseState the slot is collected into
+        """
+        self.universe = universe_state.universe
+        self.source = None
+        self.closed = False
+        self.collected = 0
+        self.bytes_collected = 0
+        self._shared = shared
+        self._universe_state = universe_state
+        self._version = 0
+        # (frames written, sequence, received_ns, bytes written, frame)
+        # as of the last collect()
+        self.latest = None
+
+    def collect(self):
+        """
+        Read the shared slot if it has changed since the last call.
+        Frames written since then are given sequence numbers, so those
+        that were overwritten are counted as coalesced.
+        :return: (frames written, sequence, received_ns, bytes written,
+        frame) for the newest frame, or None
+        """
+        version = self._shared.version(self.universe)
+        if version != self._version and not version & 1:
+            frame = self._shared.read(self.universe)
+            if frame is not None:
+                written = frame.frames_received - (self.latest[0] if self.latest else 0)
+                if written > 0:
+                    sequence = self._universe_state.reserve_sequences(written)
+                    self.latest = (frame.frames_received, sequence, frame.received_ns,
+                                   frame.bytes_received, frame.data)
+                self._version = frame.version
+        return self.latest
+
+
+class IngestPool:
+    """
+    Runs the TCP listeners of every universe in worker processes.
+
+    It has the socketserver interface (serve_forever(), shutdown() and
+    server_close()), so SocketServerThread.AddServer() runs it alongside
+    the other receivers. The workers are started, and their ports bound,
+    by the constructor, so a port in use is reported straight away.
+    """
+
+    def __init__(self, host, ports, frame_store, workers=2, frame_size=512, shm_name=None):
+        """
+        Constructor
+        :param host: Address to listen on
+        :param ports: List of port numbers. The port at index n receives
+        frames for universe n.
+        :param frame_store: The FrameStore the universes are collected into
+        :param workers: Number of worker processes
+        :param frame_size: Largest accepted frame
+        :param shm_name: Name of the shared universe block. None for a
+        generated name. A named block doubles as the shared memory export.
+        """
+        workers = max(1, min(workers, len(ports)))
+        self.server_address = (host, ports[0])
+        self._frame_store = frame_store
+        self._shared = SharedUniverses.create(len(ports), name=shm_name)
+        self._stop_event = multiprocessing.Event()
+        self._shutdown_request = threading.Event()
+        self._is_shut_down = threading.Event()
+        self._is_shut_down.set()
+        self._processes = []
+
+        self._slots = []
+        for universe in range(len(ports)):
+            state = frame_store.universe(universe)
+            slot = SharedUniverseSlot(self._shared, state)
+            state.add_slot(slot)
+            self._slots.append((state, slot))
+
+        try:
+            for worker in range(workers):
+                port_universes = {port: universe for universe, port in enumerate(ports)
+                                  if universe % workers == worker}
+                receiver, sender = multiprocessing.Pipe(duplex=False)
+                process = multiprocessing.Process(target=run_worker, name="IngestWorker-{0}".format(worker),
+                                                  args=(self._shared.name, host, port_universes, frame_size,
+                                                        sender, self._stop_event))
+                process.daemon = True
+                process.start()
+                self._processes.append(process)
+                status = receiver.recv() if receiver.poll(10.0) else "worker did not start"
+                receiver.close()
+                if status != "ok":
+                    raise OSError("Ingest worker {0} failed: {1}".format(worker, status))
+        except Exception:
+            self.shutdown()
+            self.server_close()
+            raise
+        logger.info("Ingesting %d universes with %d worker processes", len(ports), workers)
+
+    @property
+    def shared(self):
+        return self._shared
+
+    def serve_forever(self):
+        """
+        Wait until shutdown() is called, then stop the workers
+        :return:
+        """
+        self._is_shut_down.clear()
+        try:
+            self._shutdown_request.wait()
+        finally:
+            self._stop_workers()
+            self._is_shut_down.set()
+
+    def shutdown(self):
+        """
+        Stop serve_forever() and wait for it to finish
+        :return:
+        """
+        self._shutdown_request.set()
+        self._is_shut_down.wait()
+        self._stop_workers()
+
+    def _stop_workers(self):
+        self._stop_event.set()
+        for process in self._processes:
+            process.join(5.0)
+            if process.is_alive():
+                process.terminate()
+                process.join()
+
+    def server_close(self):
+        """
+        Collect the universes for the last time, then remove the
+        shared block
+        :return:
+        """
+        for state, slot in self._slots:
+            state.remove_slot(slot)
+        self._slots = []
+        self._shared.close()
+        self._shared.unlink()
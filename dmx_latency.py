@@ -0,0 +1,270 @@
+#
+# DMX Emulator latency histograms
+# Copyright © 2019  Dave Hocker (email: AtHomeX10@gmail.com)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the LICENSE file for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program (the LICENSE file).  If not, see <http://www.gnu.org/licenses/>.
+#
+
+import math
+from array import array
+
+
+class LatencyHistogram:
+    """
+    A fixed size histogram of nanosecond values in the style of
+    HdrHistogram. Values are grouped into power of 2 buckets, each split
+    into a fixed number of linear sub-buckets, so every recorded value is
+    kept to within 1% (with the default 7 significant bits) however large
+    it is. Memory use is constant: about 2200 counters.
+    """
+
+    def __init__(self, significant_bits=7, max_bits=40):
+        """
+        Constructor
+        :param significant_bits: Sub-bucket resolution in bits. Values are
+        accurate to 1 part in 2**(significant_bits - 1).
+        :param max_bits: Largest trackable value in bits. 40 bits of
+        nanoseconds is about 18 minutes. Larger values are clamped.
+        """
+        self._significant_bits = significant_bits
+        self._half_count = 1 << (significant_bits - 1)
+        self._highest_value = (1 << max_bits) - 1
+        bucket_count = max_bits - significant_bits + 1
+        self._counts = array("Q", bytes(8 * (bucket_count + 1) * self._half_count))
+        self.reset()
+
+    def reset(self):
+        """
+        Clear all recorded values
+        :return:
+        """
+        for i in range(len(self._counts)):
+            self._counts[i] = 0
+        self.count = 0
+        self.min = None
+        self.max = None
+        self._total = 0
+        self._total_squares = 0
+
+    def _index(self, value):
+        bucket = value.bit_length() - self._significant_bits
+        if bucket < 0:
+            bucket = 0
+        return ((bucket + 1) * self._half_count) + (value >> bucket) - self._half_count
+
+    def _highest_equivalent_value(self, index):
+        if index < 2 * self._half_count:
+            return index
+        bucket = index // self._half_count - 1
+        sub_bucket = index - bucket * self._half_count
+        return ((sub_bucket + 1) << bucket) - 1
+
+    def record(self, value):
+        """
+        Record one value
+        :param value: Non-negative integer, normally nanoseconds
+        :return:
+        """
+        if value < 0:
+            value = 0
+        elif value > self._highest_value:
+            value = self._highest_value
+        self._counts[self._index(value)] += 1
+        self.count += 1
+        self._total += value
+        self._total_squares += value * value
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    def merge(self, other):
+        """
+        Add the values recorded by another histogram with the same
+        resolution to this one
+        :param other: A LatencyHistogram
+        :return:
+        """
+        for i, count in enumerate(other._counts):
+            if count:
+                self._counts[i] += count
+        if other.count:
+            self.count += other.count
+            self._total += other._total
+            self._total_squares += other._total_squares
+            self.min = other.min if self.min is None else min(self.min, other.min)
+            self.max = other.max if self.max is None else max(self.max, other.max)
+
+    @property
+    def total(self):
+        """
+        Returns the sum of the recorded values
+        """
+        return self._total
+
+    def cumulative_counts(self, bounds):
+        """
+        Count the recorded values at or below each of a list of bounds,
+        as needed for a Prometheus histogram. Values are compared by
+        their sub-bucket, so a count may include values up to 1% above
+        its bound.
+        :param bounds: Sorted list of values
+        :return: A list of counts, one per bound
+        """
+        result = []
+        seen = 0
+        index = 0
+        counts = self._counts
+        for bound in bounds:
+            if bound > self._highest_value:
+                last = len(counts) - 1
+            else:
+                last = self._index(max(0, int(bound)))
+            while index <= last:
+                seen += counts[index]
+                index += 1
+            result.append(seen)
+        return result
+
+    def mean(self):
+        """
+        Returns the mean of the recorded values or None
+        """
+        if not self.count:
+            return None
+        return self._total / self.count
+
+    def stddev(self):
+        """
+        Returns the standard deviation of the recorded values or None
+        """
+        if not self.count:
+            return None
+        mean = self._total / self.count
+        return math.sqrt(max(0.0, self._total_squares / self.count - mean * mean))
+
+    def value_at_percentile(self, percentile):
+        """
+        Returns the value that the given percentage of recorded values
+        are at or below
+        :param percentile: 0.0-100.0
+        :return: The value or None if nothing has been recorded
+        """
+        if not self.count:
+            return None
+        target = max(1, int(math.ceil(percentile / 100.0 * self.count)))
+        seen = 0
+        for i, count in enumerate(self._counts):
+            seen += count
+            if seen >= target:
+                return min(self._highest_equivalent_value(i), self.max)
+        return self.max
+
+    def to_dict(self, scale=1e-6):
+        """
+        Summarize the histogram
+        :param scale: Multiplier applied to every value. The default
+        converts nanoseconds to milliseconds.
+        :return: A dict of count, min, mean, stddev, p50, p90, p99, p999
+        and max
+        """
+        def scaled(value):
+            return None if value is None else value * scale
+
+        return {
+            "count": self.count,
+            "min": scaled(self.min),
+            "mean": scaled(self.mean()),
+            "stddev": scaled(self.stddev()),
+            "p50": scaled(self.value_at_percentile(50.0)),
+            "p90": scaled(self.value_at_percentile(90.0)),
+            "p99": scaled(self.value_at_percentile(99.0)),
+            "p999": scaled(self.value_at_percentile(99.9)),
+            "max": scaled(self.max),
+        }
+
+
+class LatencyTracker:
+    """
+    Frame statistics for one source of frames, a universe or a client
+    connection. Counts of frames and bytes plus two histograms:
+        inter_arrival - time between consecutive frames arriving in the
+        frame store. Its spread is the frame rate jitter.
+        receive_to_render - time from a frame arriving in the frame store
+        to a consumer (DMX window or headless sink) finishing with it.
+    """
+
+    def __init__(self, name, labels=()):
+        """
+        Constructor
+        :param name: Name used in reports
+        :param labels: (name, value) pairs that identify the source in
+        metrics, e.g. (("port", 5555), ("universe", 0))
+        """
+        self.name = name
+        self.labels = tuple(labels)
+        self.inter_arrival = LatencyHistogram()
+        self.receive_to_render = LatencyHistogram()
+        self._last_arrival = None
+        self.frames_received = 0
+        self.bytes_received = 0
+
+    def arrived(self, received_ns, size):
+        """
+        Record the arrival of a frame
+        :param received_ns: time.monotonic_ns() when the frame arrived
+        :param size: Frame length in bytes
+        :return:
+        """
+        self.frames_received += 1
+        self.bytes_received += size
+        if self._last_arrival is not None:
+            self.inter_arrival.record(received_ns - self._last_arrival)
+        self._last_arrival = received_ns
+
+    def rendered(self, latency_ns):
+        """
+        Record the receive to render time of a frame
+        :param latency_ns: Nanoseconds
+        :return:
+        """
+        self.receive_to_render.record(latency_ns)
+
+    def merge(self, other):
+        """
+        Add the counts and histograms of another tracker to this one
+        :param other: A LatencyTracker
+        :return:
+        """
+        self.frames_received += other.frames_received
+        self.bytes_received += other.bytes_received
+        self.inter_arrival.merge(other.inter_arrival)
+        self.receive_to_render.merge(other.receive_to_render)
+
+    def reset(self):
+        """
+        Clear the histograms
+        :return:
+        """
+        self.inter_arrival.reset()
+        self.receive_to_render.reset()
+
+    def to_dict(self):
+        """
+        Summarize both histograms, in milliseconds
+        :return: A dict
+        """
+        return {
+            "inter_arrival_ms": self.inter_arrival.to_dict(),
+            "receive_to_render_ms": self.receive_to_render.to_dict(),
+        }
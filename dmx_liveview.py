@@ -0,0 +1,533 @@
+#
+# DMX Emulator live view over WebSocket
+# Copyright © 2019  Dave Hocker (email: AtHomeX10@gmail.com)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the LICENSE file for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program (the LICENSE file).  If not, see <http://www.gnu.org/licenses/>.
+#
+
+#
+# A browser alternative to the DMX window. GET / serves a page that shows a
+# universe's channel grid, and GET /ws is a WebSocket (RFC 6455) that
+# pushes the universe's changes to it. Only the standard library is used.
+#
+# Binary messages, server to browser (integers big endian):
+#   type      uint8   1 = full frame, 2 = delta
+#   universe  uint16
+#   length    uint16  number of channels in the frame
+# followed by, for a full frame, length channel values, and for a delta
+#   count     uint16
+#   count x (channel uint16 (0 based), value uint8)
+#
+# Text messages are JSON. The server sends {"universes": [...],
+# "universe": n, "rate": r} when the socket opens, and the browser sends
+# {"universe": n} to watch another universe.
+#
+# The state comes from a LiveViewSink on the frame scheduler. Every client
+# is sent at most rate updates per second, each one the difference between
+# what the client was last sent and the newest state, so states that
+# arrive while a client is slow to read are dropped instead of buffered.
+# Clients that are in step share one encoded message per change.
+#
+
+import asyncio
+import base64
+import hashlib
+import json
+import socket
+import struct
+import threading
+from dmx_sinks import FrameSink
+import app_logger
+
+logger = app_logger.getAppLogger()
+
+WEBSOCKET_GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+
+OPCODE_CONTINUATION = 0x0
+OPCODE_TEXT = 0x1
+OPCODE_BINARY = 0x2
+OPCODE_CLOSE = 0x8
+OPCODE_PING = 0x9
+OPCODE_PONG = 0xA
+
+MESSAGE_FULL = 1
+MESSAGE_DELTA = 2
+FULL_HEADER = struct.Struct("!BHH")
+DELTA_HEADER = struct.Struct("!BHHH")
+DELTA_ENTRY = struct.Struct("!HB")
+
+PAGE = """<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<title>DMX Emulator</title>
+<style>
+body { font-family: sans-serif; background: #202020; color: #e0e0e0; }
+#grid { display: grid; grid-template-columns: repeat(32, 2.4em); gap: 2px; margin-top: 1em; }
+.cell { height: 2.4em; font-size: 0.7em; line-height: 2.4em; text-align: center; background: #000; color: #fff; }
+</style>
+</head>
+<body>
+<h1>DMX Emulator</h1>
+Universe <select id="universe"></select> <span id="status">connecting</span>
+<div id="grid"></div>
+<script>
+const grid = document.getElementById("grid");
+const select = document.getElementById("universe");
+const status = document.getElementById("status");
+const cells = [];
+const values = new Uint8Array(512);
+let length = 0;
+for (let i = 0; i < 512; i++) {
+    const cell = document.createElement("div");
+    cell.className = "cell";
+    cell.title = "Channel " + (i + 1);
+    grid.appendChild(cell);
+    cells.push(cell);
+}
+function show(i) {
+    const v = values[i];
+    cells[i].textContent = i < length ? v : "";
+    cells[i].style.background = "rgb(" + v + "," + v + "," + v + ")";
+    cells[i].style.color = v > 127 ? "#000" : "#fff";
+}
+const ws = new WebSocket((location.protocol === "https:" ? "wss://" : "ws://") + location.host + "/ws");
+ws.binaryType = "arraybuffer";
+ws.onopen = () => { status.textContent = ""; };
+ws.onclose = () => { status.textContent = "disconnected"; };
+ws.onmessage = (event) => {
+    if (typeof event.data === "string") {
+        const info = JSON.parse(event.data);
+        select.innerHTML = "";
+        for (const u of info.universes) {
+            const option = document.createElement("option");
+            option.value = u;
+            option.textContent = u;
+            select.appendChild(option);
+        }
+        select.value = info.universe;
+        return;
+    }
+    const view = new DataView(event.data);
+    const type = view.getUint8(0);
+    const n = view.getUint16(3);
+    if (type === 1) {
+        const old = length;
+        length = n;
+        for (let i = 0; i < n; i++) { values[i] = view.getUint8(5 + i); }
+        for (let i = n; i < old; i++) { values[i] = 0; }
+        for (let i = 0; i < Math.max(n, old); i++) { show(i); }
+    } else {
+        length = n;
+        const count = view.getUint16(5);
+        for (let k = 0; k < count; k++) {
+            const channel = view.getUint16(7 + 3 * k);
+            values[channel] = view.getUint8(9 + 3 * k);
+            show(channel);
+        }
+    }
+};
+select.onchange = () => { ws.send(JSON.stringify({universe: Number(select.value)})); };
+</script>
+</body>
+</html>
+"""
+
+
+def _websocket_frame(opcode, payload):
+    """
+    Build an unmasked (server to client) WebSocket frame
+    :param opcode: One of the OPCODE_ constants
+    :param payload: bytes
+    :return: The frame as bytes
+    """
+    n = len(payload)
+    if n < 126:
+        header = struct.pack("!BB", 0x80 | opcode, n)
+    elif n < 65536:
+        header = struct.pack("!BBH", 0x80 | opcode, 126, n)
+    else:
+        header = struct.pack("!BBQ", 0x80 | opcode, 127, n)
+    return header + payload
+
+
+def _encode(universe, old, new):
+    """
+    Build the binary message that takes a client from one state to another
+    :param universe: Universe number
+    :param old: The channels the client has, or None
+    :param new: The newest channels
+    :return: The message as a WebSocket frame
+    """
+    length = len(new)
+    if old is not None and len(old) == length:
+        changes = [channel for channel, (a, b) in enumerate(zip(old, new)) if a != b]
+        if DELTA_ENTRY.size * len(changes) + 2 < length:
+            payload = bytearray(DELTA_HEADER.size + DELTA_ENTRY.size * len(changes))
+            DELTA_HEADER.pack_into(payload, 0, MESSAGE_DELTA, universe, length, len(changes))
+            for i, channel in enumerate(changes):
+                DELTA_ENTRY.pack_into(payload, DELTA_HEADER.size + i * DELTA_ENTRY.size, channel, new[channel])
+            return _websocket_frame(OPCODE_BINARY, bytes(payload))
+    return _websocket_frame(OPCODE_BINARY, FULL_HEADER.pack(MESSAGE_FULL, universe, length) + bytes(new))
+
+
+class LiveViewSink(FrameSink):
+    """
+    Keeps the newest frame of every universe for the live view and wakes
+    the server's event loop once per tick when something changed
+    """
+
+    def __init__(self):
+        # universe: (change number, frame)
+        self._frames = {}
+        self._changed = False
+        self._server = None
+
+    def attach(self, server):
+        """
+        Called by the LiveViewServer that consumes this sink
+        :param server: A LiveViewServer
+        :return:
+        """
+        self._server = server
+
+    def frame(self, universe, dmx_data):
+        previous = self._frames.get(universe)
+        self._frames[universe] = (previous[0] + 1 if previous else 1, dmx_data)
+        self._changed = True
+
+    def tick(self, now):
+        if self._changed and self._server is not None:
+            self._changed = False
+            self._server.changed()
+
+    def latest(self, universe):
+        """
+        Returns (change number, frame) for a universe, or None
+        """
+        return self._frames.get(universe)
+
+
+class LiveViewClient:
+    """
+    One browser connection
+    """
+
+    def __init__(self, universe):
+        self.universe = universe
+        self.wake = asyncio.Event()
+        self.sent_change = None
+        self.sent_frame = None
+        self.next_send = 0.0
+
+        # Statistics
+        self.messages_sent = 0
+        # States replaced before this client could be sent them
+        self.states_dropped = 0
+
+
+class LiveViewServer:
+    """
+    HTTP and WebSocket server for the live view, on an asyncio event loop
+    of its own. It has the socketserver interface (serve_forever(),
+    shutdown() and server_close()), so SocketServerThread can run it
+    alongside the DMX listeners. Its sink must be added to the frame
+    scheduler.
+    """
+
+    allow_reuse_address = True
+    request_queue_size = 16
+    # Largest HTTP request header and client message accepted
+    max_request_size = 8192
+    # Bytes waiting to be sent to a client before it is held back
+    write_buffer_limit = 16384
+
+    def __init__(self, server_address, frame_store, rate=20.0):
+        """
+        Create the server and bind its listening socket
+        :param server_address: (host, port) tuple
+        :param frame_store: The FrameStore, for the list of universes
+        :param rate: Most updates per second sent to each client
+        """
+        self.server_address = server_address
+        self._frame_store = frame_store
+        self._interval = 1.0 / rate
+        self.rate = rate
+        self.sink = LiveViewSink()
+        self.sink.attach(self)
+
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        try:
+            if self.allow_reuse_address:
+                self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            self.socket.bind(server_address)
+            self.socket.listen(self.request_queue_size)
+        except Exception:
+            self.socket.close()
+            raise
+
+        self._loop = asyncio.new_event_loop()
+        self._shutdown_requested = False
+        self._shutdown_request = None
+        # Open connections, writer: handler task
+        self._connections = {}
+        self._clients = []
+        # universe: (change number, {sent change: message})
+        self._messages = {}
+        self._is_shut_down = threading.Event()
+        self._is_shut_down.set()
+
+        # Statistics
+        self.clients_served = 0
+
+    def clients(self):
+        """
+        Returns the connected LiveViewClients
+        """
+        return list(self._clients)
+
+    def serve_forever(self):
+        """
+        Run the event loop until shutdown() is called
+        :return:
+        """
+        self._is_shut_down.clear()
+        try:
+            asyncio.set_event_loop(self._loop)
+            self._loop.run_until_complete(self._serve())
+        finally:
+            self._loop.close()
+            self._is_shut_down.set()
+
+    def shutdown(self):
+        """
+        Stop serve_forever() and wait for it to finish. Must be called
+        from a different thread than the one running serve_forever().
+        :return:
+        """
+        try:
+            self._loop.call_soon_threadsafe(self._request_shutdown)
+        except RuntimeError:
+            # The event loop has already been closed
+            pass
+        self._is_shut_down.wait()
+
+    def server_close(self):
+        """
+        Close the listening socket
+        :return:
+        """
+        self.socket.close()
+
+    def changed(self):
+        """
+        Called by the sink, on its own thread, when universes have changed
+        :return:
+        """
+        try:
+            self._loop.call_soon_threadsafe(self._wake_clients)
+        except RuntimeError:
+            # The event loop has already been closed
+            pass
+
+    def _wake_clients(self):
+        for client in self._clients:
+            client.wake.set()
+
+    def _request_shutdown(self):
+        # Runs on the event loop. This can happen before _serve() has
+        # started, so the request is also remembered in a flag.
+        self._shutdown_requested = True
+        if self._shutdown_request:
+            self._shutdown_request.set()
+
+    async def _serve(self):
+        self._shutdown_request = asyncio.Event()
+        if self._shutdown_requested:
+            self._shutdown_request.set()
+        server = await asyncio.start_server(self._handle_connection, sock=self.socket,
+                                            limit=self.max_request_size)
+
+        await self._shutdown_request.wait()
+
+        # Stop accepting, then drop every open connection
+        server.close()
+        connections = list(self._connections.items())
+        for writer, task in connections:
+            writer.close()
+        await asyncio.gather(*[task for writer, task in connections], return_exceptions=True)
+        await server.wait_closed()
+
+    async def _handle_connection(self, reader, writer):
+        """
+        Serve one HTTP request, or a WebSocket for the rest of the connection
+        :param reader: asyncio.StreamReader for the connection
+        :param writer: asyncio.StreamWriter for the connection
+        :return:
+        """
+        self._connections[writer] = asyncio.current_task()
+        try:
+            request = await reader.readuntil(b"\r\n\r\n")
+            lines = request.decode("latin-1").split("\r\n")
+            method, path = (lines[0].split(" ") + ["", ""])[0:2]
+            headers = {}
+            for line in lines[1:]:
+                if ":" in line:
+                    name, value = line.split(":", 1)
+                    headers[name.strip().lower()] = value.strip()
+
+            path = path.split("?")[0]
+            if method != "GET":
+                self._http_response(writer, "405 Method Not Allowed", "text/plain", b"Method not allowed\n")
+            elif path == "/ws" and headers.get("upgrade", "").lower() == "websocket" and \
+                    "sec-websocket-key" in headers:
+                await self._websocket(reader, writer, headers["sec-websocket-key"])
+            elif path in ("/", "/index.html"):
+                self._http_response(writer, "200 OK", "text/html; charset=utf-8", PAGE.encode("utf-8"))
+            else:
+                self._http_response(writer, "404 Not Found", "text/plain", b"Not found\n")
+            await writer.drain()
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError,
+                asyncio.CancelledError, ValueError):
+            pass
+        finally:
+            del self._connections[writer]
+            writer.close()
+
+    @staticmethod
+    def _http_response(writer, status, content_type, body):
+        writer.write("HTTP/1.1 {0}\r\nContent-Type: {1}\r\nContent-Length: {2}\r\n"
+                     "Connection: close\r\n\r\n".format(status, content_type, len(body)).encode("latin-1"))
+        writer.write(body)
+
+    async def _websocket(self, reader, writer, key):
+        """
+        Complete the WebSocket handshake, then send updates until the
+        browser goes away
+        :param reader: asyncio.StreamReader for the connection
+        :param writer: asyncio.StreamWriter for the connection
+        :param key: The Sec-WebSocket-Key header
+        :return:
+        """
+        accept = base64.b64encode(hashlib.sha1((key + WEBSOCKET_GUID).encode("latin-1")).digest())
+        writer.write(b"HTTP/1.1 101 Switching Protocols\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n"
+                     b"Sec-WebSocket-Accept: " + accept + b"\r\n\r\n")
+        # A client that reads slowly is held back by drain() instead of
+        # having updates buffered for it
+        writer.transport.set_write_buffer_limits(high=self.write_buffer_limit)
+
+        universes = self._frame_store.universes()
+        client = LiveViewClient(universes[0] if universes else 0)
+        writer.write(_websocket_frame(OPCODE_TEXT, json.dumps(
+            {"universes": universes, "universe": client.universe, "rate": self.rate}).encode("utf-8")))
+        self._clients.append(client)
+        self.clients_served += 1
+        client.wake.set()
+        sender = asyncio.ensure_future(self._send_updates(client, writer))
+        try:
+            await self._receive_messages(client, reader, writer)
+        finally:
+            sender.cancel()
+            self._clients.remove(client)
+            try:
+                await sender
+            except asyncio.CancelledError:
+                pass
+
+    async def _send_updates(self, client, writer):
+        """
+        Send a client the newest state of its universe whenever it
+        changes, at most rate times per second
+        :param client: A LiveViewClient
+        :param writer: asyncio.StreamWriter for the connection
+        :return:
+        """
+        loop = asyncio.get_event_loop()
+        while True:
+            await client.wake.wait()
+            client.wake.clear()
+            delay = client.next_send - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+
+            latest = self.sink.latest(client.universe)
+            if latest is None or latest[0] == client.sent_change:
+                continue
+            change, frame = latest
+            if client.sent_change is not None and change > client.sent_change + 1:
+                client.states_dropped += change - client.sent_change - 1
+            writer.write(self._message(client, change, frame))
+            client.sent_change = change
+            client.sent_frame = frame
+            client.messages_sent += 1
+            client.next_send = loop.time() + self._interval
+            await writer.drain()
+
+    def _message(self, client, change, frame):
+        """
+        The message taking a client to a universe's newest state. Clients
+        that were sent the same state share the message.
+        :param client: A LiveViewClient
+        :param change: The newest change number
+        :param frame: The newest frame
+        :return: A WebSocket frame
+        """
+        cached = self._messages.get(client.universe)
+        if cached is None or cached[0] != change:
+            cached = (change, {})
+            self._messages[client.universe] = cached
+        message = cached[1].get(client.sent_change)
+        if message is None:
+            message = _encode(client.universe, client.sent_frame, frame)
+            cached[1][client.sent_change] = message
+        return message
+
+    async def _receive_messages(self, client, reader, writer):
+        """
+        Read the browser's messages until it closes the socket
+        :param client: A LiveViewClient
+        :param reader: asyncio.StreamReader for the connection
+        :param writer: asyncio.StreamWriter for the connection
+        :return:
+        """
+        while True:
+            first, second = await reader.readexactly(2)
+            opcode = first & 0x0F
+            n = second & 0x7F
+            if n == 126:
+                n = struct.unpack("!H", await reader.readexactly(2))[0]
+            elif n == 127:
+                n = struct.unpack("!Q", await reader.readexactly(8))[0]
+            if n > self.max_request_size:
+                writer.write(_websocket_frame(OPCODE_CLOSE, struct.pack("!H", 1009)))
+                return
+            mask = await reader.readexactly(4) if second & 0x80 else None
+            payload = await reader.readexactly(n)
+            if mask:
+                payload = bytes(b ^ mask[i & 3] for i, b in enumerate(payload))
+
+            if opcode == OPCODE_CLOSE:
+                writer.write(_websocket_frame(OPCODE_CLOSE, payload[0:2]))
+                return
+            if opcode == OPCODE_PING:
+                writer.write(_websocket_frame(OPCODE_PONG, payload))
+            elif opcode == OPCODE_TEXT:
+                try:
+                    universe = int(json.loads(payload.decode("utf-8"))["universe"])
+                except (ValueError, KeyError, TypeError):
+                    continue
+                if universe != client.universe:
+                    client.universe = universe
+                    client.sent_change = None
+                    client.sent_frame = None
+                    client.wake.set()
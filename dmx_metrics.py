@@ -0,0 +1,204 @@
+#
+# DMX Emulator Prometheus metrics endpoint
+# Copyright © 2019  Dave Hocker (email: AtHomeX10@gmail.com)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the LICENSE file for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program (the LICENSE file).  If not, see <http://www.gnu.org/licenses/>.
+#
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from dmxsocketserver.TCPRequestHandler import TCPRequestHandler
+
+# Prometheus text exposition format
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Histogram bucket bounds in seconds
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.015, 0.02, 0.025, 0.03,
+                   0.05, 0.1, 0.25, 0.5, 1.0)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join("{0}=\"{1}\"".format(k, _escape(v)) for k, v in labels) + "}"
+
+
+class MetricsWriter:
+    """
+    Builds a Prometheus text format document
+    """
+
+    def __init__(self):
+        self._lines = []
+
+    def family(self, name, metric_type, help_text):
+        """
+        Start a metric family
+        :param name: Metric name
+        :param metric_type: counter, gauge or histogram
+        :param help_text: Description
+        :return:
+        """
+        self._lines.append("# HELP {0} {1}".format(name, help_text))
+        self._lines.append("# TYPE {0} {1}".format(name, metric_type))
+
+    def sample(self, name, value, labels=()):
+        """
+        Add one sample
+        :param name: Metric name, including any _total/_bucket suffix
+        :param value: Number
+        :param labels: Sequence of (name, value) pairs
+        :return:
+        """
+        self._lines.append("{0}{1} {2}".format(name, _labels(labels), value))
+
+    def histogram(self, name, histogram, labels=()):
+        """
+        Add a LatencyHistogram (nanoseconds) as a histogram in seconds
+        :param name: Metric name
+        :param histogram: A LatencyHistogram
+        :param labels: Sequence of (name, value) pairs
+        :return:
+        """
+        labels = tuple(labels)
+        counts = histogram.cumulative_counts([int(bound * 1e9) for bound in LATENCY_BUCKETS])
+        for bound, count in zip(LATENCY_BUCKETS, counts):
+            self.sample(name + "_bucket", count, labels + (("le", repr(bound)),))
+        # The count is read last so it is never smaller than a bucket
+        count = max(histogram.count, counts[-1])
+        self.sample(name + "_bucket", count, labels + (("le", "+Inf"),))
+        self.sample(name + "_sum", histogram.total / 1e9, labels)
+        self.sample(name + "_count", count, labels)
+
+    def text(self):
+        return "\n".join(self._lines) + "\n"
+
+
+def collect(frame_store):
+    """
+    Take the current value of every metric. No frame store locks are
+    taken: counters are read as they are, so a scrape never holds up the
+    receive path, at the cost of values in one scrape being a few
+    frames apart.
+    :param frame_store: The FrameStore to report on
+    :return: The metrics in Prometheus text format
+    """
+    writer = MetricsWriter()
+    states = [frame_store.universe(universe) for universe in frame_store.universes()]
+    connections = frame_store.connections()
+    # Connections are reported per port and universe. A label per
+    # connection would start a new series on every reconnect.
+    series = frame_store.connection_series()
+
+    per_universe = (
+        ("dmx_frames_received_total", "counter", "Frames received", "frames_received"),
+        ("dmx_bytes_received_total", "counter", "DMX data bytes received", "bytes_received"),
+        ("dmx_frames_dropped_total", "counter", "Frames dropped from a full queue", "frames_dropped"),
+        ("dmx_frames_coalesced_total", "counter", "Frames overwritten before they were read",
+         "frames_coalesced"),
+        ("dmx_frames_rendered_total", "counter",
+         "Frames rendered by the DMX window or headless runner (rate() gives the render rate)",
+         "frames_rendered"),
+    )
+    for name, metric_type, help_text, attribute in per_universe:
+        writer.family(name, metric_type, help_text + " per universe")
+        for state in states:
+            writer.sample(name, getattr(state, attribute), (("universe", state.universe),))
+
+    writer.family("dmx_queue_depth", "gauge", "Frames waiting in the universe queue")
+    for state in states:
+        writer.sample("dmx_queue_depth", state.queue_depth(), (("universe", state.universe),))
+
+    writer.family("dmx_active_connections", "gauge", "Open client connections")
+    writer.sample("dmx_active_connections", len(connections))
+
+    writer.family("dmx_port_connections", "gauge", "Open client connections per port")
+    for labels, open_connections, tracker in series:
+        writer.sample("dmx_port_connections", open_connections, labels)
+
+    writer.family("dmx_connection_frames_received_total", "counter",
+                  "Frames received by client connections, open and closed, per port")
+    for labels, open_connections, tracker in series:
+        writer.sample("dmx_connection_frames_received_total", tracker.frames_received, labels)
+    writer.family("dmx_connection_bytes_received_total", "counter",
+                  "DMX data bytes received by client connections, open and closed, per port")
+    for labels, open_connections, tracker in series:
+        writer.sample("dmx_connection_bytes_received_total", tracker.bytes_received, labels)
+
+    writer.family("dmx_frames_rejected_total", "counter", "Frames rejected by the TCP server")
+    writer.sample("dmx_frames_rejected_total", TCPRequestHandler.frames_rejected_oversize,
+                  (("reason", "oversize"),))
+    writer.sample("dmx_frames_rejected_total", TCPRequestHandler.frames_rejected_invalid,
+                  (("reason", "invalid"),))
+    writer.sample("dmx_frames_rejected_total", TCPRequestHandler.frames_rejected_short,
+                  (("reason", "short"),))
+
+    histograms = (
+        ("inter_arrival_seconds", "Time between frames", "inter_arrival"),
+        ("receive_to_render_seconds", "Time from a frame arriving to it being rendered", "receive_to_render"),
+    )
+    for name, help_text, attribute in histograms:
+        writer.family("dmx_" + name, "histogram", help_text + " per universe")
+        for state in states:
+            writer.histogram("dmx_" + name, getattr(state.latency, attribute),
+                             (("universe", state.universe),))
+        writer.family("dmx_connection_" + name, "histogram",
+                      help_text + " for client connections, open and closed, per port")
+        for labels, open_connections, tracker in series:
+            writer.histogram("dmx_connection_" + name, getattr(tracker, attribute), labels)
+
+    return writer.text()
+
+
+class MetricsRequestHandler(BaseHTTPRequestHandler):
+    """
+    Serves GET /metrics
+    """
+
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = collect(self.server.frame_store).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # Scrapes every few seconds would flood the console
+        pass
+
+
+class MetricsServer(ThreadingHTTPServer):
+    """
+    HTTP server for the metrics endpoint. It has the socketserver
+    interface, so SocketServerThread can run it alongside the DMX
+    listeners.
+    """
+
+    daemon_threads = True
+    block_on_close = False
+
+    def __init__(self, server_address, frame_store):
+        """
+        Create the server and bind its socket
+        :param server_address: (host, port) tuple
+        :param frame_store: The FrameStore to report on
+        """
+        self.frame_store = frame_store
+        super(MetricsServer, self).__init__(server_address, MetricsRequestHandler)
@@ -0,0 +1,252 @@
+#
+# DMX Emulator capture replay
+# Copyright © 2019  Dave Hocker (email: AtHomeX10@gmail.com)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the LICENSE file for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program (the LICENSE file).  If not, see <http://www.gnu.org/licenses/>.
+#
+
+#
+# Replays a capture file (see dmx_capture.py) into a running emulator,
+# over TCP with DMXEmulatorClient, or straight into a frame store.
+#
+# Usage:
+#   python dmx_replay.py session.dmxcap [--host localhost] [--port 5555]
+#       [--speed 1.0 | --max-speed] [--start SEC] [--end SEC]
+#       [--universe N] [--loop N]
+#
+
+import argparse
+import threading
+import time
+from dmx_capture import CaptureReader
+from dmx_emulator_client import DMXEmulatorClient
+
+
+class ClientTarget:
+    """
+    Sends replayed frames to an emulator over TCP. Universe n is sent to
+    port + n, matching the emulator's port per universe layout. A
+    connection is opened for each universe when it is first used.
+    """
+
+    def __init__(self, host="localhost", port=5555, num_channels=512):
+        """
+        Constructor
+        :param host: Emulator host name
+        :param port: Emulator port of universe 0
+        :param num_channels: Channels per frame
+        """
+        self._host = host
+        self._port = port
+        self._num_channels = num_channels
+        # universe: DMXEmulatorClient
+        self._clients = {}
+
+    def _client(self, universe):
+        client = self._clients.get(universe)
+        if client is None:
+            client = DMXEmulatorClient(self._num_channels, host=self._host, port=self._port + universe)
+            client.open()
+            self._clients[universe] = client
+        return client
+
+    def send(self, universe, dmx_data):
+        self._client(universe).send(dmx_data)
+
+    def send_many(self, universe, frames):
+        self._client(universe).send_many(frames)
+
+    def close(self):
+        for client in self._clients.values():
+            client.close()
+        self._clients = {}
+
+
+class FrameStoreTarget:
+    """
+    Writes replayed frames directly into a FrameStore
+    """
+
+    def __init__(self, frame_store):
+        """
+        Constructor
+        :param frame_store: The FrameStore to update
+        """
+        self._frame_store = frame_store
+
+    def send(self, universe, dmx_data):
+        self._frame_store.update(universe, dmx_data)
+
+    def send_many(self, universe, frames):
+        self._frame_store.update_many(universe, frames)
+
+    def close(self):
+        pass
+
+
+class CaptureReplayer:
+    """
+    Plays the records of a capture to a target.
+
+    Each record is due at an absolute deadline, start + timestamp / speed,
+    so scheduling errors never accumulate however long the replay is. A
+    record that is already late is sent at once and the schedule is kept.
+    With speed=None there is no pacing: consecutive records for the same
+    universe are sent in batches as fast as the target accepts them.
+
+    Records are read from the capture's memory map one at a time, so
+    memory use does not depend on the length of the capture.
+    """
+
+    # Largest batch sent at max speed
+    batch_size = 64
+
+    def __init__(self, capture, target, speed=1.0, universe=None):
+        """
+        Constructor
+        :param capture: An open CaptureReader
+        :param target: A ClientTarget, FrameStoreTarget or any object with
+        send(universe, dmx_data) and send_many(universe, frames) methods
+        :param speed: Replay speed multiplier. None for max speed.
+        :param universe: Only replay this universe. None for all.
+        """
+        if speed is not None and speed <= 0:
+            raise ValueError("Replay speed must be greater than 0")
+        self._capture = capture
+        self._target = target
+        self._speed = speed
+        self._universe = universe
+        self._stop_event = threading.Event()
+
+        # Statistics
+        self.frames_sent = 0
+        self.elapsed = 0.0
+        # Worst lateness of a paced frame (seconds)
+        self.max_late = 0.0
+
+    def play(self, start=0.0, end=None):
+        """
+        Replay the records between two capture times. Runs on the calling
+        thread until done or stop() is called.
+        :param start: Capture time to start at (seconds)
+        :param end: Capture time to stop at (seconds). None for the end
+        of the capture.
+        :return: Number of frames sent
+        """
+        capture = self._capture
+        first = capture.find_time(int(start * 1e9))
+        last = len(capture) if end is None else capture.find_time(int(end * 1e9))
+        if first >= last:
+            return 0
+
+        began = time.monotonic()
+        if self._speed is None:
+            sent = self._play_max_speed(first, last)
+        else:
+            sent = self._play_paced(first, last)
+        self.elapsed += time.monotonic() - began
+        self.frames_sent += sent
+        return sent
+
+    def _play_paced(self, first, last):
+        capture = self._capture
+        base_ns = capture.timestamp(first)
+        scale = 1.0 / (self._speed * 1e9)
+        start = time.monotonic()
+        sent = 0
+        for index in range(first, last):
+            record = capture[index]
+            if self._universe is not None and record.universe != self._universe:
+                continue
+            deadline = start + (record.timestamp_ns - base_ns) * scale
+            delay = deadline - time.monotonic()
+            if delay > 0:
+                if self._stop_event.wait(delay):
+                    break
+            else:
+                self.max_late = max(self.max_late, -delay)
+                if self._stop_event.is_set():
+                    break
+            self._target.send(record.universe, record.data)
+            sent += 1
+        return sent
+
+    def _play_max_speed(self, first, last):
+        capture = self._capture
+        sent = 0
+        batch = []
+        batch_universe = None
+        for index in range(first, last):
+            record = capture[index]
+            if self._universe is not None and record.universe != self._universe:
+                continue
+            if batch and (record.universe != batch_universe or len(batch) >= self.batch_size):
+                self._target.send_many(batch_universe, batch)
+                sent += len(batch)
+                batch = []
+                if self._stop_event.is_set():
+                    return sent
+            batch_universe = record.universe
+            batch.append(record.data)
+        if batch:
+            self._target.send_many(batch_universe, batch)
+            sent += len(batch)
+        return sent
+
+    def stop(self):
+        """
+        Ask play() to return. May be called from any thread.
+        :return:
+        """
+        self._stop_event.set()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay a DMX Emulator capture file")
+    parser.add_argument("file", help="Capture file")
+    parser.add_argument("--host", default="localhost", help="Emulator host name")
+    parser.add_argument("--port", type=int, default=5555, help="Emulator port of universe 0")
+    speed = parser.add_mutually_exclusive_group()
+    speed.add_argument("--speed", type=float, default=1.0, help="Speed multiplier (1.0 is real time)")
+    speed.add_argument("--max-speed", action="store_true", help="Replay as fast as possible")
+    parser.add_argument("--start", type=float, default=0.0, help="Capture time to start at (seconds)")
+    parser.add_argument("--end", type=float, default=None, help="Capture time to stop at (seconds)")
+    parser.add_argument("--universe", type=int, default=None, help="Only replay this universe")
+    parser.add_argument("--loop", type=int, default=1, help="Number of times to replay")
+    args = parser.parse_args()
+
+    target = ClientTarget(host=args.host, port=args.port)
+    try:
+        with CaptureReader(args.file) as capture:
+            replayer = CaptureReplayer(capture, target, speed=None if args.max_speed else args.speed,
+                                       universe=args.universe)
+            try:
+                for i in range(args.loop):
+                    replayer.play(start=args.start, end=args.end)
+            except KeyboardInterrupt:
+                pass
+    finally:
+        target.close()
+
+    rate = replayer.frames_sent / replayer.elapsed if replayer.elapsed else 0.0
+    print("Sent {0} frames in {1:.3f} sec ({2:.1f} frames/sec)".format(replayer.frames_sent,
+                                                                       replayer.elapsed, rate))
+    if not args.max_speed:
+        print("Latest frame was {0:.3f} ms behind schedule".format(replayer.max_late * 1000.0))
+
+
+#
+# Run as an application
+#
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,603 @@
+#
+# DMX Emulator channel rules - triggers and assertions for automated tests
+# Copyright © 2019  Dave Hocker (email: AtHomeX10@gmail.com)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the LICENSE file for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program (the LICENSE file).  If not, see <http://www.gnu.org/licenses/>.
+#
+
+#
+# Rules file (JSON):
+#
+#   {"rules": [
+#       {"name": "dimmers capped", "universe": 0, "channels": "1-16", "never": "> 200"},
+#       {"name": "master up", "channels": "1", "always": ">= 10"},
+#       {"name": "strobe fires", "channels": "37", "expect": "== 255", "within": 2.0,
+#        "after": {"frame": 100}},
+#       {"name": "blackout", "channels": "1-512", "expect": "== 0", "within": 1.0,
+#        "after": {"channels": "512", "when": "== 255"}}
+#   ]}
+#
+# channels is a channel (1-512) or a range "first-last". A condition is an
+# operator (<, <=, >, >=, ==, !=) and a value, and holds for a range when
+# it holds for every channel in the range. Channels past the end of a
+# short frame count as 0. universe defaults to 0.
+#
+#   always  The condition holds in every frame.
+#   never   The condition holds for no channel in any frame.
+#   expect  The condition holds in some frame no more than within seconds
+#           after the trigger: the frame with sequence number frame, the
+#           first frame in which the when condition holds for its
+#           channels, or, with no after, the universe's first frame.
+#           An expectation that is never triggered fails.
+#
+# A rule that was not checked against any frame, because its universe
+# received none, fails.
+#
+# Every frame is checked as it is received. The rules are compiled so a
+# frame costs one min() and max() per distinct channel range, plus one
+# comparison per group of always/never rules with the same range and
+# operator: the group's tightest threshold is compared first and the
+# other rules only when it fails.
+#
+# Usage (offline, against a capture file):
+#   python dmx_rules.py rules.json session.dmxcap [--report report.json]
+#
+
+import argparse
+import json
+import sys
+import threading
+import time
+from collections import OrderedDict
+from dmx_sinks import FrameSink
+import app_logger
+
+logger = app_logger.getAppLogger()
+
+DMX_UNIVERSE_SIZE = 512
+
+OPERATORS = ("<", "<=", ">", ">=", "==", "!=")
+# "no channel meets c" is "every channel meets the complement of c"
+COMPLEMENTS = {"<": ">=", "<=": ">", ">": "<=", ">=": "<", "==": "!=", "!=": "=="}
+
+STATUS_PENDING = "pending"
+STATUS_PASSED = "passed"
+STATUS_FAILED = "failed"
+
+
+def _parse_channels(spec, name):
+    """
+    Parse a channel or channel range
+    :param spec: 37, "37" or "1-16"
+    :param name: Rule name, for errors
+    :return: (first, last) channel numbers, 1 based
+    """
+    try:
+        if isinstance(spec, int):
+            first = last = spec
+        else:
+            parts = str(spec).split("-")
+            first = int(parts[0])
+            last = int(parts[1]) if len(parts) > 1 else first
+    except (ValueError, IndexError):
+        raise ValueError("Rule {0}: invalid channels {1}".format(name, spec))
+    if first < 1 or last > DMX_UNIVERSE_SIZE or first > last:
+        raise ValueError("Rule {0}: channels must be within 1-{1}".format(name, DMX_UNIVERSE_SIZE))
+    return first, last
+
+
+def _parse_condition(spec, name):
+    """
+    Parse a condition
+    :param spec: e.g. "> 200"
+    :param name: Rule name, for errors
+    :return: (operator, value)
+    """
+    try:
+        operator, value = str(spec).split()
+        value = int(value)
+    except ValueError:
+        raise ValueError("Rule {0}: invalid condition {1}".format(name, spec))
+    if operator not in OPERATORS or value < 0 or value > 255:
+        raise ValueError("Rule {0}: invalid condition {1}".format(name, spec))
+    return operator, value
+
+
+def _compare(operator, value, channel_value):
+    if operator == "<":
+        return channel_value < value
+    if operator == "<=":
+        return channel_value <= value
+    if operator == ">":
+        return channel_value > value
+    if operator == ">=":
+        return channel_value >= value
+    if operator == "==":
+        return channel_value == value
+    return channel_value != value
+
+
+class Predicate:
+    """
+    A condition on every channel of a range, evaluated from the range's
+    min and max
+    """
+
+    def __init__(self, range_index, first, last, operator, value):
+        self.range_index = range_index
+        self.first = first
+        self.last = last
+        self.operator = operator
+        self.value = value
+
+    def holds(self, low, high, part):
+        """
+        :param low: Smallest value in the range
+        :param high: Largest value in the range
+        :param part: The range's channel values (for !=)
+        """
+        operator = self.operator
+        if operator == "<":
+            return high < self.value
+        if operator == "<=":
+            return high <= self.value
+        if operator == ">":
+            return low > self.value
+        if operator == ">=":
+            return low >= self.value
+        if operator == "==":
+            return low == self.value and high == self.value
+        return low != self.value and high != self.value and self.value not in part
+
+    def offenders(self, dmx_data):
+        """
+        The channels that do not meet the condition, for reports
+        :return: OrderedDict of channel number: value
+        """
+        result = OrderedDict()
+        for channel in range(self.first, self.last + 1):
+            channel_value = dmx_data[channel - 1] if channel <= len(dmx_data) else 0
+            if not _compare(self.operator, self.value, channel_value):
+                result[channel] = channel_value
+        return result
+
+    def __str__(self):
+        channels = str(self.first) if self.first == self.last else "{0}-{1}".format(self.first, self.last)
+        return "channels {0} {1} {2}".format(channels, self.operator, self.value)
+
+
+class Rule:
+    """
+    The state and result of one rule
+    """
+
+    def __init__(self, name, universe, kind, predicate, description):
+        self.name = name
+        self.universe = universe
+        self.kind = kind
+        self.predicate = predicate
+        self.description = description
+        self.status = STATUS_PENDING
+        self.message = None
+        self.frames_checked = 0
+        self.violations = 0
+        self.first_failure = None
+        # Set once the status has been logged by a RulesSink
+        self.reported = False
+
+        # expect only
+        self.trigger = None
+        self.trigger_frame = None
+        self.within = None
+        self.triggered_frame = None
+        self.triggered_at = None
+        self.reached_frame = None
+        self.latency = None
+
+    def fail(self, message, sequence=None, dmx_data=None, elapsed=None):
+        self.status = STATUS_FAILED
+        self.message = message
+        if sequence is not None and self.first_failure is None:
+            failure = OrderedDict()
+            failure["frame"] = sequence
+            failure["time"] = elapsed
+            failure["channels"] = self.predicate.offenders(dmx_data)
+            self.first_failure = failure
+
+    def to_dict(self):
+        result = OrderedDict()
+        result["name"] = self.name
+        result["universe"] = self.universe
+        result["rule"] = self.description
+        result["status"] = self.status
+        if self.message:
+            result["message"] = self.message
+        result["frames_checked"] = self.frames_checked
+        if self.kind == "expect":
+            result["triggered_frame"] = self.triggered_frame
+            result["reached_frame"] = self.reached_frame
+            result["latency"] = self.latency
+        else:
+            result["violations"] = self.violations
+            if self.first_failure is not None:
+                # JSON object keys are strings
+                failure = OrderedDict(self.first_failure)
+                failure["channels"] = OrderedDict((str(k), v) for k, v in failure["channels"].items())
+                result["first_failure"] = failure
+        return result
+
+
+class _UniverseRules:
+    """
+    The compiled rules of one universe
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        # (first, last) of each distinct range, 1 based
+        self.ranges = []
+        self._range_index = {}
+        # always rules grouped by (range, operator), tightest first.
+        # List of (predicate of the tightest rule, [rules]).
+        self.groups = []
+        self._groups = {}
+        # always rules with == or !=, checked one by one
+        self.singles = []
+        # expect rules not yet resolved
+        self.expects = []
+
+    def range_index(self, first, last):
+        index = self._range_index.get((first, last))
+        if index is None:
+            index = len(self.ranges)
+            self.ranges.append((first, last))
+            self._range_index[(first, last)] = index
+        return index
+
+    def add_always(self, rule):
+        predicate = rule.predicate
+        if predicate.operator in ("==", "!="):
+            self.singles.append(rule)
+            return
+        key = (predicate.range_index, predicate.operator)
+        group = self._groups.get(key)
+        if group is None:
+            group = [predicate, []]
+            self._groups[key] = group
+            self.groups.append(group)
+        rules = group[1]
+        rules.append(rule)
+        # A rule whose threshold is met whenever the first one's is, is
+        # met whenever the group's tightest one is
+        if predicate.operator in ("<", "<="):
+            rules.sort(key=lambda r: r.predicate.value)
+        else:
+            rules.sort(key=lambda r: -r.predicate.value)
+        group[0] = rules[0].predicate
+
+
+class RuleEngine:
+    """
+    Checks channel rules against every received frame. Register it as a
+    frame store listener; the results are reported by a RulesSink.
+    """
+
+    def __init__(self, rules):
+        """
+        Compile a list of rules
+        :param rules: List of rule dicts (see the top of this file)
+        """
+        self.rules = []
+        self._universes = {}
+        self._start = None
+        for index, spec in enumerate(rules):
+            self._compile(spec, index)
+
+    @classmethod
+    def load(cls, file_path):
+        """
+        Load a rules file
+        :param file_path: Full path to the JSON rules file
+        :return: A RuleEngine
+        """
+        with open(file_path, "r") as rules_file:
+            config = json.load(rules_file)
+        return cls(config.get("rules", []))
+
+    def _compile(self, spec, index):
+        name = spec.get("name", "rule {0}".format(index + 1))
+        universe = int(spec.get("universe", 0))
+        universe_rules = self._universes.get(universe)
+        if universe_rules is None:
+            universe_rules = _UniverseRules()
+            self._universes[universe] = universe_rules
+        first, last = _parse_channels(spec.get("channels"), name)
+        range_index = universe_rules.range_index(first, last)
+
+        kinds = [kind for kind in ("always", "never", "expect") if kind in spec]
+        if len(kinds) != 1:
+            raise ValueError("Rule {0}: needs exactly one of always, never or expect".format(name))
+        kind = kinds[0]
+        operator, value = _parse_condition(spec[kind], name)
+        description = "{0} {1}".format(kind, Predicate(range_index, first, last, operator, value))
+        if kind == "never":
+            operator = COMPLEMENTS[operator]
+        rule = Rule(name, universe, "expect" if kind == "expect" else "always",
+                    Predicate(range_index, first, last, operator, value), description)
+
+        if kind == "expect":
+            if "within" not in spec:
+                raise ValueError("Rule {0}: expect needs within (seconds)".format(name))
+            rule.within = float(spec["within"])
+            after = spec.get("after")
+            if after is not None:
+                if "frame" in after:
+                    rule.trigger_frame = int(after["frame"])
+                    rule.description += " within {0} s of frame {1}".format(rule.within, rule.trigger_frame)
+                else:
+                    t_first, t_last = _parse_channels(after.get("channels"), name)
+                    t_operator, t_value = _parse_condition(after.get("when"), name)
+                    rule.trigger = Predicate(universe_rules.range_index(t_first, t_last), t_first, t_last,
+                                             t_operator, t_value)
+                    rule.description += " within {0} s of {1}".format(rule.within, rule.trigger)
+            else:
+                rule.description += " within {0} s of the first frame".format(rule.within)
+            universe_rules.expects.append(rule)
+        else:
+            universe_rules.add_always(rule)
+        self.rules.append(rule)
+
+    def __call__(self, universe, sequence, dmx_data):
+        """
+        Frame store listener
+        :param universe: Universe number
+        :param sequence: The frame's sequence number
+        :param dmx_data: The DMX data as a bytes-like object
+        :return:
+        """
+        self.check(universe, sequence, dmx_data, time.monotonic())
+
+    def check(self, universe, sequence, dmx_data, now):
+        """
+        Check a frame against a universe's rules
+        :param universe: Universe number
+        :param sequence: The frame's sequence number
+        :param dmx_data: The DMX data as a bytes-like object
+        :param now: The frame's receive time in seconds
+        :return:
+        """
+        universe_rules = self._universes.get(universe)
+        if universe_rules is None:
+            return
+        with universe_rules.lock:
+            if self._start is None:
+                self._start = now
+            # One min() and max() per distinct range
+            length = len(dmx_data)
+            lows = []
+            highs = []
+            parts = []
+            for first, last in universe_rules.ranges:
+                part = dmx_data[first - 1:last]
+                if len(part):
+                    low = min(part)
+                    high = max(part)
+                else:
+                    low = high = 0
+                if last > length:
+                    low = 0
+                lows.append(low)
+                highs.append(high)
+                parts.append(part if last <= length else bytes(part) + bytes(1))
+
+            for predicate, rules in universe_rules.groups:
+                i = predicate.range_index
+                if predicate.holds(lows[i], highs[i], parts[i]):
+                    continue
+                for rule in rules:
+                    if rule.predicate.holds(lows[i], highs[i], parts[i]):
+                        break
+                    self._violated(rule, sequence, dmx_data, now)
+            for rule in universe_rules.singles:
+                i = rule.predicate.range_index
+                if not rule.predicate.holds(lows[i], highs[i], parts[i]):
+                    self._violated(rule, sequence, dmx_data, now)
+
+            if universe_rules.expects:
+                self._check_expects(universe_rules, sequence, now, lows, highs, parts)
+            for predicate, rules in universe_rules.groups:
+                for rule in rules:
+                    rule.frames_checked += 1
+            for rule in universe_rules.singles:
+                rule.frames_checked += 1
+
+    def _violated(self, rule, sequence, dmx_data, now):
+        rule.violations += 1
+        if rule.status != STATUS_FAILED:
+            rule.fail("violated in frame {0}".format(sequence), sequence, dmx_data, now - self._start)
+
+    def _check_expects(self, universe_rules, sequence, now, lows, highs, parts):
+        resolved = []
+        for rule in universe_rules.expects:
+            rule.frames_checked += 1
+            if rule.triggered_at is None:
+                if rule.trigger_frame is not None:
+                    triggered = sequence >= rule.trigger_frame
+                elif rule.trigger is not None:
+                    i = rule.trigger.range_index
+                    triggered = rule.trigger.holds(lows[i], highs[i], parts[i])
+                else:
+                    triggered = True
+                if not triggered:
+                    continue
+                rule.triggered_at = now
+                rule.triggered_frame = sequence
+
+            if now > rule.triggered_at + rule.within:
+                rule.fail("not reached within {0} s of frame {1}".format(rule.within, rule.triggered_frame))
+                resolved.append(rule)
+                continue
+            i = rule.predicate.range_index
+            if rule.predicate.holds(lows[i], highs[i], parts[i]):
+                rule.status = STATUS_PASSED
+                rule.reached_frame = sequence
+                rule.latency = now - rule.triggered_at
+                resolved.append(rule)
+        if resolved:
+            universe_rules.expects = [rule for rule in universe_rules.expects if rule not in resolved]
+
+    def check_deadlines(self, now):
+        """
+        Fail the expectations whose time is up, without waiting for
+        another frame
+        :param now: time.monotonic()
+        :return:
+        """
+        for universe_rules in self._universes.values():
+            with universe_rules.lock:
+                expired = [rule for rule in universe_rules.expects
+                           if rule.triggered_at is not None and now > rule.triggered_at + rule.within]
+                for rule in expired:
+                    rule.fail("not reached within {0} s of frame {1}".format(rule.within, rule.triggered_frame))
+                if expired:
+                    universe_rules.expects = [rule for rule in universe_rules.expects if rule not in expired]
+
+    def finish(self, now=None):
+        """
+        Resolve every rule at the end of a run. Unresolved expectations
+        fail. always and never rules pass if they were checked against at
+        least one frame and never violated. A rule that saw no frames
+        (a wrong universe, or no sender) fails rather than passing by
+        default.
+        :param now: The end time. None for time.monotonic().
+        :return:
+        """
+        if now is None:
+            now = time.monotonic()
+        self.check_deadlines(now)
+        for universe_rules in self._universes.values():
+            with universe_rules.lock:
+                for rule in universe_rules.expects:
+                    if rule.triggered_at is None:
+                        rule.fail("never triggered")
+                    else:
+                        rule.fail("not reached before the run ended, {0:.3f} s after frame {1}".format(
+                            now - rule.triggered_at, rule.triggered_frame))
+                universe_rules.expects = []
+        for rule in self.rules:
+            if rule.status == STATUS_PENDING:
+                if rule.frames_checked == 0:
+                    rule.fail("no frames checked")
+                else:
+                    rule.status = STATUS_PASSED
+
+    @property
+    def passed(self):
+        """
+        True if no rule has failed
+        """
+        return all(rule.status != STATUS_FAILED for rule in self.rules)
+
+    def results(self):
+        """
+        Returns the results as a dict, for a JSON report
+        """
+        report = OrderedDict()
+        report["passed"] = self.passed
+        report["rules"] = [rule.to_dict() for rule in self.rules]
+        return report
+
+
+class RulesSink(FrameSink):
+    """
+    Logs rule results as they are decided and a summary when the
+    scheduler stops, optionally writing a JSON report. The frames
+    themselves are checked by the RuleEngine as they are received.
+    """
+
+    # Expectation deadlines are checked 10 times a second
+    rate = 10.0
+
+    def __init__(self, engine, report_path=None):
+        """
+        Constructor
+        :param engine: The RuleEngine, registered as a frame store listener
+        :param report_path: Full path of the JSON report, or None
+        """
+        self._engine = engine
+        self._report_path = report_path
+
+    def tick(self, now):
+        self._engine.check_deadlines(now)
+        self._log_results()
+
+    def close(self):
+        self._engine.finish()
+        self._log_results()
+        passed = sum(1 for rule in self._engine.rules if rule.status == STATUS_PASSED)
+        failed = len(self._engine.rules) - passed
+        if failed:
+            logger.error("Rules: %d passed, %d FAILED", passed, failed)
+        else:
+            logger.info("Rules: all %d passed", passed)
+        if self._report_path:
+            with open(self._report_path, "w") as report_file:
+                json.dump(self._engine.results(), report_file, indent=2)
+            logger.info("Rule report written to %s", self._report_path)
+
+    def _log_results(self):
+        for rule in self._engine.rules:
+            if rule.reported or rule.status == STATUS_PENDING:
+                continue
+            rule.reported = True
+            if rule.status == STATUS_FAILED:
+                logger.error("Rule %s FAILED (universe %d, %s): %s", rule.name, rule.universe,
+                             rule.description, rule.message)
+            elif rule.kind == "expect":
+                logger.info("Rule %s passed (universe %d): reached in frame %d, %.3f s after frame %d",
+                            rule.name, rule.universe, rule.reached_frame, rule.latency, rule.triggered_frame)
+
+
+def main():
+    from dmx_capture import CaptureReader
+
+    parser = argparse.ArgumentParser(description="Check a capture file against DMX channel rules")
+    parser.add_argument("rules", help="JSON rules file")
+    parser.add_argument("capture", help="Capture file (see dmx_capture.py)")
+    parser.add_argument("--report", default=None, help="Write a JSON report to this file")
+    args = parser.parse_args()
+
+    engine = RuleEngine.load(args.rules)
+    with CaptureReader(args.capture) as reader:
+        end = 0.0
+        for record in reader:
+            end = record.timestamp_ns / 1e9
+            engine.check(record.universe, record.sequence, record.data, end)
+        engine.finish(end)
+
+    results = engine.results()
+    for rule in results["rules"]:
+        print("{0:8} {1} (universe {2}, {3}){4}".format(
+            rule["status"].upper(), rule["name"], rule["universe"], rule["rule"],
+            ": " + rule["message"] if "message" in rule else ""))
+    if args.report:
+        with open(args.report, "w") as report_file:
+            json.dump(results, report_file, indent=2)
+    return 0 if results["passed"] else 1
+
+
+#
+# Run as an application
+#
+if __name__ == "__main__":
+    sys.exit(main())
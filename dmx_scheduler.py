@@ -0,0 +1,333 @@
+#
+# DMX Emulator frame scheduler
+# Copyright © 2019  Dave Hocker (email: AtHomeX10@gmail.com)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the LICENSE file for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program (the LICENSE file).  If not, see <http://www.gnu.org/licenses/>.
+#
+
+import time
+from collections import namedtuple
+from threading import Condition, Event, Thread
+import app_logger
+
+logger = app_logger.getAppLogger()
+
+# The coalesced state of one universe at a scheduler tick
+UniverseFrame = namedtuple("UniverseFrame", ["universe", "sequence", "received_ns", "source", "data"])
+
+
+class AdaptiveInterval:
+    """
+    Stretches a consumer's refresh interval when the consumer cannot keep
+    up. The time spent on each refresh is smoothed, and the interval is
+    made long enough that refreshing uses at most budget of the time.
+    Frames that arrive in between are skipped, never queued.
+    """
+
+    def __init__(self, interval, max_interval, budget=0.5, smoothing=0.2):
+        """
+        Constructor
+        :param interval: Normal (shortest) interval in seconds
+        :param max_interval: Longest interval in seconds
+        :param budget: Fraction of the time a consumer may be busy
+        :param smoothing: Weight of the newest busy time (0-1)
+        """
+        self.base_interval = interval
+        self.max_interval = max(max_interval, interval)
+        self.budget = budget
+        self.smoothing = smoothing
+        self.interval = interval
+        # Smoothed seconds per refresh
+        self.busy = 0.0
+
+    def update(self, busy):
+        """
+        Record the time a refresh took
+        :param busy: Seconds spent on the refresh
+        :return: The interval until the next refresh (seconds)
+        """
+        self.busy += self.smoothing * (busy - self.busy)
+        self.interval = min(self.max_interval, max(self.base_interval, self.busy / self.budget))
+        return self.interval
+
+
+class ScheduledSink:
+    """
+    A sink registered with the scheduler, with its own refresh interval
+    and the sequence number of the last frame it was given per universe
+    """
+
+    def __init__(self, sink, interval, adaptive, max_interval):
+        self.sink = sink
+        self.adaptive = adaptive
+        self.pacer = AdaptiveInterval(interval, max_interval)
+        self.next_due = None
+        # universe: sequence of the last delivered frame
+        self.delivered = {}
+
+        # Statistics
+        self.frames_delivered = 0
+        # Frames that were replaced before this sink was due
+        self.frames_skipped = 0
+
+
+class FrameScheduler:
+    """
+    Owns the handoff from the frame store to its consumers.
+
+    Once per tick the newest frame of every universe is taken from the
+    frame store and published as the current state, a dict of
+    UniverseFrame replaced as a whole (never modified), so any thread
+    can read it without a lock. Receiving threads only ever write to
+    the frame store, so a slow consumer cannot hold up ingestion.
+
+    Each sink has a thread of its own and is called at its own rate
+    with the universes that changed since it was last called, so a slow
+    sink (a recorder on a busy disk) does not hold up the others. Sink
+    threads are woken by each tick as soon as its state is published,
+    and a sink that is due is called then, so a frame waits for one
+    tick, not for a tick and then for the sink's own timer. An adaptive
+    sink's rate drops when it is slow. The DMX window reads the current
+    state on the Tk thread with latest().
+    """
+
+    def __init__(self, frame_store, tick_interval_ms=30):
+        """
+        Constructor
+        :param frame_store: The FrameStore to consume
+        :param tick_interval_ms: Time between ticks in ms. Ticks are made
+        faster if a sink asks for a higher rate.
+        """
+        self._frame_store = frame_store
+        self._tick_interval = float(tick_interval_ms) / 1000.0
+        self._sinks = []
+        # universe: UniverseFrame
+        self._state = {}
+        self._stop_event = Event()
+        self._thread = None
+        # Bumped, and the sink threads woken, by every tick of run()
+        self._tick_condition = Condition()
+        self._generation = 0
+
+        # Statistics
+        self.ticks = 0
+
+    def add_sink(self, sink, rate=None, adaptive=False, max_interval=1.0):
+        """
+        Register a sink. Must be called before run() or start().
+        :param sink: A FrameSink
+        :param rate: Calls per second. None for once per tick.
+        :param adaptive: Lower the rate when the sink is slow
+        :param max_interval: Longest interval of an adaptive sink (seconds)
+        :return: The ScheduledSink, for its statistics
+        """
+        interval = self._tick_interval if not rate else 1.0 / rate
+        scheduled = ScheduledSink(sink, interval, adaptive, max_interval)
+        self._sinks.append(scheduled)
+        self._tick_interval = min(self._tick_interval, interval)
+        return scheduled
+
+    def sinks(self):
+        """
+        Returns the registered sinks as ScheduledSink instances
+        """
+        return list(self._sinks)
+
+    def state(self):
+        """
+        Returns the current state, a dict of universe: UniverseFrame.
+        Do not modify it.
+        """
+        return self._state
+
+    def latest(self, universe):
+        """
+        Returns the current state of a universe
+        :param universe: Universe number
+        :return: A UniverseFrame or None if no frame has been received
+        """
+        return self._state.get(universe)
+
+    def rendered(self, frame, rendered_ns=None):
+        """
+        Record that a frame from the current state has been rendered
+        :param frame: A UniverseFrame
+        :param rendered_ns: time.monotonic_ns() when rendering finished
+        :return: The receive to render time in ns
+        """
+        return self._frame_store.record_rendered(frame.universe, frame.received_ns, frame.source, rendered_ns)
+
+    def run(self):
+        """
+        Tick until stop() is called. Runs on the calling thread, with
+        the sinks on threads of their own.
+        :return:
+        """
+        for scheduled in self._sinks:
+            scheduled.sink.open(self._frame_store)
+        threads = []
+        for scheduled in self._sinks:
+            thread = Thread(target=self._run_sink, args=(scheduled,),
+                            name="Sink-" + type(scheduled.sink).__name__)
+            thread.daemon = True
+            thread.start()
+            threads.append(thread)
+        try:
+            next_tick = time.monotonic()
+            while not self._stop_event.is_set():
+                now = time.monotonic()
+                self._coalesce()
+                self._wake_sinks()
+
+                # Deadlines are absolute so the tick rate does not drift.
+                # If we fall behind, skip the missed ticks.
+                next_tick += self._tick_interval
+                if next_tick < now:
+                    next_tick = now + self._tick_interval
+                self._stop_event.wait(next_tick - time.monotonic())
+        finally:
+            self._stop_event.set()
+            self._wake_sinks()
+            for thread in threads:
+                thread.join()
+            for scheduled in self._sinks:
+                try:
+                    scheduled.sink.close()
+                except Exception as ex:
+                    logger.error("Error closing sink %s", type(scheduled.sink).__name__)
+                    logger.error(str(ex))
+
+    def _wake_sinks(self):
+        """
+        Tell the sink threads that a tick has published its state
+        :return:
+        """
+        with self._tick_condition:
+            self._generation += 1
+            self._tick_condition.notify_all()
+
+    def _run_sink(self, scheduled):
+        """
+        Call one sink at its rate until the scheduler stops. The sink is
+        only called right after a tick, on the first tick at which it is
+        due.
+        :param scheduled: A ScheduledSink
+        :return:
+        """
+        generation = 0
+        # Ticks are not exactly on time, so a sink due within half a tick
+        # is called now rather than a whole tick late
+        slack = self._tick_interval / 2.0
+        try:
+            while True:
+                with self._tick_condition:
+                    while self._generation == generation and not self._stop_event.is_set():
+                        self._tick_condition.wait()
+                    generation = self._generation
+                if self._stop_event.is_set():
+                    break
+                now = time.monotonic()
+                if scheduled.next_due is None or now >= scheduled.next_due - slack:
+                    self._deliver(scheduled, now)
+        except Exception as ex:
+            logger.error("Sink %s stopped by an unhandled exception", type(scheduled.sink).__name__)
+            logger.error(str(ex))
+
+    def start(self):
+        """
+        Run the scheduler on its own thread
+        :return:
+        """
+        self._thread = Thread(target=self._run_thread, name="FrameScheduler")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _run_thread(self):
+        try:
+            self.run()
+        except Exception as ex:
+            logger.error("Frame scheduler stopped by an unhandled exception")
+            logger.error(str(ex))
+
+    def stop(self):
+        """
+        Ask the scheduler to stop. May be called from any thread. If
+        start() was used, waits for the thread to finish.
+        :return:
+        """
+        self._stop_event.set()
+        self._wake_sinks()
+        if self._thread is not None and self._thread.is_alive():
+            self._thread.join()
+
+    def tick(self, now):
+        """
+        Publish the newest frame of each changed universe, then call the
+        sinks that are due, all on the calling thread. For callers that
+        drive the scheduler themselves instead of using run().
+        :param now: time.monotonic() at the start of the tick
+        :return:
+        """
+        self._coalesce()
+        for scheduled in self._sinks:
+            if scheduled.next_due is None or now >= scheduled.next_due:
+                self._deliver(scheduled, now)
+
+    def _coalesce(self):
+        """
+        Take the newest frame of each changed universe from the frame
+        store and publish a new current state
+        :return:
+        """
+        changed = {}
+        for universe in self._frame_store.universes():
+            stamped = self._frame_store.get_latest_stamped(universe)
+            if stamped is not None:
+                changed[universe] = UniverseFrame(universe, *stamped)
+        if changed:
+            state = dict(self._state)
+            state.update(changed)
+            self._state = state
+        self.ticks += 1
+
+    def _deliver(self, scheduled, now):
+        """
+        Give a sink the universes that changed since it was last called
+        :param scheduled: A ScheduledSink
+        :param now: time.monotonic() at the start of the tick
+        :return:
+        """
+        sink = scheduled.sink
+        started = time.perf_counter()
+        for universe, frame in self._state.items():
+            last = scheduled.delivered.get(universe)
+            if last == frame.sequence:
+                continue
+            if last is not None and frame.sequence > last + 1:
+                scheduled.frames_skipped += frame.sequence - last - 1
+            sink.frame(universe, frame.data)
+            scheduled.delivered[universe] = frame.sequence
+            scheduled.frames_delivered += 1
+            if sink.renders:
+                self.rendered(frame)
+        sink.tick(now)
+
+        if scheduled.adaptive:
+            interval = scheduled.pacer.update(time.perf_counter() - started)
+        else:
+            interval = scheduled.pacer.base_interval
+        if scheduled.next_due is None:
+            scheduled.next_due = now
+        scheduled.next_due += interval
+        if scheduled.next_due < now:
+            scheduled.next_due = now + interval
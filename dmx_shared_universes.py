@@ -0,0 +1,349 @@
+#
+# DMX Emulator universe buffers in shared memory
+# Copyright © 2019  Dave Hocker (email: AtHomeX10@gmail.com)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the LICENSE file for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program (the LICENSE file).  If not, see <http://www.gnu.org/licenses/>.
+#
+
+#
+# Shared memory layout (all integers little endian)
+#
+# Header, 64 bytes:
+#   magic           8 bytes  b"DMXSHM\x00\x01"
+#   version         uint16   1
+#   slot_size       uint16   576
+#   num_universes   uint32
+#   reserved        48 bytes
+#
+# Followed by one 576 byte slot per universe. Slot n starts at 64 + n * 576:
+#   version         uint64   seqlock counter, odd while the slot is being written
+#   frames_received uint64
+#   bytes_received  uint64
+#   received_ns     uint64   time.monotonic_ns() when the frame arrived
+#   length          uint16   number of valid channels, 0-512
+#   reserved        30 bytes
+#   data            512 bytes
+#
+# Each slot has a single writer. The writer makes the version odd, writes
+# the slot, then makes it even again. A reader copies the slot and keeps
+# the copy only if the version was even and unchanged across the copy.
+# Readers never block the writer. On Linux the block is a file in
+# /dev/shm, and CLOCK_MONOTONIC is system wide, so receive times can be
+# compared between processes.
+#
+# The emulator exports its universes in a block of this layout when
+# shm_export_name is configured (see SharedUniverseExport). Any process can
+# map the block and read a universe without a system call:
+#
+#   python dmx_shared_universes.py <name> [--universe n] [--watch]
+#
+
+import argparse
+import struct
+import sys
+import threading
+import time
+from collections import namedtuple
+from multiprocessing import resource_tracker, shared_memory
+import app_logger
+
+logger = app_logger.getAppLogger()
+
+MAGIC = b"DMXSHM\x00\x01"
+VERSION = 1
+HEADER = struct.Struct("<8sHHL48x")
+HEADER_SIZE = HEADER.size
+SLOT_VERSION = struct.Struct("<Q")
+SLOT_HEADER = struct.Struct("<QQQQH30x")
+DMX_UNIVERSE_SIZE = 512
+SLOT_SIZE = SLOT_HEADER.size + DMX_UNIVERSE_SIZE
+
+# A consistent copy of one universe slot
+SharedFrame = namedtuple("SharedFrame", ["version", "frames_received", "bytes_received", "received_ns", "data"])
+
+
+def _open_shared_memory(name):
+    # Readers must not unlink the block when they exit. Before Python
+    # 3.13 attaching registers the block with the reader's resource
+    # tracker, which unlinks it when the reader exits, so registration is
+    # skipped for the duration of the attach.
+    if sys.version_info >= (3, 13):
+        return shared_memory.SharedMemory(name=name, track=False)
+    register = resource_tracker.register
+    resource_tracker.register = lambda name, rtype: None
+    try:
+        return shared_memory.SharedMemory(name=name)
+    finally:
+        resource_tracker.register = register
+
+
+class SharedUniverses:
+    """
+    A block of universe buffers in shared memory, written by ingest
+    worker processes and read by the main process (or any other process
+    that knows the block's name) without copying through a pipe.
+
+    Use create() in the owning process and attach() everywhere else.
+    """
+
+    # Reads retried while a slot is being written
+    read_attempts = 100
+
+    def __init__(self, shm, num_universes, owner):
+        """
+        Constructor. Use create() or attach().
+        :param shm: The SharedMemory block
+        :param num_universes: Number of universe slots
+        :param owner: True if this process created the block
+        """
+        self._shm = shm
+        self._owner = owner
+        self.num_universes = num_universes
+        self._buffer = shm.buf
+        # Writer side: the last version written per universe
+        self._versions = [0] * num_universes
+        self._frames = [0] * num_universes
+        self._bytes = [0] * num_universes
+
+    @classmethod
+    def create(cls, num_universes, name=None):
+        """
+        Create and initialize a block. An existing DMX block of the same
+        name, left behind by a run that did not exit cleanly, is replaced.
+        :param num_universes: Number of universe slots
+        :param name: Name of the block. None for a generated name.
+        :return: A SharedUniverses instance
+        """
+        size = HEADER_SIZE + num_universes * SLOT_SIZE
+        try:
+            shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+        except FileExistsError:
+            if name is None:
+                raise
+            # Left behind by an emulator that was killed or crashed
+            cls._remove_stale(name)
+            shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+        shm.buf[0:size] = bytes(size)
+        HEADER.pack_into(shm.buf, 0, MAGIC, VERSION, SLOT_SIZE, num_universes)
+        return cls(shm, num_universes, True)
+
+    @staticmethod
+    def _remove_stale(name):
+        """
+        Remove an existing block that has the name wanted for a new one,
+        if it is a DMX shared universe block
+        :param name: Name of the block
+        :return:
+        """
+        # Attached with the resource tracker, so the unlink below is
+        # matched by a registration
+        shm = shared_memory.SharedMemory(name=name)
+        try:
+            is_dmx = shm.size >= HEADER_SIZE and HEADER.unpack_from(shm.buf, 0)[0] == MAGIC
+            if not is_dmx:
+                raise FileExistsError("Shared memory {0} exists and is not a DMX shared universe block".format(name))
+            logger.warning("Removing shared memory block %s left behind by an earlier run", name)
+            shm.unlink()
+        finally:
+            shm.close()
+
+    @classmethod
+    def attach(cls, name):
+        """
+        Attach to an existing block
+        :param name: Name of the block
+        :return: A SharedUniverses instance
+        """
+        shm = _open_shared_memory(name)
+        try:
+            magic, version, slot_size, num_universes = HEADER.unpack_from(shm.buf, 0)
+            if magic != MAGIC or slot_size != SLOT_SIZE:
+                raise ValueError("{0} is not a DMX shared universe block".format(name))
+            if version != VERSION:
+                raise ValueError("Unsupported DMX shared universe block version {0}".format(version))
+        except Exception:
+            shm.close()
+            raise
+        return cls(shm, num_universes, False)
+
+    @property
+    def name(self):
+        return self._shm.name
+
+    def _offset(self, universe):
+        if universe < 0 or universe >= self.num_universes:
+            raise IndexError("universe {0} is not in the shared block".format(universe))
+        return HEADER_SIZE + universe * SLOT_SIZE
+
+    def write(self, universe, dmx_data, received_ns=None):
+        """
+        Write a frame to a universe slot. Only one process (and one
+        thread) may write a given universe.
+        :param universe: Universe number
+        :param dmx_data: The DMX data as a bytes-like object of 1-512 bytes
+        :param received_ns: time.monotonic_ns() when the frame arrived
+        :return:
+        """
+        if received_ns is None:
+            received_ns = time.monotonic_ns()
+        offset = self._offset(universe)
+        buffer = self._buffer
+        n = min(len(dmx_data), DMX_UNIVERSE_SIZE)
+        self._frames[universe] += 1
+        self._bytes[universe] += n
+        version = self._versions[universe]
+
+        # Odd while writing
+        SLOT_VERSION.pack_into(buffer, offset, version + 1)
+        start = offset + SLOT_HEADER.size
+        buffer[start:start + n] = dmx_data[0:n]
+        SLOT_HEADER.pack_into(buffer, offset, version + 1, self._frames[universe], self._bytes[universe],
+                              received_ns, n)
+        SLOT_VERSION.pack_into(buffer, offset, version + 2)
+        self._versions[universe] = version + 2
+
+    def version(self, universe):
+        """
+        Returns a universe's seqlock version, a cheap way to see whether
+        it has changed. Odd while a write is in progress.
+        :param universe: Universe number
+        """
+        return SLOT_VERSION.unpack_from(self._buffer, self._offset(universe))[0]
+
+    def read(self, universe):
+        """
+        Take a consistent copy of a universe slot
+        :param universe: Universe number
+        :return: A SharedFrame, or None if the slot has never been
+        written or stayed busy for read_attempts tries
+        """
+        offset = self._offset(universe)
+        buffer = self._buffer
+        start = offset + SLOT_HEADER.size
+        for attempt in range(self.read_attempts):
+            version, frames, bytes_received, received_ns, n = SLOT_HEADER.unpack_from(buffer, offset)
+            if version & 1:
+                # Let the writer finish
+                time.sleep(0)
+                continue
+            if version == 0:
+                return None
+            data = bytes(buffer[start:start + n])
+            if SLOT_VERSION.unpack_from(buffer, offset)[0] == version:
+                return SharedFrame(version, frames, bytes_received, received_ns, data)
+        return None
+
+    def view(self, universe):
+        """
+        A zero copy view of a universe's 512 data bytes. The view is not
+        synchronized with the writer: compare version() before and after
+        using it, as read() does.
+        :param universe: Universe number
+        :return: A memoryview, valid until close()
+        """
+        start = self._offset(universe) + SLOT_HEADER.size
+        return self._buffer[start:start + DMX_UNIVERSE_SIZE]
+
+    def close(self):
+        """
+        Detach from the block. Views from view() must be released first.
+        :return:
+        """
+        if self._buffer is not None:
+            self._buffer = None
+            self._shm.close()
+
+    def unlink(self):
+        """
+        Remove the block. Only the creator should do this.
+        :return:
+        """
+        if self._owner:
+            self._shm.unlink()
+            self._owner = False
+
+
+class SharedUniverseExport:
+    """
+    Frame store listener that publishes every received frame in a named
+    shared universe block, for other processes (visualizers, test
+    harnesses) to read. Frames for universes outside the block are not
+    exported. A lock per universe keeps each slot to a single writer
+    when several connections or receivers send the same universe.
+    """
+
+    def __init__(self, name, num_universes):
+        """
+        Create the block
+        :param name: Name of the block. On Linux it is /dev/shm/<name>.
+        :param num_universes: Number of universe slots
+        """
+        self.shared = SharedUniverses.create(num_universes, name=name)
+        self._locks = [threading.Lock() for universe in range(num_universes)]
+
+    def __call__(self, universe, sequence, dmx_data):
+        """
+        Publish a frame
+        :param universe: Universe number
+        :param sequence: The frame store sequence number (unused)
+        :param dmx_data: The DMX data as a bytes-like object
+        :return:
+        """
+        if 0 <= universe < len(self._locks):
+            with self._locks[universe]:
+                self.shared.write(universe, dmx_data)
+
+    def close(self):
+        """
+        Remove the block. Remove the listener from the frame store first.
+        :return:
+        """
+        self.shared.close()
+        self.shared.unlink()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Show the universes in a DMX shared universe block")
+    parser.add_argument("name", help="Name of the block (shm_export_name)")
+    parser.add_argument("--universe", type=int, default=None, help="Only show this universe")
+    parser.add_argument("--channels", type=int, default=16, help="Number of channels shown")
+    parser.add_argument("--watch", action="store_true", help="Show the universes every second until ctrl-c")
+    args = parser.parse_args()
+
+    shared = SharedUniverses.attach(args.name)
+    universes = range(shared.num_universes) if args.universe is None else [args.universe]
+    try:
+        while True:
+            now = time.monotonic_ns()
+            for universe in universes:
+                frame = shared.read(universe)
+                if frame is None:
+                    print("Universe {0}: no frames".format(universe))
+                    continue
+                print("Universe {0}: frames {1} age {2:.1f} ms channels {3}".format(
+                    universe, frame.frames_received, (now - frame.received_ns) / 1e6,
+                    list(frame.data[0:args.channels])))
+            if not args.watch:
+                break
+            time.sleep(1.0)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        shared.close()
+
+
+#
+# Run as an application
+#
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,210 @@
+#
+# DMX frame sinks - consumers of universe state in headless mode
+# Copyright © 2019  Dave Hocker (email: AtHomeX10@gmail.com)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the LICENSE file for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program (the LICENSE file).  If not, see <http://www.gnu.org/licenses/>.
+#
+
+import json
+import time
+import app_logger
+
+logger = app_logger.getAppLogger()
+
+
+class FrameSink:
+    """
+    Base class for a headless frame consumer.
+
+    The frame scheduler calls each sink at the sink's own rate. For
+    every universe that changed since the sink was last called, frame()
+    is called with the newest frame. Frames replaced in between are
+    skipped. tick() is called after all frames have been delivered.
+    """
+
+    # Calls per second. None for once per scheduler tick.
+    rate = None
+    # Lower the rate when the sink is too slow to keep up
+    adaptive = False
+    # Delivering a frame to this sink counts as rendering it, for the
+    # receive to render latency
+    renders = False
+
+    def open(self, frame_store):
+        """
+        Called once before the first frame
+        :param frame_store: The FrameStore being consumed
+        :return:
+        """
+        self._frame_store = frame_store
+
+    def frame(self, universe, dmx_data):
+        """
+        Called with the newest frame of a universe that has changed
+        :param universe: Universe number
+        :param dmx_data: The frame as bytes
+        :return:
+        """
+        pass
+
+    def tick(self, now):
+        """
+        Called once per call of the sink
+        :param now: time.monotonic() at the start of the scheduler tick
+        :return:
+        """
+        pass
+
+    def close(self):
+        """
+        Called once when the scheduler stops
+        :return:
+        """
+        pass
+
+
+class StatsSink(FrameSink):
+    """
+    Periodically logs frame statistics for every universe
+    """
+
+    def __init__(self, interval=10.0):
+        """
+        Constructor
+        :param interval: Seconds between statistics reports
+        """
+        self._interval = interval
+        self._next_report = None
+        # universe: frames_received at the last report
+        self._last_received = {}
+
+    def tick(self, now):
+        if self._next_report is None:
+            self._next_report = now + self._interval
+        elif now >= self._next_report:
+            self._next_report += self._interval
+            self.report()
+
+    def close(self):
+        self.report()
+
+    def report(self):
+        for universe in self._frame_store.universes():
+            state = self._frame_store.universe(universe)
+            received = state.frames_received
+            rate = (received - self._last_received.get(universe, 0)) / self._interval
+            self._last_received[universe] = received
+            logger.info("Universe %d: received %d (%.1f/sec) dropped %d coalesced %d queued %d",
+                        universe, received, rate, state.frames_dropped,
+                        state.frames_coalesced, state.queue_depth())
+            self._report_latency(state.latency)
+        for tracker in self._frame_store.connections():
+            self._report_latency(tracker)
+
+    @staticmethod
+    def _report_latency(tracker):
+        """
+        Log a latency tracker's histograms
+        :param tracker: A LatencyTracker
+        :return:
+        """
+        for title, histogram in (("inter-arrival", tracker.inter_arrival),
+                                 ("receive to render", tracker.receive_to_render)):
+            if histogram.count:
+                logger.info("  %s %s ms: p50 %.2f p99 %.2f p99.9 %.2f max %.2f stddev %.2f",
+                            tracker.name, title,
+                            histogram.value_at_percentile(50.0) / 1e6,
+                            histogram.value_at_percentile(99.0) / 1e6,
+                            histogram.value_at_percentile(99.9) / 1e6,
+                            histogram.max / 1e6, histogram.stddev() / 1e6)
+
+
+class RecorderSink(FrameSink):
+    """
+    Writes the newest state of each changed universe to a file, one
+    JSON object per line, at most once per call. When the disk is slow
+    the recording rate drops instead of the recorder falling behind.
+    """
+
+    adaptive = True
+
+    def __init__(self, file_path, rate=None):
+        """
+        Constructor
+        :param file_path: Full path to the output file
+        :param rate: Most records per second per universe. None for once
+        per scheduler tick.
+        """
+        self._file_path = file_path
+        self.rate = rate
+        self._file = None
+
+    def open(self, frame_store):
+        super(RecorderSink, self).open(frame_store)
+        self._file = open(self._file_path, "a")
+        logger.info("Recording universe state to %s", self._file_path)
+
+    def frame(self, universe, dmx_data):
+        record = {
+            "time": time.time(),
+            "universe": universe,
+            "channels": list(dmx_data),
+        }
+        self._file.write(json.dumps(record) + "\n")
+
+    def tick(self, now):
+        self._file.flush()
+
+    def close(self):
+        if self._file:
+            self._file.close()
+            self._file = None
+
+
+class MetricsSink(FrameSink):
+    """
+    Counts the frames consumed per universe and the consumption rate,
+    the headless equivalent of the DMX window's render rate.
+    """
+
+    renders = True
+
+    def __init__(self, interval=1.0, rate=None):
+        """
+        Constructor
+        :param interval: Seconds over which the rate is measured
+        :param rate: Calls per second. None for once per scheduler tick.
+        """
+        self._interval = interval
+        self.rate = rate
+        # universe: frames consumed
+        self.frames_consumed = {}
+        # universe: frames consumed per second over the last interval
+        self.consume_rate = {}
+        self._interval_start = None
+        self._interval_counts = {}
+
+    def frame(self, universe, dmx_data):
+        self.frames_consumed[universe] = self.frames_consumed.get(universe, 0) + 1
+        self._interval_counts[universe] = self._interval_counts.get(universe, 0) + 1
+
+    def tick(self, now):
+        if self._interval_start is None:
+            self._interval_start = now
+            return
+        elapsed = now - self._interval_start
+        if elapsed >= self._interval:
+            for universe in self.frames_consumed.keys():
+                self.consume_rate[universe] = self._interval_counts.get(universe, 0) / elapsed
+            self._interval_counts = {}
+            self._interval_start = now
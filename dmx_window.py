@@ -22,22 +22,64 @@ if sys.version_info.major is 3:
     from tkinter import ttk
 else:
     import Tkinter as Tk, tkFont
+import re
+import time
 from dmx_connection_handler import DMXConnectionHandler
+from dmx_scheduler import AdaptiveInterval, FrameScheduler
+
+# Matches any byte that is not zero
+_NON_ZERO_BYTE = re.compile(b'[^\x00]')
+
+
+def changed_channels(old_values, new_values):
+    """
+    Find the channels whose values differ between two frames. The
+    comparison is done on whole buffers: the frames are XORed as big
+    integers and the non-zero bytes of the result are located with a
+    regular expression, so there is no Python level loop per channel.
+    :param old_values: bytes-like object
+    :param new_values: bytes-like object of the same length
+    :return: List of changed channel indexes
+    """
+    if old_values == new_values:
+        return []
+    diff = int.from_bytes(old_values, "big") ^ int.from_bytes(new_values, "big")
+    diff = diff.to_bytes(len(new_values), "big")
+    return [m.start() for m in _NON_ZERO_BYTE.finditer(diff)]
+
 
 class DMXTestFrame(Tk.Tk):
-    def __init__(self, num_channels, polling_interval_ms=30, frame_size=0):
+    def __init__(self, num_channels, polling_interval_ms=30, frame_size=0, num_universes=1,
+                 scheduler=None, max_polling_interval_ms=500):
         """
         Constructor
         :param num_channels: Number of pixels in LED string
         :param polling_interval: Polling time in ms.
+        :param num_universes: Number of universes that can be viewed
+        :param scheduler: The running FrameScheduler to display
+        :param max_polling_interval_ms: Longest polling time in ms when
+        rendering cannot keep up
         """
         # TODO Rework for DMX-512
         super(DMXTestFrame, self).__init__()
         self.title("DMX Emulator")
         self._num_channels = num_channels
-
-        # This is the polling time converted to seconds (e.g. 0.030 = 30ms)
+        self._num_universes = num_universes
+        # The universe being displayed
+        self._universe = 0
+
+        # Frames are taken from the scheduler's current state
+        self._scheduler = scheduler
+        # Sequence of the frame on display
+        self._rendered_sequence = None
+        self.frames_skipped = 0
+
+        # This is the polling time converted to seconds (e.g. 0.030 = 30ms).
+        # When rendering takes too long the interval is stretched, skipping
+        # frames, so the Tk event loop stays responsive.
         self._polling_interval = float(polling_interval_ms) / 1000.0
+        self._pacer = AdaptiveInterval(self._polling_interval, float(max_polling_interval_ms) / 1000.0)
+        self._shown_interval = self._polling_interval
         # How many polling intervals to wait to clear change marker
         self._clear_changes_after = 10.0
         self._reset_changed_count = 0
@@ -73,6 +115,14 @@ class DMXTestFrame(Tk.Tk):
         self._channels = []
         self._channel_values = []
 
+        # What is currently on the canvas. Only channels that differ from
+        # this are updated when a new frame is rendered.
+        self._rendered_values = bytearray(self._num_channels)
+        # Channels 0 to n-1 have displayed a value (the rest show ---)
+        self._rendered_count = 0
+        # Channels 0 to n-1 are marked as changed
+        self._marked_count = 0
+
         # Top and bottom
         # Top is offset from border
         y0 = 6
@@ -141,6 +191,15 @@ class DMXTestFrame(Tk.Tk):
         self._frame_count_w.grid(row=metrics_gr, column=2)
         self._frame_count_w["text"] = "DMX frame count: " + str(self._frame_count)
 
+        # Universe selector
+        if self._num_universes > 1:
+            self._universe_label = Tk.Label(self._metrics_frame, font=self._fixed_font, text="Universe:")
+            self._universe_label.grid(row=metrics_gr, column=3)
+            self._universe_w = Tk.Spinbox(self._metrics_frame, font=self._fixed_font, width=4,
+                                          from_=0, to=self._num_universes - 1,
+                                          state="readonly", command=self._select_universe)
+            self._universe_w.grid(row=metrics_gr, column=4)
+
         main_gr += 1
 
         # Quit button
@@ -164,41 +223,112 @@ class DMXTestFrame(Tk.Tk):
 
     def _next_frame(self):
         """
-        Process all queued DMX data frames
+        Render the current state of the universe. Frames that arrived
+        since the last poll are collapsed into the latest one.
         :return:
         """
-        # Here's where we need to get the next data frame
-        frame = DMXConnectionHandler.get_frame()
-        while frame:
-            # Each frame contains up to 512 channel values
-            self._frame_count += 1
+        started = time.perf_counter()
+        frame = self._scheduler.latest(self._universe)
+        if frame and frame.sequence != self._rendered_sequence:
+            if self._rendered_sequence is not None and frame.sequence > self._rendered_sequence + 1:
+                self.frames_skipped += frame.sequence - self._rendered_sequence - 1
+            self._rendered_sequence = frame.sequence
+            self._frame_count = DMXConnectionHandler.frames_received(self._universe)
             self._frame_count_w["text"] = "Frame count: " + str(self._frame_count)
-            for i in range(len(frame)):
-                channel_value = int(frame[i])
-                self._canvas.itemconfigure(self._channels[i], fill="green")
-                self._canvas.itemconfigure(self._channel_values[i], text=str(channel_value))
-            # Reset unchanged channels
-            for i in range(len(frame), self._num_channels):
-                self._canvas.itemconfigure(self._channels[i], fill="")
+            self._render_frame(frame.data)
+            # Draw now, so the time taken includes the redraw
+            self.update_idletasks()
+            self._scheduler.rendered(frame)
 
             # How many poll intervals until it's time to clear change markers
             self._reset_changed_count = int(self._clear_changes_after / self._polling_interval)
 
-            # Check for another DMX data frame
-            frame = DMXConnectionHandler.get_frame()
-
         # Reset changed markers after n polls with no changes
         if self._reset_changed_count > 0:
             self._reset_changed_count -= 1
         elif self._reset_changed_count == 0:
-            for i in range(self._num_channels):
-                self._canvas.itemconfigure(self._channels[i], fill="")
+            self._mark_channels(0)
             self._reset_changed_count = -1
 
+        self._polling_interval = self._pacer.update(time.perf_counter() - started)
+        if abs(self._polling_interval - self._shown_interval) >= 0.005:
+            self._shown_interval = self._polling_interval
+            self._speed_wait["text"] = "Polling Interval: " + "{0:.3f}".format(self._polling_interval) + "sec"
+
         # Scehdule next polling cycle
         self.after(int(self._polling_interval * 1000.0), self._next_frame)
 
-def run_dmx_window(num_channels, polling_interval):
-    test_frame = DMXTestFrame(num_channels, polling_interval_ms=polling_interval)
+    def _select_universe(self):
+        """
+        Switch the display to the universe chosen in the selector
+        :return:
+        """
+        universe = int(self._universe_w.get())
+        if universe == self._universe:
+            return
+        self._universe = universe
+
+        # Start over with a blank display, then show the universe's
+        # current state straight away
+        for i in range(self._rendered_count):
+            self._canvas.itemconfigure(self._channel_values[i], text="---")
+        self._rendered_count = 0
+        self._mark_channels(0)
+
+        self._frame_count = DMXConnectionHandler.frames_received(universe)
+        self._frame_count_w["text"] = "Frame count: " + str(self._frame_count)
+        frame = self._scheduler.latest(universe)
+        self._rendered_sequence = None
+        if frame:
+            self._rendered_sequence = frame.sequence
+            self._render_frame(frame.data)
+            self._mark_channels(0)
+
+    def _render_frame(self, frame):
+        """
+        Update the canvas items of the channels that changed
+        :param frame: Up to 512 channel values
+        :return:
+        """
+        n = min(len(frame), self._num_channels)
+        frame = frame[0:n]
+
+        # Channels showing a value that may have changed
+        shown = min(n, self._rendered_count)
+        changed = changed_channels(self._rendered_values[0:shown], frame[0:shown])
+        # Channels that are showing a value for the first time
+        changed.extend(range(shown, n))
+
+        for i in changed:
+            self._canvas.itemconfigure(self._channel_values[i], text=str(frame[i]))
+        self._rendered_values[0:n] = frame
+        self._rendered_count = max(self._rendered_count, n)
+
+        # Channels in the frame are marked, the rest are reset
+        self._mark_channels(n)
+
+    def _mark_channels(self, count):
+        """
+        Mark the first count channels as changed and reset the rest
+        :param count: Number of channels to mark
+        :return:
+        """
+        for i in range(self._marked_count, count):
+            self._canvas.itemconfigure(self._channels[i], fill="green")
+        for i in range(count, self._marked_count):
+            self._canvas.itemconfigure(self._channels[i], fill="")
+        self._marked_count = count
+
+def run_dmx_window(num_channels, polling_interval, num_universes=1, scheduler=None, max_polling_interval=500):
+    own_scheduler = scheduler is None
+    if own_scheduler:
+        scheduler = FrameScheduler(DMXConnectionHandler.get_frame_store(), tick_interval_ms=polling_interval)
+        scheduler.start()
+    test_frame = DMXTestFrame(num_channels, polling_interval_ms=polling_interval, num_universes=num_universes,
+                              scheduler=scheduler, max_polling_interval_ms=max_polling_interval)
     test_frame.mainloop()
+    if own_scheduler:
+        scheduler.stop()
+    if test_frame.frames_skipped:
+        print("DMX window skipped {0} frames".format(test_frame.frames_skipped))
     print("DMX window closed")
\ No newline at end of file
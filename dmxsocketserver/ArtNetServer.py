@@ -0,0 +1,86 @@
+# coding: utf-8
+#
+# AtHomeSocketServer
+# Copyright © 2016, 2019  Dave Hocker (email: AtHomeX10@gmail.com)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3 of the License.
+#
+# See the LICENSE file for more details.
+#
+
+#
+# Art-Net (UDP) receiver
+#
+
+from struct import unpack_from
+from .DatagramServer import DatagramServer
+
+# Art-Net constants
+ARTNET_PORT = 6454
+ARTNET_ID = b"Art-Net\x00"
+OP_DMX = 0x5000
+# ArtDmx header: ID, OpCode (LE), ProtVer (BE), Sequence, Physical,
+# SubUni, Net, Length (BE)
+ARTDMX_HEADER_SIZE = 18
+MIN_PROTOCOL_VERSION = 14
+
+
+class ArtNetServer(DatagramServer):
+    """
+    Receives ArtDmx packets on a UDP socket.
+
+    The 15 bit Art-Net port address (Net, SubNet and Universe) is used as
+    the emulator universe number. Each valid packet is passed to the
+    handler's execute_universe(universe, dmx_data) method.
+    """
+
+    def __init__(self, server_address, handler):
+        """
+        Create the server and bind its socket
+        :param server_address: (host, port) tuple, normally port 6454
+        :param handler: An object with an execute_universe(universe, dmx_data) method
+        """
+        super(ArtNetServer, self).__init__(server_address)
+        self._handler = handler
+
+        # Statistics
+        self.packets_received = 0
+        self.packets_rejected = 0
+
+    def process_packet(self, packet):
+        """
+        Parse one datagram and pass its DMX data to the handler
+        :param packet: memoryview of the datagram
+        :return:
+        """
+        parsed = self.parse_artdmx(packet)
+        if parsed is None:
+            self.packets_rejected += 1
+            return
+        universe, dmx_data = parsed
+        self.packets_received += 1
+        self._handler.execute_universe(universe, dmx_data)
+
+    @staticmethod
+    def parse_artdmx(packet):
+        """
+        Parse an ArtDmx packet without copying its data
+        :param packet: bytes-like object holding the datagram
+        :return: Returns a tuple of (port address, DMX data view) or
+        None if the packet is not a valid ArtDmx packet
+        """
+        if len(packet) < ARTDMX_HEADER_SIZE or packet[0:8] != ARTNET_ID:
+            return None
+        opcode = unpack_from("<H", packet, 8)[0]
+        if opcode != OP_DMX:
+            # ArtPoll, ArtSync etc. are not used by the emulator
+            return None
+        protocol_version, sub_uni, net, length = unpack_from("!HxxBBH", packet, 10)
+        if protocol_version < MIN_PROTOCOL_VERSION:
+            return None
+        if length < 1 or length > 512 or ARTDMX_HEADER_SIZE + length > len(packet):
+            return None
+        port_address = ((net & 0x7F) << 8) | sub_uni
+        return port_address, memoryview(packet)[ARTDMX_HEADER_SIZE:ARTDMX_HEADER_SIZE + length]
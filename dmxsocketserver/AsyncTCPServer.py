@@ -0,0 +1,236 @@
+# coding: utf-8
+#
+# AtHomeSocketServer
+# Copyright © 2016, 2019  Dave Hocker (email: AtHomeX10@gmail.com)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3 of the License.
+#
+# See the LICENSE file for more details.
+#
+
+#
+# TCP server using a single asyncio event loop instead of a thread per connection
+#
+
+import asyncio
+import socket
+import threading
+from struct import unpack
+from .TCPRequestHandler import TCPRequestHandler
+from . import FrameCodec
+
+
+class AsyncTCPServer:
+    """
+    Serves the same DMX frame protocol (length-prefixed and typed) as
+    ThreadedTCPServer + TCPRequestHandler, but all connections are
+    handled by coroutines on one event loop.
+
+    The public interface mirrors socketserver.TCPServer: the listening
+    socket is bound by the constructor, serve_forever() runs the server
+    on the calling thread and shutdown() (called from another thread)
+    stops it and waits for serve_forever() to return. Unlike TCPServer,
+    a list of addresses can be given to listen on several ports from
+    the same event loop.
+
+    The command handler class and maximum frame size are the ones
+    injected into TCPRequestHandler, so both engines are configured
+    the same way.
+    """
+
+    allow_reuse_address = True
+    request_queue_size = 5
+
+    def __init__(self, server_address):
+        """
+        Create the server and bind its listening socket(s)
+        :param server_address: (host, port) tuple or a list of them
+        """
+        if isinstance(server_address, tuple):
+            server_addresses = [server_address]
+        else:
+            server_addresses = list(server_address)
+        self.server_address = server_addresses[0]
+        self.server_addresses = server_addresses
+
+        self.sockets = []
+        try:
+            for address in server_addresses:
+                sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+                self.sockets.append(sock)
+                if self.allow_reuse_address:
+                    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+                sock.bind(address)
+                sock.listen(self.request_queue_size)
+        except Exception:
+            self.server_close()
+            raise
+        self.socket = self.sockets[0]
+
+        self._loop = asyncio.new_event_loop()
+        self._shutdown_requested = False
+        self._shutdown_request = None
+        # Open connections, writer: handler task
+        self._connections = {}
+        self._is_shut_down = threading.Event()
+        self._is_shut_down.set()
+
+    def serve_forever(self):
+        """
+        Run the event loop until shutdown() is called
+        :return:
+        """
+        self._is_shut_down.clear()
+        try:
+            asyncio.set_event_loop(self._loop)
+            self._loop.run_until_complete(self._serve())
+        finally:
+            self._loop.close()
+            self._is_shut_down.set()
+
+    def shutdown(self):
+        """
+        Stop serve_forever() and wait for it to finish. Must be called
+        from a different thread than the one running serve_forever().
+        :return:
+        """
+        try:
+            self._loop.call_soon_threadsafe(self._request_shutdown)
+        except RuntimeError:
+            # The event loop has already been closed
+            pass
+        self._is_shut_down.wait()
+
+    def server_close(self):
+        """
+        Close the listening socket(s)
+        :return:
+        """
+        for sock in self.sockets:
+            sock.close()
+
+    def _request_shutdown(self):
+        # Runs on the event loop. This can happen before _serve() has
+        # started, so the request is also remembered in a flag.
+        self._shutdown_requested = True
+        if self._shutdown_request:
+            self._shutdown_request.set()
+
+    async def _serve(self):
+        self._shutdown_request = asyncio.Event()
+        if self._shutdown_requested:
+            self._shutdown_request.set()
+        servers = []
+        for sock in self.sockets:
+            servers.append(await asyncio.start_server(self._handle_connection, sock=sock))
+
+        await self._shutdown_request.wait()
+
+        # Stop accepting, then drop every open connection
+        for server in servers:
+            server.close()
+        connections = list(self._connections.items())
+        for writer, task in connections:
+            writer.close()
+        await asyncio.gather(*[task for writer, task in connections], return_exceptions=True)
+        for server in servers:
+            await server.wait_closed()
+
+    async def _handle_connection(self, reader, writer):
+        """
+        Coroutine equivalent of TCPRequestHandler.handle()
+        :param reader: asyncio.StreamReader for the connection
+        :param writer: asyncio.StreamWriter for the connection
+        :return:
+        """
+        self._connections[writer] = asyncio.current_task()
+        print("Connection from {0}".format(writer.get_extra_info("peername")[0]))
+        port = writer.get_extra_info("sockname")[1]
+
+        handler = None
+        if TCPRequestHandler.command_handler_class:
+            handler = TCPRequestHandler.command_handler_class()
+        # Typed frames are applied to this connection's universe buffer
+        decoder = FrameCodec.FrameDecoder(TCPRequestHandler.max_frame_size)
+
+        try:
+            while True:
+                dmx_data = await self._read_dmx_data(reader, writer, decoder)
+                if not dmx_data:
+                    # We consider this an error, so we force close the socket
+                    break
+                try:
+                    if handler:
+                        handler.execute_command(port, dmx_data)
+                except Exception as ex:
+                    print("Exception occurred while handling DMX data")
+                    print(str(ex))
+                    print(dmx_data)
+
+                TCPRequestHandler.call_sequence += 1
+        except (ConnectionError, asyncio.CancelledError):
+            pass
+        finally:
+            del self._connections[writer]
+            writer.close()
+            close = getattr(handler, "close", None)
+            if close:
+                close()
+        print("Connection closed")
+
+    @staticmethod
+    async def _read_dmx_data(reader, writer, decoder):
+        """
+        Read one length-prefixed or typed DMX data frame
+        :param reader: asyncio.StreamReader for the connection
+        :param writer: asyncio.StreamWriter for the connection, for
+        replying to a HELLO
+        :param decoder: The connection's FrameCodec.FrameDecoder
+        :return: Returns the frame as a bytes-like object or None
+        """
+        while True:
+            try:
+                client_frame_size = await reader.readexactly(4)
+            except asyncio.IncompleteReadError:
+                return None
+            # Note that the result of unpack is a tuple with one value
+            client_frame_size = unpack('!i', client_frame_size)[0]
+            if client_frame_size < 0:
+                # A typed frame (see FrameCodec)
+                frame_type, client_frame_size = FrameCodec.split_header(client_frame_size)
+                if not decoder.accepts(frame_type, client_frame_size):
+                    print("Client frame type or size is invalid")
+                    TCPRequestHandler.frames_rejected_invalid += 1
+                    return None
+            else:
+                frame_type = FrameCodec.FRAME_RAW
+                if client_frame_size > TCPRequestHandler.max_frame_size:
+                    print("Client frame size is too large")
+                    TCPRequestHandler.frames_rejected_oversize += 1
+                    return None
+                if client_frame_size < 1:
+                    print("Client frame size is invalid")
+                    TCPRequestHandler.frames_rejected_invalid += 1
+                    return None
+
+            try:
+                dmx_data = await reader.readexactly(client_frame_size)
+            except asyncio.IncompleteReadError:
+                print("Failed to receive complete frame")
+                TCPRequestHandler.frames_rejected_short += 1
+                return None
+
+            if frame_type == FrameCodec.FRAME_HELLO:
+                writer.write(decoder.hello(dmx_data))
+                await writer.drain()
+                continue
+            if decoder.version == FrameCodec.PROTOCOL_LEGACY:
+                return dmx_data
+
+            dmx_data = decoder.decode(frame_type, dmx_data)
+            if dmx_data is None:
+                print("Client frame data is invalid")
+                TCPRequestHandler.frames_rejected_invalid += 1
+            return dmx_data
@@ -0,0 +1,169 @@
+# coding: utf-8
+#
+# AtHomeSocketServer
+# Copyright © 2016, 2019  Dave Hocker (email: AtHomeX10@gmail.com)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3 of the License.
+#
+# See the LICENSE file for more details.
+#
+
+#
+# Base class for UDP receivers
+#
+
+import selectors
+import socket
+import threading
+
+# Largest datagram we care about, rounded up
+MAX_PACKET_SIZE = 1024
+
+
+class DatagramServer:
+    """
+    Receives datagrams on a non-blocking UDP socket.
+
+    When the selector reports the socket readable, every queued datagram
+    is drained into a set of preallocated buffers before any of them is
+    processed. Python has no binding for recvmmsg, so draining is a
+    recv_into loop, but it runs without returning to the selector
+    between packets.
+
+    Subclasses implement process_packet(), and optionally end_batch()
+    (called after each drained batch) and idle() (called at least every
+    poll_interval seconds).
+
+    The interface mirrors socketserver.UDPServer so SocketServerThread
+    can run it alongside the TCP listeners.
+    """
+
+    # Datagrams drained per wakeup before they are processed
+    batch_size = 64
+    # How often serve_forever checks for shutdown (seconds)
+    poll_interval = 0.5
+    # Kernel receive buffer. Lighting protocols are bursty with many universes.
+    receive_buffer_size = 4 * 1024 * 1024
+
+    def __init__(self, server_address):
+        """
+        Create the server and bind its socket
+        :param server_address: (host, port) tuple
+        """
+        self.server_address = server_address
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        try:
+            self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, self.receive_buffer_size)
+            self.socket.bind(server_address)
+            self.socket.setblocking(False)
+        except Exception:
+            self.socket.close()
+            raise
+
+        self._buffers = [bytearray(MAX_PACKET_SIZE) for i in range(self.batch_size)]
+        self._views = [memoryview(b) for b in self._buffers]
+
+        self._shutdown_request = False
+        self._is_shut_down = threading.Event()
+        self._is_shut_down.set()
+
+    def serve_forever(self):
+        """
+        Receive packets until shutdown() is called
+        :return:
+        """
+        self._is_shut_down.clear()
+        try:
+            with selectors.DefaultSelector() as selector:
+                selector.register(self.socket, selectors.EVENT_READ)
+                while not self._shutdown_request:
+                    if selector.select(self.poll_interval):
+                        self._drain()
+                    # idle() may hand frames on too (sACN source
+                    # timeouts), so it is guarded like end_batch()
+                    try:
+                        self.idle()
+                    except Exception as ex:
+                        print("Exception occurred while {0} was idle".format(type(self).__name__))
+                        print(str(ex))
+        finally:
+            self._shutdown_request = False
+            self._is_shut_down.set()
+
+    def shutdown(self):
+        """
+        Stop serve_forever() and wait for it to finish
+        :return:
+        """
+        self._shutdown_request = True
+        self._is_shut_down.wait()
+
+    def server_close(self):
+        """
+        Close the socket
+        :return:
+        """
+        self.socket.close()
+
+    def _drain(self):
+        """
+        Read every queued datagram, up to batch_size at a time, then
+        process them
+        :return:
+        """
+        while True:
+            count = 0
+            sizes = []
+            while count < self.batch_size:
+                try:
+                    size = self.socket.recv_into(self._buffers[count])
+                except (BlockingIOError, InterruptedError):
+                    break
+                sizes.append(size)
+                count += 1
+
+            for i in range(count):
+                try:
+                    self.process_packet(self._views[i][0:sizes[i]])
+                except Exception as ex:
+                    print("Exception occurred while handling {0} data".format(type(self).__name__))
+                    print(str(ex))
+            if count:
+                # end_batch() hands frames on (to frame store listeners,
+                # for instance). An exception there must not stop the
+                # receiver.
+                try:
+                    self.end_batch()
+                except Exception as ex:
+                    print("Exception occurred while ending a {0} batch".format(type(self).__name__))
+                    print(str(ex))
+
+            if count < self.batch_size:
+                # The socket is empty
+                return
+
+    def process_packet(self, packet):
+        """
+        Handle one datagram
+        :param packet: memoryview of the datagram. It is only valid until
+        the end of the current batch.
+        :return:
+        """
+        raise NotImplementedError()
+
+    def end_batch(self):
+        """
+        Called after every packet of a drained batch has been processed
+        :return:
+        """
+        pass
+
+    def idle(self):
+        """
+        Called after every selector wakeup or timeout
+        :return:
+        """
+        pass
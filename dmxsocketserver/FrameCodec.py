@@ -0,0 +1,269 @@
+# coding: utf-8
+#
+# AtHomeSocketServer
+# Copyright © 2016, 2019  Dave Hocker (email: AtHomeX10@gmail.com)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3 of the License.
+#
+# See the LICENSE file for more details.
+#
+
+#
+# Typed frames (protocol version 2)
+#
+# A version 1 (legacy) frame is a signed, big endian 32 bit length of
+# 1-512 followed by that many channel bytes. Version 2 keeps legacy frames
+# and adds typed frames. The 4 byte header of a typed frame has the top bit
+# set, so a version 1 server rejects it as an invalid length:
+#
+#   bit 31      1
+#   bits 24-30  frame type
+#   bits 0-23   payload length
+#
+# FRAME_HELLO   Payload: uint32, the highest version the client speaks.
+#               The server replies with a HELLO carrying the version it
+#               will use. Sent first, before any frame.
+# FRAME_FULL    Payload: 1-512 channel bytes, as in a legacy frame.
+# FRAME_DELTA   Payload: zero or more (uint16 channel, uint8 value) entries
+#               applied to the connection's previous frame. A channel past
+#               the end of the previous frame extends it, with zeroes in
+#               between. An empty delta repeats the previous frame.
+# FRAME_RLE     Payload: (uint8 count 1-255, uint8 value) runs. The frame
+#               is the runs one after the other, 1-512 channels.
+#
+# Typed frames are only accepted once a HELLO has agreed on version 2.
+#
+
+from struct import Struct
+
+PROTOCOL_LEGACY = 1
+PROTOCOL_TYPED = 2
+# Highest version this implementation speaks
+PROTOCOL_VERSION = PROTOCOL_TYPED
+
+FRAME_HELLO = 0
+FRAME_FULL = 1
+FRAME_DELTA = 2
+FRAME_RLE = 3
+# A legacy, length only frame
+FRAME_RAW = -1
+
+TYPED_FRAME = 0x80000000
+HEADER = Struct("!I")
+HELLO = Struct("!I")
+DELTA_ENTRY = Struct("!HB")
+RLE_RUN = Struct("!BB")
+MAX_RUN = 255
+
+# A run of each value, sliced for RLE decoding
+_RUNS = [bytes([value]) * MAX_RUN for value in range(256)]
+
+
+def typed_header(frame_type, payload_size):
+    """
+    Pack the header of a typed frame
+    :param frame_type: One of the FRAME_ constants
+    :param payload_size: Payload length in bytes
+    :return: 4 bytes
+    """
+    return HEADER.pack(TYPED_FRAME | (frame_type << 24) | payload_size)
+
+
+def split_header(word):
+    """
+    Split a typed frame header
+    :param word: The header as a signed 32 bit integer (negative)
+    :return: (frame type, payload length)
+    """
+    return (word >> 24) & 0x7F, word & 0xFFFFFF
+
+
+def max_payload_size(max_frame_size):
+    """
+    Returns the largest payload of any frame type, the size a
+    receive buffer must be able to hold
+    :param max_frame_size: Largest frame in channels
+    """
+    return max(DELTA_ENTRY.size, RLE_RUN.size) * max_frame_size
+
+
+class FrameDecoder:
+    """
+    The server side of a connection. Keeps the connection's universe
+    buffer, the channels of the last frame received, and applies full,
+    delta and RLE frames to it in place.
+
+    Until a HELLO agrees on version 2 the decoder is not involved:
+    legacy frames are passed on as they were received. After that every
+    frame goes through the universe buffer and decode() returns a
+    read-only view of it, which is only valid until the next frame.
+    """
+
+    def __init__(self, max_frame_size=512):
+        """
+        Constructor
+        :param max_frame_size: Largest frame in channels
+        """
+        self.max_frame_size = max_frame_size
+        self.version = PROTOCOL_LEGACY
+        self._buffer = bytearray(max_frame_size)
+        self._view = memoryview(self._buffer)
+        self._readonly_view = self._view.toreadonly()
+        # Number of channels in the last frame
+        self._length = 0
+
+    def accepts(self, frame_type, payload_size):
+        """
+        Check a typed frame header before its payload is read
+        :param frame_type: Frame type from split_header()
+        :param payload_size: Payload length from split_header()
+        :return: True if the frame is valid at the current version
+        """
+        if frame_type == FRAME_HELLO:
+            return self.version == PROTOCOL_LEGACY and payload_size == HELLO.size
+        if self.version < PROTOCOL_TYPED:
+            return False
+        if frame_type == FRAME_FULL:
+            return 1 <= payload_size <= self.max_frame_size
+        if frame_type == FRAME_DELTA:
+            return payload_size % DELTA_ENTRY.size == 0 and \
+                payload_size <= DELTA_ENTRY.size * self.max_frame_size
+        if frame_type == FRAME_RLE:
+            return payload_size % RLE_RUN.size == 0 and \
+                RLE_RUN.size <= payload_size <= RLE_RUN.size * self.max_frame_size
+        return False
+
+    def hello(self, payload):
+        """
+        Agree on a protocol version
+        :param payload: The HELLO payload
+        :return: The reply to send to the client
+        """
+        client_version = HELLO.unpack(payload)[0]
+        self.version = max(PROTOCOL_LEGACY, min(client_version, PROTOCOL_VERSION))
+        return typed_header(FRAME_HELLO, HELLO.size) + HELLO.pack(self.version)
+
+    def decode(self, frame_type, payload):
+        """
+        Apply a frame to the universe buffer
+        :param frame_type: FRAME_RAW, FRAME_FULL, FRAME_DELTA or FRAME_RLE
+        :param payload: The payload as a bytes-like object
+        :return: A read-only view of the universe buffer, or None if the
+        payload is invalid
+        """
+        # The payload is checked in full before the buffer is touched, so
+        # an invalid frame leaves the previous frame as it was
+        buffer = self._buffer
+        if frame_type == FRAME_RAW or frame_type == FRAME_FULL:
+            length = len(payload)
+            if length < 1 or length > self.max_frame_size:
+                return None
+            self._view[0:length] = payload
+        elif frame_type == FRAME_DELTA:
+            entries = list(DELTA_ENTRY.iter_unpack(payload))
+            length = self._length
+            if entries:
+                highest = max(channel for channel, value in entries)
+                if highest >= self.max_frame_size:
+                    return None
+                if highest >= length:
+                    # Channels past the end of the previous frame extend
+                    # it, with zeroes in between
+                    self._view[length:highest + 1] = bytes(highest + 1 - length)
+                    length = highest + 1
+            if length == 0:
+                return None
+            for channel, value in entries:
+                buffer[channel] = value
+        elif frame_type == FRAME_RLE:
+            runs = list(RLE_RUN.iter_unpack(payload))
+            length = sum(count for count, value in runs)
+            if not runs or length > self.max_frame_size or any(count == 0 for count, value in runs):
+                return None
+            start = 0
+            for count, value in runs:
+                self._view[start:start + count] = _RUNS[value][0:count]
+                start += count
+        else:
+            return None
+        self._length = length
+        return self._readonly_view[0:length]
+
+
+class FrameEncoder:
+    """
+    The client side of a version 2 connection. Remembers the last frame
+    sent and encodes each new frame as whichever of a full, delta or RLE
+    frame is smallest.
+    """
+
+    def __init__(self):
+        self._previous = None
+
+        # Statistics, frames sent per type
+        self.frames_full = 0
+        self.frames_delta = 0
+        self.frames_rle = 0
+
+    def reset(self):
+        """
+        Forget the previous frame, for a new connection
+        :return:
+        """
+        self._previous = None
+
+    def encode(self, frame):
+        """
+        Encode a frame
+        :param frame: A bytes-like object of 1-512 channels
+        :return: (header, payload) as bytes-like objects
+        """
+        frame = bytes(frame)
+        previous = self._previous
+        self._previous = frame
+        length = len(frame)
+
+        # A delta needs the previous frame. Only a frame of the same
+        # length is compared: anything else is rare.
+        changes = None
+        if previous is not None and len(previous) == length:
+            if previous == frame:
+                self.frames_delta += 1
+                return typed_header(FRAME_DELTA, 0), b""
+            changes = [channel for channel, (old, new) in enumerate(zip(previous, frame)) if old != new]
+        delta_size = DELTA_ENTRY.size * len(changes) if changes is not None else length + 1
+
+        # RLE can be no smaller than one run per MAX_RUN channels, so it
+        # is only worth looking at when the delta is bigger than that
+        rle_size = length + 1
+        if delta_size > RLE_RUN.size * ((length + MAX_RUN - 1) // MAX_RUN):
+            # Run starts, from which the RLE size is known before encoding
+            starts = [0]
+            starts.extend(channel for channel, (old, new) in enumerate(zip(frame, frame[1:]), 1) if old != new)
+            starts.append(length)
+            runs = sum((starts[i + 1] - starts[i] + MAX_RUN - 1) // MAX_RUN for i in range(len(starts) - 1))
+            rle_size = RLE_RUN.size * runs
+
+        if delta_size < length and delta_size <= rle_size:
+            payload = bytearray(delta_size)
+            for i, channel in enumerate(changes):
+                DELTA_ENTRY.pack_into(payload, i * DELTA_ENTRY.size, channel, frame[channel])
+            self.frames_delta += 1
+            return typed_header(FRAME_DELTA, delta_size), payload
+        if rle_size < length:
+            payload = bytearray(rle_size)
+            offset = 0
+            for i in range(len(starts) - 1):
+                value = frame[starts[i]]
+                remaining = starts[i + 1] - starts[i]
+                while remaining > 0:
+                    count = min(remaining, MAX_RUN)
+                    RLE_RUN.pack_into(payload, offset, count, value)
+                    offset += RLE_RUN.size
+                    remaining -= count
+            self.frames_rle += 1
+            return typed_header(FRAME_RLE, rle_size), payload
+        self.frames_full += 1
+        return typed_header(FRAME_FULL, length), frame
@@ -0,0 +1,101 @@
+# coding: utf-8
+#
+# AtHomeSocketServer
+# Copyright © 2016, 2019  Dave Hocker (email: AtHomeX10@gmail.com)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3 of the License.
+#
+# See the LICENSE file for more details.
+#
+
+#
+# Buffered, copy free reader for a connected socket
+#
+
+
+class FrameReader:
+    """
+    Reads fixed size blocks from a stream socket through a preallocated,
+    per-connection buffer.
+
+    The buffer is filled with socket.recv_into, reading ahead as much
+    as the socket has available. When a client sends frames back-to-back
+    a single recv_into usually picks up the length word and the payload
+    of one or more frames, so most blocks are returned without a system
+    call at all.
+
+    Blocks are returned as read-only memoryview slices of the buffer. A
+    block is only valid until the next call to receive(). Callers that
+    need to keep the data must copy it.
+    """
+
+    # Default read-ahead buffer size
+    DEFAULT_BUFFER_SIZE = 64 * 1024
+
+    def __init__(self, sock, max_block_size, buffer_size=DEFAULT_BUFFER_SIZE):
+        """
+        Constructor
+        :param sock: A connected stream socket
+        :param max_block_size: The largest block that will be requested
+        :param buffer_size: Size of the read-ahead buffer
+        """
+        self._sock = sock
+        self._buffer = bytearray(max(buffer_size, max_block_size))
+        self._view = memoryview(self._buffer)
+        self._readonly_view = self._view.toreadonly()
+        # Unconsumed data lives in _buffer[_start:_end]
+        self._start = 0
+        self._end = 0
+
+    def buffered(self):
+        """
+        Returns the number of bytes that have been received but not
+        yet consumed.
+        """
+        return self._end - self._start
+
+    def peek(self, block_size):
+        """
+        Look at buffered data without consuming it. Never reads from
+        the socket.
+        :param block_size: Number of bytes to look at
+        :return: A read-only memoryview of at most block_size bytes
+        """
+        return self._readonly_view[self._start:min(self._start + block_size, self._end)]
+
+    def receive(self, block_size):
+        """
+        Read exactly block_size bytes from the socket
+        :param block_size: Number of bytes to read
+        :return: A read-only memoryview of the block or None if the
+        connection was closed.
+        """
+        if block_size > len(self._buffer):
+            raise ValueError("Block size {0} exceeds the receive buffer size".format(block_size))
+
+        available = self._end - self._start
+        if available == 0:
+            # Everything has been consumed, start over at the front
+            self._start = self._end = 0
+        elif available < block_size:
+            if self._start + block_size > len(self._buffer):
+                # Not enough room left after the unconsumed data.
+                # Move it to the front of the buffer (memoryview slice
+                # assignment handles the overlap).
+                self._view[0:available] = self._view[self._start:self._end]
+                self._start = 0
+                self._end = available
+
+        if available < block_size:
+            while self._end - self._start < block_size:
+                count = self._sock.recv_into(self._view[self._end:])
+                if count == 0:
+                    # Broken socket
+                    return None
+                self._end += count
+
+        start = self._start
+        self._start += block_size
+        return self._readonly_view[start:self._start]
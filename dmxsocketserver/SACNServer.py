@@ -0,0 +1,334 @@
+# coding: utf-8
+#
+# AtHomeSocketServer
+# Copyright © 2016, 2019  Dave Hocker (email: AtHomeX10@gmail.com)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3 of the License.
+#
+# See the LICENSE file for more details.
+#
+
+#
+# sACN (ANSI E1.31) multicast receiver with source priority merging
+#
+
+import socket
+import time
+from struct import pack, unpack_from
+from .DatagramServer import DatagramServer
+
+# E1.31 constants
+SACN_PORT = 5568
+ACN_PACKET_IDENTIFIER = b"ASC-E1.17\x00\x00\x00"
+VECTOR_ROOT_E131_DATA = 0x00000004
+VECTOR_E131_DATA_PACKET = 0x00000002
+VECTOR_DMP_SET_PROPERTY = 0x02
+DMP_ADDRESS_DATA_TYPE = 0xA1
+# Offset of the first DMX slot (after the start code)
+DMX_DATA_OFFSET = 126
+# Framing layer options
+OPTION_PREVIEW_DATA = 0x80
+OPTION_STREAM_TERMINATED = 0x40
+# A source that has not been heard from for this long is dropped
+SOURCE_TIMEOUT = 2.5
+DMX_UNIVERSE_SIZE = 512
+
+# Merge modes
+MERGE_HTP = "htp"
+MERGE_LTP = "ltp"
+
+# Masks for the byte-wise maximum of 512 byte buffers held as integers
+_HIGH_BITS = int.from_bytes(b"\x80" * DMX_UNIVERSE_SIZE, "big")
+_LOW_BITS = int.from_bytes(b"\x7f" * DMX_UNIVERSE_SIZE, "big")
+
+
+def multicast_group(universe):
+    """
+    Returns the multicast group address for an sACN universe
+    :param universe: sACN universe, 1-63999
+    :return: Dotted address string
+    """
+    return "239.255.{0}.{1}".format(universe >> 8, universe & 0xFF)
+
+
+def htp_max(a, b):
+    """
+    Byte-wise maximum (highest takes precedence) of two 512 byte buffers
+    held as big integers. All 512 bytes are compared at once with SWAR
+    arithmetic; there is no loop over channels.
+    :param a: int.from_bytes(buffer_a, "big")
+    :param b: int.from_bytes(buffer_b, "big")
+    :return: The merged buffer as an integer
+    """
+    # Per byte, (a | 0x80) - (b & 0x7f) never borrows from the next byte
+    # and its top bit is set when the low 7 bits of a >= those of b
+    low_ge = (a | _HIGH_BITS) - (b & _LOW_BITS)
+    # Top bit of each byte is set where a >= b
+    ge = ((a & ~b) | (~(a ^ b) & low_ge)) & _HIGH_BITS
+    # Spread each top bit into a full byte mask
+    mask = (ge >> 7) * 0xFF
+    return (a & mask) | (b & ~mask)
+
+
+class SACNSource:
+    """
+    The most recent data from one source (CID) on one universe
+    """
+
+    def __init__(self, cid):
+        self.cid = cid
+        self.priority = 0
+        self.sequence = None
+        self.value = 0
+        self.length = 0
+        self.last_seen = 0.0
+
+
+class SACNUniverse:
+    """
+    Merges the sources transmitting on one universe. Only sources at the
+    highest priority take part. Between them, channels are merged HTP
+    (highest value wins) or LTP (the source that sent last wins).
+    """
+
+    def __init__(self, merge_mode):
+        self.merge_mode = merge_mode
+        # cid: SACNSource
+        self.sources = {}
+        # Source data changed since the last merge
+        self.dirty = False
+        # The single packet that may be passed through without merging
+        self.passthrough = None
+        self.last_source = None
+
+    def expire(self, now):
+        """
+        Drop sources that have timed out
+        :param now: time.monotonic()
+        :return: True if any source was dropped
+        """
+        expired = [cid for cid, source in self.sources.items() if now - source.last_seen > SOURCE_TIMEOUT]
+        for cid in expired:
+            del self.sources[cid]
+        if expired:
+            self.dirty = True
+        return len(expired) > 0
+
+    def merge(self):
+        """
+        Merge the winning sources
+        :return: Returns the merged frame as bytes, or None if there are
+        no sources
+        """
+        if not self.sources:
+            return None
+        top = max(source.priority for source in self.sources.values())
+        winners = [source for source in self.sources.values() if source.priority == top]
+
+        if len(winners) == 1 or self.merge_mode == MERGE_LTP:
+            if self.merge_mode == MERGE_LTP and self.last_source in winners:
+                source = self.last_source
+            else:
+                source = max(winners, key=lambda s: s.last_seen)
+            value = source.value
+            length = source.length
+        else:
+            value = winners[0].value
+            length = winners[0].length
+            for source in winners[1:]:
+                value = htp_max(value, source.value)
+                length = max(length, source.length)
+
+        return value.to_bytes(DMX_UNIVERSE_SIZE, "big")[0:length]
+
+
+class SACNServer(DatagramServer):
+    """
+    Receives E1.31 data packets, joins the multicast group of each
+    configured universe and merges multiple sources per universe by
+    priority, then HTP or LTP.
+
+    Packets are parsed in place with struct.unpack_from on the receive
+    buffer. Each source's channel data is kept as one big integer, so a
+    merge of any number of sources works on whole 512 byte buffers.
+    Merging is done once per universe per drained batch, however many
+    packets for it were in the batch. When a universe has a single
+    source, its data goes straight to the frame store without a merge.
+
+    The sACN universe number is used as the emulator universe number.
+    Merged frames are passed to the handler's
+    execute_universe(universe, dmx_data) method.
+    """
+
+    def __init__(self, server_address, handler, universes, merge_mode=MERGE_HTP, interface="0.0.0.0"):
+        """
+        Create the server, bind its socket and join the multicast groups
+        :param server_address: (host, port) tuple, normally port 5568
+        :param handler: An object with an execute_universe(universe, dmx_data) method
+        :param universes: List of sACN universes to join
+        :param merge_mode: MERGE_HTP or MERGE_LTP
+        :param interface: Address of the interface to join the groups on
+        """
+        if merge_mode not in (MERGE_HTP, MERGE_LTP):
+            raise ValueError("Unrecognized sACN merge mode: {0}".format(merge_mode))
+        super(SACNServer, self).__init__(server_address)
+        self._handler = handler
+        self._merge_mode = merge_mode
+        self.universes = list(universes)
+
+        try:
+            for universe in self.universes:
+                membership = socket.inet_aton(multicast_group(universe)) + socket.inet_aton(interface)
+                self.socket.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP, membership)
+        except Exception:
+            self.socket.close()
+            raise
+
+        # sACN universe: SACNUniverse
+        self._universes = {}
+        self._next_expire = 0.0
+
+        # Statistics
+        self.packets_received = 0
+        self.packets_rejected = 0
+
+    def process_packet(self, packet):
+        """
+        Parse one datagram and update its source
+        :param packet: memoryview of the datagram
+        :return:
+        """
+        parsed = self.parse_e131(packet)
+        if parsed is None:
+            self.packets_rejected += 1
+            return
+        cid, priority, sequence, options, universe, dmx_data = parsed
+        self.packets_received += 1
+
+        if options & OPTION_PREVIEW_DATA:
+            # Preview data is not meant for live output
+            return
+
+        state = self._universes.get(universe)
+        if state is None:
+            state = SACNUniverse(self._merge_mode)
+            self._universes[universe] = state
+
+        if options & OPTION_STREAM_TERMINATED:
+            if cid in state.sources:
+                del state.sources[cid]
+                state.dirty = True
+            return
+
+        source = state.sources.get(cid)
+        if source is None:
+            source = SACNSource(cid)
+            state.sources[cid] = source
+        elif source.sequence is not None:
+            # E1.31 6.7.2: discard packets that are up to 20 behind
+            diff = (sequence - source.sequence) & 0xFF
+            if diff == 0 or diff > 0xFF - 20:
+                return
+
+        source.sequence = sequence
+        source.priority = priority
+        source.last_seen = time.monotonic()
+        # Pad to a full universe so every source lines up byte for byte
+        source.value = int.from_bytes(dmx_data, "big") << (8 * (DMX_UNIVERSE_SIZE - len(dmx_data)))
+        source.length = len(dmx_data)
+        state.last_source = source
+        state.passthrough = dmx_data if len(state.sources) == 1 else None
+        state.dirty = True
+
+    def end_batch(self):
+        """
+        Merge each universe that changed during the batch, once. An
+        exception from the handler for one universe does not stop the
+        others from being passed on.
+        :return:
+        """
+        for universe, state in self._universes.items():
+            if not state.dirty:
+                continue
+            state.dirty = False
+            if state.passthrough is not None and len(state.sources) == 1:
+                frame = state.passthrough
+            else:
+                frame = state.merge()
+            state.passthrough = None
+            if frame:
+                try:
+                    self._handler.execute_universe(universe, frame)
+                except Exception as ex:
+                    print("Exception occurred while handling sACN universe {0}".format(universe))
+                    print(str(ex))
+
+    def idle(self):
+        """
+        Drop sources that have stopped transmitting
+        :return:
+        """
+        now = time.monotonic()
+        if now < self._next_expire:
+            return
+        self._next_expire = now + 1.0
+        expired = False
+        for state in self._universes.values():
+            expired = state.expire(now) or expired
+        if expired:
+            self.end_batch()
+
+    @staticmethod
+    def parse_e131(packet):
+        """
+        Parse an E1.31 data packet without copying its data
+        :param packet: bytes-like object holding the datagram
+        :return: Returns a tuple of (cid, priority, sequence, options,
+        universe, DMX data view) or None if the packet is not a valid
+        E1.31 data packet with start code 0
+        """
+        if len(packet) < DMX_DATA_OFFSET or packet[4:16] != ACN_PACKET_IDENTIFIER:
+            return None
+        # Root layer
+        if unpack_from("!L", packet, 18)[0] != VECTOR_ROOT_E131_DATA:
+            return None
+        cid = bytes(packet[22:38])
+        # Framing layer
+        if unpack_from("!L", packet, 40)[0] != VECTOR_E131_DATA_PACKET:
+            return None
+        priority, sequence, options, universe = unpack_from("!BxxBBH", packet, 108)
+        # DMP layer
+        vector, address_type, first_address, increment, count, start_code = unpack_from("!BBHHHB", packet, 117)
+        if vector != VECTOR_DMP_SET_PROPERTY or address_type != DMP_ADDRESS_DATA_TYPE:
+            return None
+        if start_code != 0:
+            # Alternate start codes are not DMX levels
+            return None
+        length = count - 1
+        if length < 1 or length > DMX_UNIVERSE_SIZE or DMX_DATA_OFFSET + length > len(packet):
+            return None
+        return cid, priority, sequence, options, universe, memoryview(packet)[DMX_DATA_OFFSET:DMX_DATA_OFFSET + length]
+
+
+def build_e131(cid, universe, dmx_data, priority=100, sequence=0, options=0, source_name="DMX Emulator"):
+    """
+    Build an E1.31 data packet. Used by test tools to drive the receiver.
+    :param cid: 16 byte component identifier
+    :param universe: sACN universe
+    :param dmx_data: 1-512 channel values
+    :param priority: 0-200
+    :param sequence: 0-255
+    :param options: Framing layer options
+    :param source_name: Up to 63 characters
+    :return: The packet as bytes
+    """
+    length = len(dmx_data)
+    dmp = pack("!HBBHHHB", 0x7000 | (11 + length), VECTOR_DMP_SET_PROPERTY, DMP_ADDRESS_DATA_TYPE,
+               0, 1, length + 1, 0) + bytes(dmx_data)
+    framing = pack("!HL64sBHBBH", 0x7000 | (77 + len(dmp)), VECTOR_E131_DATA_PACKET,
+                   source_name.encode("utf-8")[0:63], priority, 0, sequence, options, universe) + dmp
+    root = pack("!HH12sHL16s", 0x0010, 0, ACN_PACKET_IDENTIFIER, 0x7000 | (22 + len(framing)),
+                VECTOR_ROOT_E131_DATA, cid) + framing
+    return root
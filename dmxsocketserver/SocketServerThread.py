@@ -1,51 +1,96 @@
-# coding: utf-8
-#
-# AtHomeSocketServer
-# Copyright © 2016, 2018  Dave Hocker (email: AtHomeX10@gmail.com)
-#
-# This program is free software: you can redistribute it and/or modify
-# it under the terms of the GNU General Public License as published by
-# the Free Software Foundation, version 3 of the License.
-#
-# See the LICENSE file for more details.
-#
-
-#
-# Socket server running on its own thread
-#
-
-import threading
-from .ThreadedTCPServer import ThreadedTCPServer
-from .TCPRequestHandler import TCPRequestHandler
-
-# This class should be used as a singleton
-class SocketServerThread:
-    # Constructor of an instance to serve a given host:port
-    def __init__(self, host, port, handler, connection_time_out=-1, frame_size=None):
-        self.host = host
-        self.port = port
-        self.server_thread = threading.Thread(target=self.RunServer)
-        ThreadedTCPServer.allow_reuse_address = True
-        # Inject the command handler class into the request handler
-        TCPRequestHandler.set_command_handler_class(handler, connection_time_out=connection_time_out)
-        # Inject LED data frame size
-        if frame_size:
-            TCPRequestHandler.set_max_frame_size(frame_size)
-
-        self.server = ThreadedTCPServer((host, port), TCPRequestHandler)
-
-    # Start the TCPServer on its own thread
-    def Start(self):
-        self.server_thread.start()
-
-    # Stop the TCPServer thread
-    def Stop(self):
-        print("Shutting down TCPServer thread")
-        self.server.shutdown()
-        self.server_thread.join()
-        print("TCPServer thread down")
-
-    # Run TCPServer on a new thread
-    def RunServer(self):
-        print("Now serving sockets at {0}:{1}".format(self.host, self.port))
-        self.server.serve_forever()
+# coding: utf-8
+#
+# AtHomeSocketServer
+# Copyright © 2016, 2018  Dave Hocker (email: AtHomeX10@gmail.com)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3 of the License.
+#
+# See the LICENSE file for more details.
+#
+
+#
+# Socket server running on its own thread
+#
+
+import threading
+from .ThreadedTCPServer import ThreadedTCPServer
+from .AsyncTCPServer import AsyncTCPServer
+from .TCPRequestHandler import TCPRequestHandler
+
+# Server engines
+ENGINE_THREADED = "threaded"
+ENGINE_ASYNCIO = "asyncio"
+
+
+# This class should be used as a singleton
+class SocketServerThread:
+    # Constructor of an instance to serve a given host:port
+    # port may be a single port number or a list of port numbers, in
+    # which case there is one listener per port. An empty list starts no
+    # TCP listeners, for when only servers added with AddServer() are wanted.
+    # engine selects a thread per connection (threaded) or a single
+    # event loop for all connections (asyncio).
+    def __init__(self, host, port, handler, connection_time_out=-1, frame_size=None, engine=ENGINE_THREADED):
+        if engine not in (ENGINE_THREADED, ENGINE_ASYNCIO):
+            raise ValueError("Unrecognized server engine: {0}".format(engine))
+        self.host = host
+        if isinstance(port, int):
+            self.ports = [port]
+        else:
+            self.ports = list(port)
+        self.port = self.ports[0] if self.ports else None
+        self.engine = engine
+        ThreadedTCPServer.allow_reuse_address = True
+        # Inject the command handler class into the request handler
+        TCPRequestHandler.set_command_handler_class(handler, connection_time_out=connection_time_out)
+        # Inject LED data frame size
+        if frame_size:
+            TCPRequestHandler.set_max_frame_size(frame_size)
+
+        if not self.ports:
+            self.servers = []
+        elif engine == ENGINE_ASYNCIO:
+            # One event loop serves every port
+            self.servers = [AsyncTCPServer([(host, p) for p in self.ports])]
+        else:
+            # One server (and accept thread) per port
+            self.servers = [ThreadedTCPServer((host, p), TCPRequestHandler) for p in self.ports]
+        self.server = self.servers[0] if self.servers else None
+        self.server_threads = [threading.Thread(target=self.RunServer, args=(server,)) for server in self.servers]
+
+    # Add another server (e.g. a UDP receiver) to be started and stopped
+    # with the TCP listeners. It must implement serve_forever(), shutdown()
+    # and server_close(). Call before Start().
+    def AddServer(self, server, description):
+        self.servers.append(server)
+        self.server_threads.append(threading.Thread(target=self.RunServer, args=(server, description)))
+
+    # Start the TCPServer on its own thread
+    def Start(self):
+        for server_thread in self.server_threads:
+            server_thread.start()
+
+    # Stop the TCPServer thread
+    def Stop(self):
+        print("Shutting down TCPServer thread")
+        for server in self.servers:
+            server.shutdown()
+        for server_thread in self.server_threads:
+            server_thread.join()
+        for server in self.servers:
+            server.server_close()
+        print("TCPServer thread down")
+
+    # Run TCPServer on a new thread
+    def RunServer(self, server, description=None):
+        if description:
+            print("Now serving {0} at {1}:{2}".format(description, server.server_address[0], server.server_address[1]))
+        else:
+            if self.engine == ENGINE_ASYNCIO:
+                ports = self.ports
+            else:
+                ports = [server.server_address[1]]
+            print("Now serving sockets at {0}:{1} ({2})".format(self.host, ",".join([str(p) for p in ports]), self.engine))
+        server.serve_forever()
@@ -1,140 +1,234 @@
-# coding: utf-8
-#
-# AtHomeSocketServer
-# Copyright © 2016, 2019  Dave Hocker (email: AtHomeX10@gmail.com)
-#
-# This program is free software: you can redistribute it and/or modify
-# it under the terms of the GNU General Public License as published by
-# the Free Software Foundation, version 3 of the License.
-#
-# See the LICENSE file for more details.
-#
-
-
-import sys
-try:
-    import socketserver as socketserver
-except ImportError:
-    import SocketServer as socketserver
-from struct import unpack
-
-
-class TCPRequestHandler(socketserver.BaseRequestHandler):
-    """
-    The RequestHandler class for our server.
-
-    It is instantiated once per connection to the server, and must
-    override the handle() method to implement communication to the
-    client.
-    """
-
-    call_sequence = 1
-
-    # The command_handler_class is injected by the user of this class
-    # See dmx_client.py for an example implementation.
-    command_handler_class = None
-
-    # Default size of a complete LED data frame for 50 pixels
-    max_frame_size = 512
-
-    @classmethod
-    def set_max_frame_size(cls, frame_size):
-        """
-        Complete LED data frame size injection
-        :param frame_size:
-        :return:
-        """
-        cls.max_frame_size = frame_size
-
-    @classmethod
-    def set_command_handler_class(cls, command_handler_to_use, connection_time_out=-1):
-        """
-        Command handler injection
-        :param command_handler_to_use: A class that implements a
-        Response class and an execute_command method.
-        :param connection_time_out:
-        :return:
-        """
-        cls.command_handler_class = command_handler_to_use
-        cls.connection_time_out = connection_time_out
-
-    """
-    This handler uses raw data from the SocketServer.TCPServer class.
-    """
-
-    def handle(self):
-        print("Connection from {0}".format(self.client_address[0]))
-
-        # Do until close is received
-        connection_open = True
-        while connection_open:
-            # self.request is the TCP socket connected to the client
-            dmx_data = self.read_dmx_data()
-
-            if dmx_data and len(dmx_data) > 0:
-                try:
-                    # The command handler generates the response
-                    if TCPRequestHandler.command_handler_class:
-                        # Create an instance of the command handler
-                        handler = TCPRequestHandler.command_handler_class()
-                        # Pass the command string to the command handler
-                        response = handler.execute_command(self.request.getsockname()[1], dmx_data)
-                except Exception as ex:
-                    print("Exception occurred while handling LED data")
-                    print(str(ex))
-                    print(dmx_data)
-                finally:
-                    pass
-
-                TCPRequestHandler.call_sequence += 1
-            else:
-                # We consider this an error, so we force close the socket
-                connection_open = False
-        print("Connection closed")
-
-    def read_dmx_data(self):
-        """
-        Read a stream of LED data from a socket
-        :return: Returns a list of bytes or None
-        """
-        # This is essentially APA102 format.
-        # client_frame_size followed by
-        # 4 bytes all zeroes header + 4 bytes per pixel * pixels + 4 bytes all ones trailer
-        client_frame_size = self.receive(4)
-        if not client_frame_size:
-            return None
-        # Note that the result of unpack is a tuple with one value
-        client_frame_size = unpack('!i', client_frame_size)[0]
-        if client_frame_size > TCPRequestHandler.max_frame_size:
-            print("Client frame size is too large")
-            return None
-
-        dmx_data = self.receive(client_frame_size)
-        if not dmx_data:
-            print("Failed to receive complete frame")
-            return None
-
-        return dmx_data
-
-    def receive(self, block_size):
-        """
-        Read a given number of bytes from stream
-        :param block_size:
-        :return: Received block as a list of bytes
-        """
-        count = block_size
-        dmx_data = b''
-        # Read exactly "count" bytes
-        while count:
-            seg = self.request.recv(count)
-            if seg:
-                dmx_data += seg
-                count -= len(seg)
-            else:
-                # Broken socket
-                return None
-        # It is likely that some sort of data conversion will be required.
-        # For now we'll coerce the frame into a list of bytes (which
-        # should be the format it is already in)
-        dmx_data = bytes(dmx_data)
-        return dmx_data
+# coding: utf-8
+#
+# AtHomeSocketServer
+# Copyright © 2016, 2019  Dave Hocker (email: AtHomeX10@gmail.com)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3 of the License.
+#
+# See the LICENSE file for more details.
+#
+
+
+import sys
+try:
+    import socketserver as socketserver
+except ImportError:
+    import SocketServer as socketserver
+from struct import unpack, unpack_from
+from .FrameReader import FrameReader
+from . import FrameCodec
+
+
+class TCPRequestHandler(socketserver.BaseRequestHandler):
+    """
+    The RequestHandler class for our server.
+
+    It is instantiated once per connection to the server, and must
+    override the handle() method to implement communication to the
+    client.
+    """
+
+    call_sequence = 1
+
+    # The command_handler_class is injected by the user of this class
+    # See dmx_client.py for an example implementation.
+    command_handler_class = None
+
+    # Default size of a complete LED data frame for 50 pixels
+    max_frame_size = 512
+
+    # Rejected frames, for all connections
+    frames_rejected_oversize = 0
+    frames_rejected_invalid = 0
+    frames_rejected_short = 0
+
+    @classmethod
+    def set_max_frame_size(cls, frame_size):
+        """
+        Complete LED data frame size injection
+        :param frame_size:
+        :return:
+        """
+        cls.max_frame_size = frame_size
+
+    @classmethod
+    def set_command_handler_class(cls, command_handler_to_use, connection_time_out=-1):
+        """
+        Command handler injection
+        :param command_handler_to_use: A class that implements a
+        Response class and an execute_command(port, data) method. One
+        instance is created per connection. The class may optionally
+        implement execute_frames(port, frames), which is called with a
+        list of frames when several arrive back-to-back, and close(),
+        which is called when the connection ends.
+        :param connection_time_out:
+        :return:
+        """
+        cls.command_handler_class = command_handler_to_use
+        cls.connection_time_out = connection_time_out
+
+    """
+    This handler uses raw data from the SocketServer.TCPServer class.
+    """
+
+    def setup(self):
+        # Per-connection receive buffer, large enough for a length word
+        # plus the largest allowed frame of any type
+        self._reader = FrameReader(self.request,
+                                   FrameCodec.max_payload_size(TCPRequestHandler.max_frame_size) + 4)
+        # Typed frames are applied to this connection's universe buffer
+        self._decoder = FrameCodec.FrameDecoder(TCPRequestHandler.max_frame_size)
+
+        # The command handler is bound once for the life of the connection
+        self._port = self.request.getsockname()[1]
+        self._handler = None
+        self._execute_frames = None
+        # Set when a bad frame ends a batch. The frames before it are
+        # handed on, then the connection is closed.
+        self._close_after_batch = False
+        if TCPRequestHandler.command_handler_class:
+            self._handler = TCPRequestHandler.command_handler_class()
+            # Optional batch entry point
+            self._execute_frames = getattr(self._handler, "execute_frames", None)
+
+    def handle(self):
+        print("Connection from {0}".format(self.client_address[0]))
+
+        # Do until close is received
+        connection_open = True
+        while connection_open:
+            # self.request is the TCP socket connected to the client
+            frames = self.read_dmx_frames()
+
+            if frames:
+                try:
+                    # The command handler generates the response
+                    if self._handler:
+                        if self._execute_frames and len(frames) > 1:
+                            self._execute_frames(self._port, frames)
+                        else:
+                            for dmx_data in frames:
+                                self._handler.execute_command(self._port, dmx_data)
+                except Exception as ex:
+                    print("Exception occurred while handling LED data")
+                    print(str(ex))
+                    # The frames are views of reused receive buffers
+                    print("{0} frame(s) of {1} bytes".format(len(frames), ", ".join(str(len(f)) for f in frames)))
+                finally:
+                    pass
+
+                TCPRequestHandler.call_sequence += len(frames)
+                if self._close_after_batch:
+                    connection_open = False
+            else:
+                # We consider this an error, so we force close the socket
+                connection_open = False
+        print("Connection closed")
+
+    def finish(self):
+        # Let the command handler clean up after the connection
+        close = getattr(self._handler, "close", None)
+        if close:
+            close()
+
+    def read_dmx_frames(self):
+        """
+        Read the next frame from the socket, plus any further frames
+        that are already complete in the receive buffer. If one of the
+        further frames is bad, the batch ends before it and
+        _close_after_batch is set.
+        :return: Returns a list of frames or None
+        """
+        dmx_data = self.read_dmx_data()
+        if not dmx_data:
+            return None
+        frames = [dmx_data]
+
+        # Only frames that are completely buffered are taken, so no
+        # further recv happens and the earlier frames stay valid.
+        while self._reader.buffered() >= 4:
+            client_frame_size = unpack_from('!i', self._reader.peek(4))[0]
+            if client_frame_size < 0:
+                frame_type, client_frame_size = FrameCodec.split_header(client_frame_size)
+                if frame_type == FrameCodec.FRAME_HELLO or \
+                        not self._decoder.accepts(frame_type, client_frame_size):
+                    break
+            elif client_frame_size < 1 or client_frame_size > TCPRequestHandler.max_frame_size:
+                # Let the next read_dmx_data() report the error
+                break
+            if self._reader.buffered() < client_frame_size + 4:
+                break
+            if self._decoder.version >= FrameCodec.PROTOCOL_TYPED:
+                # Decoded frames share the universe buffer
+                frames[-1] = bytes(frames[-1])
+            dmx_data = self.read_dmx_data()
+            if dmx_data is None:
+                # Already reported. Closed once the frames before it
+                # have been handed on, as for a bad first frame.
+                self._close_after_batch = True
+                break
+            frames.append(dmx_data)
+
+        return frames
+
+    def read_dmx_data(self):
+        """
+        Read a stream of LED data from a socket
+        :return: Returns a read-only memoryview of the frame or None
+        """
+        # This is essentially APA102 format.
+        # client_frame_size followed by
+        # 4 bytes all zeroes header + 4 bytes per pixel * pixels + 4 bytes all ones trailer
+        while True:
+            client_frame_size = self.receive(4)
+            if not client_frame_size:
+                return None
+            # Note that the result of unpack is a tuple with one value
+            client_frame_size = unpack('!i', client_frame_size)[0]
+            if client_frame_size < 0:
+                # A typed frame (see FrameCodec)
+                frame_type, client_frame_size = FrameCodec.split_header(client_frame_size)
+                if not self._decoder.accepts(frame_type, client_frame_size):
+                    print("Client frame type or size is invalid")
+                    TCPRequestHandler.frames_rejected_invalid += 1
+                    return None
+            else:
+                frame_type = FrameCodec.FRAME_RAW
+                if client_frame_size > TCPRequestHandler.max_frame_size:
+                    print("Client frame size is too large")
+                    TCPRequestHandler.frames_rejected_oversize += 1
+                    return None
+                if client_frame_size < 1:
+                    print("Client frame size is invalid")
+                    TCPRequestHandler.frames_rejected_invalid += 1
+                    return None
+
+            dmx_data = self.receive(client_frame_size)
+            if dmx_data is None:
+                print("Failed to receive complete frame")
+                TCPRequestHandler.frames_rejected_short += 1
+                return None
+
+            if frame_type == FrameCodec.FRAME_HELLO:
+                self.request.sendall(self._decoder.hello(dmx_data))
+                continue
+            if self._decoder.version == FrameCodec.PROTOCOL_LEGACY:
+                return dmx_data
+
+            dmx_data = self._decoder.decode(frame_type, dmx_data)
+            if dmx_data is None:
+                print("Client frame data is invalid")
+                TCPRequestHandler.frames_rejected_invalid += 1
+            return dmx_data
+
+    def receive(self, block_size):
+        """
+        Read a given number of bytes from stream
+        :param block_size:
+        :return: Received block as a read-only memoryview of the
+        connection's receive buffer. It is only valid until the next
+        call to receive(). Returns None if the socket is broken.
+        """
+        return self._reader.receive(block_size)
@@ -23,4 +23,8 @@ TCP server using threads.
 
 
 class ThreadedTCPServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
-    pass
+    # server_close() must not wait for connection threads. They only end
+    # when their client disconnects, so they must not keep the process
+    # alive at exit either.
+    block_on_close = False
+    daemon_threads = True
@@ -0,0 +1,216 @@
+#
+# DMX Emulator typed frame (protocol version 2) tests
+# Copyright © 2019  Dave Hocker (email: AtHomeX10@gmail.com)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the LICENSE file for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program (the LICENSE file).  If not, see <http://www.gnu.org/licenses/>.
+#
+
+import os
+import socket
+import socketserver
+import sys
+import threading
+import unittest
+from struct import pack
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from dmxsocketserver import FrameCodec
+from dmxsocketserver.FrameCodec import FrameDecoder, FrameEncoder, FRAME_FULL, FRAME_DELTA, FRAME_RLE, \
+    FRAME_HELLO, FRAME_RAW, DELTA_ENTRY, RLE_RUN, HELLO, PROTOCOL_LEGACY, PROTOCOL_TYPED
+from dmxsocketserver.TCPRequestHandler import TCPRequestHandler
+
+
+def typed_frame(frame_type, payload):
+    return FrameCodec.typed_header(frame_type, len(payload)) + bytes(payload)
+
+
+def delta(*entries):
+    return b"".join(DELTA_ENTRY.pack(channel, value) for channel, value in entries)
+
+
+def rle(*runs):
+    return b"".join(RLE_RUN.pack(count, value) for count, value in runs)
+
+
+class TestFrameDecoder(unittest.TestCase):
+    def setUp(self):
+        self.decoder = FrameDecoder(512)
+        self.decoder.hello(HELLO.pack(PROTOCOL_TYPED))
+
+    def test_hello_agrees_on_lowest_version(self):
+        decoder = FrameDecoder(512)
+        reply = decoder.hello(HELLO.pack(99))
+        self.assertEqual(decoder.version, PROTOCOL_TYPED)
+        self.assertEqual(reply, typed_frame(FRAME_HELLO, HELLO.pack(PROTOCOL_TYPED)))
+        decoder = FrameDecoder(512)
+        decoder.hello(HELLO.pack(PROTOCOL_LEGACY))
+        self.assertEqual(decoder.version, PROTOCOL_LEGACY)
+
+    def test_typed_frames_need_hello(self):
+        decoder = FrameDecoder(512)
+        self.assertTrue(decoder.accepts(FRAME_HELLO, HELLO.size))
+        self.assertFalse(decoder.accepts(FRAME_FULL, 3))
+        self.assertFalse(decoder.accepts(FRAME_DELTA, 3))
+        self.assertFalse(decoder.accepts(FRAME_RLE, 2))
+
+    def test_accepts_rejects_bad_sizes(self):
+        self.assertFalse(self.decoder.accepts(FRAME_HELLO, HELLO.size))
+        self.assertFalse(self.decoder.accepts(FRAME_FULL, 0))
+        self.assertFalse(self.decoder.accepts(FRAME_FULL, 513))
+        self.assertFalse(self.decoder.accepts(FRAME_DELTA, 4))
+        self.assertFalse(self.decoder.accepts(FRAME_DELTA, DELTA_ENTRY.size * 513))
+        self.assertFalse(self.decoder.accepts(FRAME_RLE, 0))
+        self.assertFalse(self.decoder.accepts(FRAME_RLE, 3))
+        self.assertFalse(self.decoder.accepts(0x7F, 2))
+
+    def test_full_delta_and_rle(self):
+        self.assertEqual(bytes(self.decoder.decode(FRAME_FULL, b"\x01\x02\x03")), b"\x01\x02\x03")
+        self.assertEqual(bytes(self.decoder.decode(FRAME_DELTA, delta((1, 9)))), b"\x01\x09\x03")
+        # Past the end extends the frame with zeroes
+        self.assertEqual(bytes(self.decoder.decode(FRAME_DELTA, delta((5, 7)))), b"\x01\x09\x03\x00\x00\x07")
+        # An empty delta repeats the frame
+        self.assertEqual(bytes(self.decoder.decode(FRAME_DELTA, b"")), b"\x01\x09\x03\x00\x00\x07")
+        self.assertEqual(bytes(self.decoder.decode(FRAME_RLE, rle((2, 4), (1, 5)))), b"\x04\x04\x05")
+
+    def assert_rejected(self, frame_type, payload):
+        before = bytes(self.decoder.decode(FRAME_DELTA, b""))
+        self.assertIsNone(self.decoder.decode(frame_type, payload))
+        # The universe buffer is left as it was
+        self.assertEqual(bytes(self.decoder.decode(FRAME_DELTA, b"")), before)
+
+    def test_invalid_delta_leaves_buffer(self):
+        self.decoder.decode(FRAME_FULL, b"\x01\x02\x03")
+        self.assert_rejected(FRAME_DELTA, delta((0, 9), (600, 1)))
+        self.assert_rejected(FRAME_DELTA, delta((1, 9), (512, 1)))
+
+    def test_invalid_rle_leaves_buffer(self):
+        self.decoder.decode(FRAME_FULL, b"\x01\x02\x03")
+        self.assert_rejected(FRAME_RLE, rle((2, 9), (0, 1)))
+        self.assert_rejected(FRAME_RLE, rle((255, 9), (255, 9), (3, 9)))
+        self.assert_rejected(FRAME_RLE, b"")
+
+    def test_empty_delta_without_previous_frame(self):
+        self.assertIsNone(self.decoder.decode(FRAME_DELTA, b""))
+
+    def test_unknown_type(self):
+        self.decoder.decode(FRAME_FULL, b"\x01")
+        self.assert_rejected(0x7F, b"\x01")
+
+    def test_full_frame_sizes(self):
+        self.assertIsNone(self.decoder.decode(FRAME_FULL, b""))
+        self.assertIsNone(self.decoder.decode(FRAME_RAW, bytes(513)))
+
+
+class TestFrameEncoder(unittest.TestCase):
+    def test_round_trip(self):
+        encoder = FrameEncoder()
+        decoder = FrameDecoder(512)
+        decoder.hello(HELLO.pack(PROTOCOL_TYPED))
+        frames = [bytes(512), bytes([1]) * 512, bytes(range(256)) * 2, bytes(range(256)) * 2,
+                  bytes([1, 2, 3]), bytes([1, 2, 4])]
+        for frame in frames:
+            header, payload = encoder.encode(frame)
+            frame_type, size = FrameCodec.split_header(FrameCodec.HEADER.unpack(header)[0] - (1 << 32))
+            self.assertEqual(size, len(payload))
+            self.assertTrue(decoder.accepts(frame_type, size))
+            self.assertEqual(bytes(decoder.decode(frame_type, payload)), frame)
+        self.assertEqual(encoder.frames_full + encoder.frames_delta + encoder.frames_rle, len(frames))
+        self.assertGreater(encoder.frames_delta, 0)
+        self.assertGreater(encoder.frames_rle, 0)
+
+
+class RecordingHandler:
+    """
+    Command handler that keeps a copy of every frame
+    """
+
+    frames = []
+
+    def execute_command(self, port, dmx_data):
+        RecordingHandler.frames.append(bytes(dmx_data))
+
+    def execute_frames(self, port, frames):
+        for dmx_data in frames:
+            RecordingHandler.frames.append(bytes(dmx_data))
+
+
+class RecordingServer(socketserver.TCPServer):
+    allow_reuse_address = True
+    errors = 0
+
+    def handle_error(self, request, client_address):
+        RecordingServer.errors += 1
+
+
+class TestTypedBatch(unittest.TestCase):
+    def setUp(self):
+        RecordingHandler.frames = []
+        RecordingServer.errors = 0
+        TCPRequestHandler.set_command_handler_class(RecordingHandler)
+        TCPRequestHandler.set_max_frame_size(512)
+        self.server = RecordingServer(("127.0.0.1", 0), TCPRequestHandler)
+
+    def tearDown(self):
+        self.server.server_close()
+        TCPRequestHandler.set_command_handler_class(None)
+
+    def send(self, data):
+        """
+        Send data in one write before the connection is handled, so
+        every frame is already buffered when the first is read, then
+        close the sending side
+        :return: What the server sent back before closing
+        """
+        client = socket.create_connection(self.server.server_address)
+        client.sendall(data)
+        client.shutdown(socket.SHUT_WR)
+        thread = threading.Thread(target=self.server.handle_request)
+        thread.start()
+        thread.join(10.0)
+        self.assertFalse(thread.is_alive())
+        received = b""
+        client.settimeout(5.0)
+        while True:
+            data = client.recv(4096)
+            if not data:
+                break
+            received += data
+        client.close()
+        return received
+
+    def test_bad_frame_ends_batch(self):
+        rejected = TCPRequestHandler.frames_rejected_invalid
+        reply = self.send(typed_frame(FRAME_HELLO, HELLO.pack(PROTOCOL_TYPED)) +
+                          typed_frame(FRAME_FULL, b"\x01\x02\x03") +
+                          typed_frame(FRAME_DELTA, delta((600, 1))) +
+                          typed_frame(FRAME_FULL, b"\x04"))
+        self.assertEqual(reply, typed_frame(FRAME_HELLO, HELLO.pack(PROTOCOL_TYPED)))
+        self.assertEqual(RecordingServer.errors, 0)
+        # The frame before the bad one is handed on, the one after it
+        # is not: the connection is closed
+        self.assertEqual(RecordingHandler.frames, [b"\x01\x02\x03"])
+        self.assertEqual(TCPRequestHandler.frames_rejected_invalid, rejected + 1)
+
+    def test_batch_of_typed_frames(self):
+        self.send(typed_frame(FRAME_HELLO, HELLO.pack(PROTOCOL_TYPED)) +
+                  typed_frame(FRAME_FULL, b"\x01\x02\x03") +
+                  typed_frame(FRAME_DELTA, delta((0, 7))) +
+                  typed_frame(FRAME_RLE, rle((2, 5))) +
+                  pack("!i", 2) + b"\x08\x09")
+        self.assertEqual(RecordingServer.errors, 0)
+        self.assertEqual(RecordingHandler.frames, [b"\x01\x02\x03", b"\x07\x02\x03", b"\x05\x05", b"\x08\x09"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,101 @@
+#
+# DMX Emulator frame store tests
+# Copyright © 2019  Dave Hocker (email: AtHomeX10@gmail.com)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the LICENSE file for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program (the LICENSE file).  If not, see <http://www.gnu.org/licenses/>.
+#
+
+#
+# Run from the repository root:
+#   python -m unittest discover tests
+#
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from dmx_frame_store import FrameStore
+
+
+class CloseAfterReadSlot:
+    """
+    A FrameSlot's consumer side whose writer puts a final frame and
+    closes the slot right after it has been collected, the narrowest
+    window between a collection's two reads of the slot
+    """
+
+    def __init__(self, slot, final_frame):
+        self.universe = slot.universe
+        self.source = slot.source
+        self.collected = 0
+        self.bytes_collected = 0
+        self._slot = slot
+        self._final_frame = final_frame
+
+    @property
+    def closed(self):
+        return self._slot.closed
+
+    def collect(self):
+        latest = self._slot.collect()
+        if self._final_frame is not None:
+            self._slot.put(self._final_frame)
+            self._slot.close()
+            self._final_frame = None
+        return latest
+
+
+class TestSlotCollection(unittest.TestCase):
+    def test_final_frame_of_closing_slot_is_collected(self):
+        store = FrameStore(handoff=FrameStore.HANDOFF_LOCK_FREE)
+        state = store.universe(0)
+        slot = state.open_slot()
+        # Only the wrapper is collected
+        state.remove_slot(slot)
+        slot.put(b"\x01\x02")
+        state.add_slot(CloseAfterReadSlot(slot, b"\x09\x09\x09"))
+
+        # The first frame is collected, then the writer puts its final
+        # frame and closes
+        self.assertEqual(state.snapshot()[1], b"\x01\x02")
+        # The final frame is collected on the next read
+        self.assertEqual(state.snapshot()[1], b"\x09\x09\x09")
+        self.assertEqual(state.frames_received, 2)
+        self.assertEqual(state.bytes_received, 5)
+
+    def test_closed_slot_is_removed_after_last_collection(self):
+        store = FrameStore(handoff=FrameStore.HANDOFF_LOCK_FREE)
+        state = store.universe(0)
+        slot = state.open_slot()
+        slot.put(b"\x05")
+        slot.close()
+        self.assertEqual(state.snapshot()[1], b"\x05")
+        self.assertEqual(state.frames_received, 1)
+        self.assertEqual(len(state._slots), 0)
+
+
+class TestSequences(unittest.TestCase):
+    def test_reserved_sequences_follow_on(self):
+        store = FrameStore(handoff=FrameStore.HANDOFF_LOCK_FREE)
+        state = store.universe(0)
+        self.assertEqual(state.reserve_sequences(), 1)
+        self.assertEqual(state.reserve_sequences(3), 4)
+        slot = state.open_slot()
+        self.assertEqual(slot.put_many([b"\x01", b"\x02"]), [5, 6])
+        self.assertEqual(store.update(0, b"\x03"), 7)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,180 @@
+#
+# DMX Emulator channel rules tests
+# Copyright © 2019  Dave Hocker (email: AtHomeX10@gmail.com)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the LICENSE file for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program (the LICENSE file).  If not, see <http://www.gnu.org/licenses/>.
+#
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from dmx_rules import RuleEngine, STATUS_PASSED, STATUS_FAILED, STATUS_PENDING
+
+
+def frame(*values, length=None):
+    """
+    A frame with the given values in channels 1, 2, ... padded with 0
+    to length channels
+    """
+    data = bytearray(values)
+    if length is not None:
+        data.extend(bytes(length - len(data)))
+    return bytes(data)
+
+
+class RulesTestCase(unittest.TestCase):
+    def run_frames(self, rules, frames, universe=0, interval=0.1, end=None):
+        """
+        Check frames received interval seconds apart, then finish
+        :return: The engine
+        """
+        engine = RuleEngine(rules)
+        now = 0.0
+        for sequence, dmx_data in enumerate(frames, start=1):
+            engine.check(universe, sequence, dmx_data, now)
+            now += interval
+        engine.finish(now if end is None else end)
+        return engine
+
+    def assert_statuses(self, engine, *statuses):
+        self.assertEqual([rule.status for rule in engine.rules], list(statuses))
+
+
+class TestAlwaysNever(RulesTestCase):
+    def test_always(self):
+        rules = [{"channels": "1-3", "always": ">= 10"},
+                 {"channels": "1-3", "always": ">= 5"},
+                 {"channels": "1-3", "always": "<= 200"}]
+        engine = self.run_frames(rules, [frame(10, 20, 30), frame(7, 20, 30)])
+        self.assert_statuses(engine, STATUS_FAILED, STATUS_PASSED, STATUS_PASSED)
+        failed = engine.rules[0]
+        self.assertEqual(failed.violations, 1)
+        self.assertEqual(failed.first_failure["frame"], 2)
+        self.assertEqual(dict(failed.first_failure["channels"]), {1: 7})
+        self.assertEqual(failed.frames_checked, 2)
+
+    def test_never_uses_complement(self):
+        rules = [{"channels": "1-2", "never": "> 200"},
+                 {"channels": "1-2", "never": "< 5"},
+                 {"channels": "1-2", "never": "== 0"}]
+        engine = self.run_frames(rules, [frame(100, 201), frame(100, 150)])
+        self.assert_statuses(engine, STATUS_FAILED, STATUS_PASSED, STATUS_PASSED)
+        rule = engine.rules[0]
+        self.assertEqual(rule.description, "never channels 1-2 > 200")
+        # The offending channels are those where the condition holds
+        self.assertEqual(dict(rule.first_failure["channels"]), {2: 201})
+        self.assertEqual(rule.violations, 1)
+
+    def test_short_frame_counts_as_zero(self):
+        rules = [{"channels": "1-4", "always": ">= 1"},
+                 {"channels": "5-6", "never": "> 0"},
+                 {"channels": "3-4", "never": "== 0"}]
+        engine = self.run_frames(rules, [frame(1, 2)])
+        self.assert_statuses(engine, STATUS_FAILED, STATUS_PASSED, STATUS_FAILED)
+        self.assertEqual(dict(engine.rules[0].first_failure["channels"]), {3: 0, 4: 0})
+
+    def test_not_equal_over_range(self):
+        rules = [{"channels": "1-5", "always": "!= 50"}]
+        # Neither the range's min nor its max is 50, a channel between is
+        engine = self.run_frames(rules, [frame(10, 20, 90), frame(10, 50, 90)])
+        self.assert_statuses(engine, STATUS_FAILED)
+        self.assertEqual(engine.rules[0].first_failure["frame"], 2)
+        self.assertEqual(dict(engine.rules[0].first_failure["channels"]), {2: 50})
+        # Channels past the end are 0
+        engine = self.run_frames([{"channels": "1-5", "always": "!= 0"}], [frame(10, 20, 90)])
+        self.assert_statuses(engine, STATUS_FAILED)
+        engine = self.run_frames([{"channels": "1-3", "always": "!= 0"}], [frame(10, 20, 90)])
+        self.assert_statuses(engine, STATUS_PASSED)
+
+    def test_no_frames_checked(self):
+        rules = [{"universe": 1, "channels": "1", "always": ">= 0"},
+                 {"universe": 0, "channels": "1", "always": ">= 0"}]
+        engine = self.run_frames(rules, [frame(1)], universe=0)
+        self.assert_statuses(engine, STATUS_FAILED, STATUS_PASSED)
+        self.assertEqual(engine.rules[0].message, "no frames checked")
+        self.assertFalse(engine.passed)
+
+
+class TestExpect(RulesTestCase):
+    def test_frame_trigger(self):
+        rules = [{"channels": "1", "expect": "== 255", "within": 1.0, "after": {"frame": 3}}]
+        # Reached before the trigger does not count
+        engine = self.run_frames(rules, [frame(255), frame(0), frame(0), frame(0), frame(255)])
+        self.assert_statuses(engine, STATUS_PASSED)
+        rule = engine.rules[0]
+        self.assertEqual(rule.triggered_frame, 3)
+        self.assertEqual(rule.reached_frame, 5)
+        self.assertAlmostEqual(rule.latency, 0.2)
+
+    def test_channel_trigger(self):
+        rules = [{"channels": "1-2", "expect": "== 0", "within": 0.5,
+                  "after": {"channels": "3", "when": "== 255"}}]
+        engine = self.run_frames(rules, [frame(0, 0, 0), frame(9, 9, 255), frame(9, 0, 0), frame(0, 0, 0)])
+        self.assert_statuses(engine, STATUS_PASSED)
+        self.assertEqual(engine.rules[0].triggered_frame, 2)
+        self.assertEqual(engine.rules[0].reached_frame, 4)
+
+    def test_first_frame_trigger(self):
+        rules = [{"channels": "1", "expect": "> 0", "within": 1.0}]
+        engine = self.run_frames(rules, [frame(0), frame(1)])
+        self.assert_statuses(engine, STATUS_PASSED)
+        self.assertEqual(engine.rules[0].triggered_frame, 1)
+
+    def test_expired_on_next_frame(self):
+        rules = [{"channels": "1", "expect": "== 255", "within": 0.15}]
+        engine = self.run_frames(rules, [frame(0), frame(0), frame(255)])
+        self.assert_statuses(engine, STATUS_FAILED)
+        self.assertEqual(engine.rules[0].message, "not reached within 0.15 s of frame 1")
+
+    def test_check_deadlines(self):
+        engine = RuleEngine([{"channels": "1", "expect": "== 255", "within": 1.0}])
+        engine.check(0, 1, frame(0), 10.0)
+        engine.check_deadlines(10.5)
+        self.assert_statuses(engine, STATUS_PENDING)
+        engine.check_deadlines(11.5)
+        self.assert_statuses(engine, STATUS_FAILED)
+        # A later frame does not change the result
+        engine.check(0, 2, frame(255), 11.6)
+        engine.finish(12.0)
+        self.assert_statuses(engine, STATUS_FAILED)
+        self.assertEqual(engine.rules[0].message, "not reached within 1.0 s of frame 1")
+
+    def test_finish(self):
+        rules = [{"channels": "1", "expect": "== 255", "within": 5.0},
+                 {"channels": "1", "expect": "== 255", "within": 5.0, "after": {"frame": 10}},
+                 {"channels": "1", "expect": "== 255", "within": 0.5}]
+        engine = self.run_frames(rules, [frame(0), frame(0)], end=1.0)
+        self.assert_statuses(engine, STATUS_FAILED, STATUS_FAILED, STATUS_FAILED)
+        self.assertTrue(engine.rules[0].message.startswith("not reached before the run ended"))
+        self.assertEqual(engine.rules[1].message, "never triggered")
+        # The deadline had passed by the end of the run
+        self.assertEqual(engine.rules[2].message, "not reached within 0.5 s of frame 1")
+
+
+class TestCompile(unittest.TestCase):
+    def test_invalid_rules(self):
+        for spec in ({"channels": "0-3", "always": "> 1"},
+                     {"channels": "4-3", "always": "> 1"},
+                     {"channels": "1", "always": "=> 1"},
+                     {"channels": "1", "always": "> 256"},
+                     {"channels": "1", "always": "> 1", "never": "> 2"},
+                     {"channels": "1", "expect": "> 1"}):
+            with self.assertRaises(ValueError):
+                RuleEngine([spec])
+
+
+if __name__ == "__main__":
+    unittest.main()
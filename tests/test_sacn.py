@@ -0,0 +1,192 @@
+#
+# DMX Emulator sACN receiver tests
+# Copyright © 2019  Dave Hocker (email: AtHomeX10@gmail.com)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the LICENSE file for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program (the LICENSE file).  If not, see <http://www.gnu.org/licenses/>.
+#
+
+import os
+import random
+import sys
+import threading
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from dmxsocketserver.DatagramServer import DatagramServer
+from dmxsocketserver.SACNServer import SACNServer, build_e131, htp_max, MERGE_HTP, MERGE_LTP, \
+    OPTION_PREVIEW_DATA, OPTION_STREAM_TERMINATED, SOURCE_TIMEOUT
+
+CID_A = b"A" * 16
+CID_B = b"B" * 16
+
+
+class RecordingHandler:
+    """
+    Keeps every merged frame, optionally failing for some universes
+    """
+
+    def __init__(self, failing=()):
+        self.frames = []
+        self.failing = failing
+
+    def execute_universe(self, universe, dmx_data):
+        if universe in self.failing:
+            raise RuntimeError("universe {0} failed".format(universe))
+        self.frames.append((universe, bytes(dmx_data)))
+
+
+class TestHTPMax(unittest.TestCase):
+    def test_matches_bytewise_max(self):
+        rng = random.Random(1)
+        for _ in range(20):
+            a = bytes(rng.choice((0, 1, 127, 128, 255, rng.randrange(256))) for _ in range(512))
+            b = bytes(rng.choice((0, 1, 127, 128, 255, rng.randrange(256))) for _ in range(512))
+            merged = htp_max(int.from_bytes(a, "big"), int.from_bytes(b, "big")).to_bytes(512, "big")
+            self.assertEqual(merged, bytes(max(x, y) for x, y in zip(a, b)))
+
+
+class TestSACNServer(unittest.TestCase):
+    def setUp(self):
+        self.servers = []
+
+    def tearDown(self):
+        for server in self.servers:
+            server.server_close()
+
+    def create(self, merge_mode=MERGE_HTP, failing=()):
+        handler = RecordingHandler(failing)
+        # No universes, so no multicast groups are joined
+        server = SACNServer(("127.0.0.1", 0), handler, [], merge_mode=merge_mode)
+        self.servers.append(server)
+        return server, handler
+
+    @staticmethod
+    def receive(server, *packets):
+        for packet in packets:
+            server.process_packet(memoryview(packet))
+        server.end_batch()
+
+    def test_single_source_passes_through(self):
+        server, handler = self.create()
+        self.receive(server, build_e131(CID_A, 1, b"\x01\x02\x03"))
+        self.assertEqual(handler.frames, [(1, b"\x01\x02\x03")])
+        # Nothing changed, nothing is passed on
+        server.end_batch()
+        self.assertEqual(len(handler.frames), 1)
+
+    def test_htp_merge(self):
+        server, handler = self.create(MERGE_HTP)
+        self.receive(server, build_e131(CID_A, 1, b"\x10\x00\x30"),
+                     build_e131(CID_B, 1, b"\x00\x20\x05\x40"))
+        self.assertEqual(handler.frames[-1], (1, b"\x10\x20\x30\x40"))
+
+    def test_ltp_merge(self):
+        server, handler = self.create(MERGE_LTP)
+        self.receive(server, build_e131(CID_A, 1, b"\x10\x00\x30"),
+                     build_e131(CID_B, 1, b"\x00\x20"))
+        self.assertEqual(handler.frames[-1], (1, b"\x00\x20"))
+        self.receive(server, build_e131(CID_A, 1, b"\x11\x00\x30", sequence=1))
+        self.assertEqual(handler.frames[-1], (1, b"\x11\x00\x30"))
+
+    def test_highest_priority_wins(self):
+        server, handler = self.create(MERGE_HTP)
+        self.receive(server, build_e131(CID_A, 1, b"\xff\xff", priority=100),
+                     build_e131(CID_B, 1, b"\x01\x02", priority=150))
+        self.assertEqual(handler.frames[-1], (1, b"\x01\x02"))
+        # Equal priority takes part in the merge again
+        self.receive(server, build_e131(CID_A, 1, b"\xff\x00", priority=150, sequence=1))
+        self.assertEqual(handler.frames[-1], (1, b"\xff\x02"))
+
+    def test_sequence_check(self):
+        server, handler = self.create()
+        self.receive(server, build_e131(CID_A, 1, b"\x01", sequence=10))
+        # A repeat and a packet up to 20 behind are discarded
+        self.receive(server, build_e131(CID_A, 1, b"\x02", sequence=10),
+                     build_e131(CID_A, 1, b"\x03", sequence=250))
+        self.assertEqual(handler.frames, [(1, b"\x01")])
+        # Further behind is taken as a restarted source, and the
+        # sequence wraps
+        self.receive(server, build_e131(CID_A, 1, b"\x04", sequence=200))
+        self.receive(server, build_e131(CID_A, 1, b"\x05", sequence=5))
+        self.assertEqual(handler.frames, [(1, b"\x01"), (1, b"\x04"), (1, b"\x05")])
+
+    def test_preview_and_invalid_packets_are_ignored(self):
+        server, handler = self.create()
+        self.receive(server, build_e131(CID_A, 1, b"\x01", options=OPTION_PREVIEW_DATA),
+                     b"not an sACN packet")
+        self.assertEqual(handler.frames, [])
+        self.assertEqual(server.packets_rejected, 1)
+
+    def test_stream_terminated_drops_source(self):
+        server, handler = self.create()
+        self.receive(server, build_e131(CID_A, 1, b"\x10\x10"), build_e131(CID_B, 1, b"\x20"))
+        self.receive(server, build_e131(CID_B, 1, b"\x20", sequence=1, options=OPTION_STREAM_TERMINATED))
+        self.assertEqual(handler.frames[-1], (1, b"\x10\x10"))
+
+    def test_source_timeout(self):
+        server, handler = self.create()
+        self.receive(server, build_e131(CID_A, 1, b"\x10\x10"), build_e131(CID_B, 1, b"\x20"))
+        self.assertEqual(handler.frames[-1], (1, b"\x20\x10"))
+        server._universes[1].sources[CID_B].last_seen -= SOURCE_TIMEOUT + 1.0
+        server.idle()
+        self.assertEqual(handler.frames[-1], (1, b"\x10\x10"))
+        self.assertEqual(list(server._universes[1].sources), [CID_A])
+
+    def test_failing_universe_does_not_skip_others(self):
+        server, handler = self.create(failing=(2,))
+        self.receive(server, build_e131(CID_A, 1, b"\x01"), build_e131(CID_A, 2, b"\x02"),
+                     build_e131(CID_A, 3, b"\x03"))
+        self.assertEqual(handler.frames, [(1, b"\x01"), (3, b"\x03")])
+        # A source expiring on the failing universe does not raise from idle
+        server._universes[2].sources[CID_A].last_seen -= SOURCE_TIMEOUT + 1.0
+        self.receive(server, build_e131(CID_B, 2, b"\x04"))
+        server.idle()
+
+
+class FailingIdleServer(DatagramServer):
+    poll_interval = 0.01
+
+    def __init__(self, server_address):
+        super(FailingIdleServer, self).__init__(server_address)
+        self.idle_calls = 0
+
+    def process_packet(self, packet):
+        pass
+
+    def idle(self):
+        self.idle_calls += 1
+        raise RuntimeError("idle failed")
+
+
+class TestDatagramServer(unittest.TestCase):
+    def test_idle_exception_keeps_serving(self):
+        server = FailingIdleServer(("127.0.0.1", 0))
+        thread = threading.Thread(target=server.serve_forever)
+        thread.start()
+        try:
+            for _ in range(500):
+                if server.idle_calls >= 3:
+                    break
+                threading.Event().wait(0.01)
+            self.assertGreaterEqual(server.idle_calls, 3)
+            self.assertTrue(thread.is_alive())
+        finally:
+            server.shutdown()
+            thread.join(5.0)
+            server.server_close()
+        self.assertFalse(thread.is_alive())
+
+
+if __name__ == "__main__":
+    unittest.main()